@@ -22,6 +22,7 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from models.base import Base
 from models.bitcoin_data import Block, Tx, Output, Input, Address
+from models.graph_data import GraphPopulationCheckpoint
 
 from alembic import context
 
@@ -0,0 +1,90 @@
+"""Store transaction hashes and addresses as compact binary
+
+Revision ID: 3c9f1e7a5b2d
+Revises: be187cc2670a
+Create Date: 2024-02-12 14:03:27.118420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from models.encoding import encode_address, decode_address
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9f1e7a5b2d'
+down_revision: Union[str, None] = 'be187cc2670a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# number of rows converted per statement
+BATCH_SIZE = 100_000
+
+
+def _id_batches(connection, table: str):
+    lowest, highest = connection.execute(sa.text(f"SELECT MIN(id), MAX(id) FROM {table}")).one()
+    if lowest is None:
+        return
+    for start in range(lowest, highest + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE - 1
+
+
+def _convert_addresses(connection, source: str, target: str, convert):
+    for start, end in _id_batches(connection, 'addresses'):
+        rows = connection.execute(
+            sa.text(f"SELECT id, {source} FROM addresses WHERE id BETWEEN :start AND :end AND {source} IS NOT NULL"),
+            {'start': start, 'end': end}
+        ).all()
+        if rows:
+            connection.execute(
+                sa.text(f"UPDATE addresses SET {target} = :value WHERE id = :id"),
+                [{'id': id_, 'value': convert(value)} for id_, value in rows]
+            )
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+
+    op.add_column('transactions', sa.Column('hash_bin', sa.LargeBinary(length=32), nullable=True))
+    op.add_column('addresses', sa.Column('addr_bin', sa.LargeBinary(), nullable=True))
+
+    # hex decoding can be done entirely by postgres
+    for start, end in _id_batches(connection, 'transactions'):
+        connection.execute(
+            sa.text("UPDATE transactions SET hash_bin = decode(hash, 'hex') WHERE id BETWEEN :start AND :end"),
+            {'start': start, 'end': end}
+        )
+
+    # base58check decoding has to happen in python
+    _convert_addresses(connection, 'addr', 'addr_bin', encode_address)
+
+    op.drop_index('ix_addresses_addr', table_name='addresses')
+    op.drop_column('transactions', 'hash')
+    op.drop_column('addresses', 'addr')
+    op.alter_column('transactions', 'hash_bin', new_column_name='hash')
+    op.alter_column('addresses', 'addr_bin', new_column_name='addr')
+    op.create_index(op.f('ix_addresses_addr'), 'addresses', ['addr'], unique=False)
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+
+    op.add_column('transactions', sa.Column('hash_str', sa.String(), nullable=True))
+    op.add_column('addresses', sa.Column('addr_str', sa.String(), nullable=True))
+
+    for start, end in _id_batches(connection, 'transactions'):
+        connection.execute(
+            sa.text("UPDATE transactions SET hash_str = encode(hash, 'hex') WHERE id BETWEEN :start AND :end"),
+            {'start': start, 'end': end}
+        )
+
+    _convert_addresses(connection, 'addr', 'addr_str', decode_address)
+
+    op.drop_index('ix_addresses_addr', table_name='addresses')
+    op.drop_column('transactions', 'hash')
+    op.drop_column('addresses', 'addr')
+    op.alter_column('transactions', 'hash_str', new_column_name='hash')
+    op.alter_column('addresses', 'addr_str', new_column_name='addr')
+    op.create_index(op.f('ix_addresses_addr'), 'addresses', ['addr'], unique=False)
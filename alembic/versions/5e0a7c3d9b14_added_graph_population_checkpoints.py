@@ -0,0 +1,33 @@
+"""Added graph population checkpoints
+
+Revision ID: 5e0a7c3d9b14
+Revises: 8d41b6c2e9f0
+Create Date: 2024-02-26 14:02:51.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0a7c3d9b14'
+down_revision: Union[str, None] = '8d41b6c2e9f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('graph_population_checkpoints',
+                    sa.Column('element_type', sa.String(length=16), nullable=False),
+                    sa.Column('block_height', sa.Integer(), nullable=False),
+                    sa.Column('output_id', sa.BigInteger(), nullable=False),
+                    sa.Column('pending_output_id', sa.BigInteger(), nullable=True),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('element_type')
+                    )
+
+
+def downgrade() -> None:
+    op.drop_table('graph_population_checkpoints')
@@ -0,0 +1,41 @@
+"""Added outputs.address_addr staging column
+
+Revision ID: 8d41b6c2e9f0
+Revises: 3c9f1e7a5b2d
+Create Date: 2024-02-19 10:41:08.532964
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41b6c2e9f0'
+down_revision: Union[str, None] = '3c9f1e7a5b2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# number of output IDs backfilled per statement
+BATCH_SIZE = 1_000_000
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+
+    op.add_column('outputs', sa.Column('address_addr', sa.LargeBinary(), nullable=True))
+
+    # backfill the staging column from the addresses already assigned
+    lowest, highest = connection.execute(sa.text("SELECT MIN(id), MAX(id) FROM outputs")).one()
+    if lowest is not None:
+        for start in range(lowest, highest + 1, BATCH_SIZE):
+            connection.execute(
+                sa.text("UPDATE outputs SET address_addr = addresses.addr FROM addresses"
+                        " WHERE outputs.address_id = addresses.id AND outputs.id BETWEEN :start AND :end"),
+                {'start': start, 'end': start + BATCH_SIZE - 1}
+            )
+
+
+def downgrade() -> None:
+    op.drop_column('outputs', 'address_addr')
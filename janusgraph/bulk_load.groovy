@@ -0,0 +1,85 @@
+// ./janusgraph/bulk_load.groovy
+//
+// Bulk load files written by src/graph/bulk_export.py into JanusGraph.
+//
+// The gremlin server holds the berkeleyje lock, so stop it before loading, then run:
+//   ./bin/gremlin.sh -e /opt/janusgraph/bulk_load.groovy /path/to/export [storage directory]
+//
+// Vertices are created with the IDs assigned by the exporter, which needs
+// graph.set-vertex-id=true. It is a local option, and the graph is opened with it set
+// below, so it only applies while loading. The gremlin server in docker-compose.yml
+// leaves it off, since with it every vertex added through gremlin, e.g. by
+// graph_populate.py, would have to be given an ID.
+// Run create_index.groovy first so that the property keys and indexes exist.
+
+import org.janusgraph.core.JanusGraphFactory
+import groovy.json.JsonSlurper
+
+exportDir = new File(args[0])
+storageDirectory = args.length > 1 ? args[1] : '/var/lib/janusgraph/data'
+
+// number of elements added per transaction
+commitSize = 50000
+
+graph = JanusGraphFactory.build()
+    .set('storage.backend', 'berkeleyje')
+    .set('storage.directory', storageDirectory)
+    // skip consistency checks and locking; the exported data is known to be consistent
+    .set('storage.batch-loading', true)
+    // reserve large blocks of IDs so the loader doesn't keep asking for more
+    .set('ids.block-size', 10000000)
+    .set('graph.set-vertex-id', true)
+    .open()
+
+idManager = graph.getIDManager()
+manifest = new JsonSlurper().parse(new File(exportDir, 'manifest.json'))
+
+def eachRow(File file, Closure closure) {
+    file.withReader { reader ->
+        reader.readLine() // header
+        String line
+        while ((line = reader.readLine()) != null) {
+            closure(line.split(',', -1))
+        }
+    }
+}
+
+count = 0
+def committed() {
+    count++
+    if (count % commitSize == 0) {
+        graph.tx().commit()
+    }
+}
+
+start = System.currentTimeMillis()
+
+manifest.vertices.each { shard ->
+    eachRow(new File(exportDir, shard.file)) { row ->
+        vertex = graph.addVertex(T.id, idManager.toVertexId(row[0] as long), T.label, 'output')
+        vertex.property('output_id', row[1] as int)
+        if (row[2]) {
+            vertex.property('address_id', row[2] as int)
+        }
+        vertex.property('value', row[3] as double)
+        vertex.property('block_height', row[4] as int)
+        committed()
+    }
+    graph.tx().commit()
+    println "Loaded ${shard.rows} vertices from ${shard.file}"
+}
+
+manifest.edges.each { shard ->
+    eachRow(new File(exportDir, shard.file)) { row ->
+        outVertex = graph.vertices(idManager.toVertexId(row[0] as long)).next()
+        inVertex = graph.vertices(idManager.toVertexId(row[1] as long)).next()
+        outVertex.addEdge('sent', inVertex, 'value', row[2] as double)
+        committed()
+    }
+    graph.tx().commit()
+    println "Loaded ${shard.rows} edges from ${shard.file}"
+}
+
+println "Loaded ${count} elements in ${(System.currentTimeMillis() - start) / 1000} seconds"
+
+graph.close()
@@ -16,3 +16,21 @@
 
 :> graph.tx().rollback(); mgmt = graph.openManagement(); idKey = mgmt.containsPropertyKey('output_id') ? mgmt.getPropertyKey('output_id') : mgmt.makePropertyKey('output_id').dataType(Integer.class).make(); addressKey = mgmt.containsPropertyKey('address_id') ? mgmt.getPropertyKey('address_id') : mgmt.makePropertyKey('address_id').dataType(Integer.class).make(); if (!mgmt.containsGraphIndex('byOutputIdComposite')) { mgmt.buildIndex('byOutputIdComposite', Vertex.class).addKey(idKey).buildCompositeIndex(); }; if (!mgmt.containsGraphIndex('byAddressIdComposite')) { mgmt.buildIndex('byAddressIdComposite', Vertex.class).addKey(addressKey).buildCompositeIndex(); }; ownerId = mgmt.containsPropertyKey('owner_id') ? mgmt.getPropertyKey('owner_id') : mgmt.makePropertyKey('owner_id').dataType(Integer.class).make(); sent = mgmt.containsEdgeLabel('sent') ? mgmt.getEdgeLabel('sent') : mgmt.makeEdgeLabel('sent').multiplicity(SIMPLE).make(); if (!mgmt.containsGraphIndex('byOwnerIdComposite')) { mgmt.buildIndex('byOwnerIdComposite', Vertex.class).addKey(ownerId).buildCompositeIndex(); }; mgmt.commit();
 
+
+// output vertices carry their value, with the 'value' key sent edges use, and their block height:
+// create vertex property 'block_height' if it doesn't exist
+
+:> graph.tx().rollback(); mgmt = graph.openManagement(); if (!mgmt.containsPropertyKey('value')) { mgmt.makePropertyKey('value').dataType(Double.class).make(); }; if (!mgmt.containsPropertyKey('block_height')) { mgmt.makePropertyKey('block_height').dataType(Integer.class).make(); }; mgmt.commit();
+
+
+// for the tx projection (see src/graph/projection.py):
+// create vertex property 'tx_id' and a composite index on it if they don't exist
+// create spent and created edge labels if they don't exist
+
+:> graph.tx().rollback(); mgmt = graph.openManagement(); txIdKey = mgmt.containsPropertyKey('tx_id') ? mgmt.getPropertyKey('tx_id') : mgmt.makePropertyKey('tx_id').dataType(Long.class).make(); if (!mgmt.containsGraphIndex('byTxIdComposite')) { mgmt.buildIndex('byTxIdComposite', Vertex.class).addKey(txIdKey).buildCompositeIndex(); }; spent = mgmt.containsEdgeLabel('spent') ? mgmt.getEdgeLabel('spent') : mgmt.makeEdgeLabel('spent').multiplicity(SIMPLE).make(); created = mgmt.containsEdgeLabel('created') ? mgmt.getEdgeLabel('created') : mgmt.makeEdgeLabel('created').multiplicity(SIMPLE).make(); mgmt.commit();
+
+// for the address flow graph:
+// create address vertex label and a composite index on 'address_id' for address vertices only, if they don't exist
+// create flow edge label and its 'tx_count', 'first_height' and 'last_height' properties if they don't exist
+
+:> graph.tx().rollback(); mgmt = graph.openManagement(); addressKey = mgmt.getPropertyKey('address_id'); addressLabel = mgmt.containsVertexLabel('address') ? mgmt.getVertexLabel('address') : mgmt.makeVertexLabel('address').make(); if (!mgmt.containsGraphIndex('byAddressVertexComposite')) { mgmt.buildIndex('byAddressVertexComposite', Vertex.class).addKey(addressKey).indexOnly(addressLabel).unique().buildCompositeIndex(); }; flow = mgmt.containsEdgeLabel('flow') ? mgmt.getEdgeLabel('flow') : mgmt.makeEdgeLabel('flow').multiplicity(SIMPLE).make(); txCount = mgmt.containsPropertyKey('tx_count') ? mgmt.getPropertyKey('tx_count') : mgmt.makePropertyKey('tx_count').dataType(Integer.class).make(); firstHeight = mgmt.containsPropertyKey('first_height') ? mgmt.getPropertyKey('first_height') : mgmt.makePropertyKey('first_height').dataType(Integer.class).make(); lastHeight = mgmt.containsPropertyKey('last_height') ? mgmt.getPropertyKey('last_height') : mgmt.makePropertyKey('last_height').dataType(Integer.class).make(); mgmt.commit();
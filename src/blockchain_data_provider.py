@@ -14,17 +14,38 @@ import asyncio
 import aiohttp
 import requests
 import numpy as np
-from sqlalchemy import tuple_
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import tuple_, select, inspect, any_, bindparam, cast, Float
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, joinedload, selectinload, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import text
 from sqlalchemy.sql.expression import func
 
 from aio_utils import asyncio_run, asyncio_gather
-from models.bitcoin_data import Block, Tx, Input, Output, Address, DUPLICATE_TRANSACTIONS
+from models.bitcoin_data import (
+    Block,
+    Tx,
+    Input,
+    Output,
+    Address,
+    AddressOwnerAssociation,
+    ManualProportion,
+    DUPLICATE_TRANSACTIONS
+)
 
 
 BLOCKCHAIN_INFO_BLOCK_ENDPOINT = "https://blockchain.info/rawblock/"
 BLOCKCHAIN_INFO_TX_ENDPOINT = "https://blockchain.info/rawtx/"
 
+# Tables holding populated blockchain data, in the order they must be emptied
+BLOCKCHAIN_TABLES = ['inputs', 'outputs', 'transactions', 'blocks', 'addresses']
+
+# Maximum number of keys sent in one batch lookup query
+LOOKUP_CHUNK_SIZE = 10_000
+
+# Key in Session.info where batch lookups cache the objects they load
+LOOKUP_CACHE_KEY = 'blockchain_lookup_cache'
+
 
 def chunked_ranges(lowest, highest, buffer: int = 100) -> list[tuple[int, int]]:
 
@@ -54,6 +75,18 @@ def chunked_indices(items: list, buffer: int):
     return [(start, end + 1) for (start, end) in chunked_ranges(0, len(items) - 1, buffer)]
 
 
+def any_of(session: Session, column, values: list):
+    """Filter clause matching rows where the column is one of the given values.
+
+    On postgres, this is "column = ANY(:values)" with the values sent as a single
+    array parameter, so the statement stays the same size regardless of how many
+    values there are. Other databases fall back to IN.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        return column == any_(bindparam(None, list(values), type_=ARRAY(column.type)))
+    return column.in_(list(values))
+
+
 class InvalidDataError(Exception):
     pass
 
@@ -573,75 +606,124 @@ class PersistentBlockchainAPIData(BlockchainDataProviderADT):
         self.population_stats = self.PopulationStatistics()
 
     def get_block(self, session: Session, height: int) -> Block:
-        block = session.query(Block) \
-            .options(
-                joinedload(Block.transactions)
-                .joinedload(Tx.inputs)
-                .joinedload(Input.prev_out)
-                .joinedload(Output.address),
-                joinedload(Block.transactions)
-                .joinedload(Tx.outputs)
-                .joinedload(Output.address)
-        ) \
-            .filter_by(height=height).first()
-
-        if block:
-            return block
-        # If block not found in the database, raise error
-        raise FileNotFoundError(f"Block with height {height} not found in database")
+        block = session.query(Block).filter_by(height=height).first()
 
-    def get_tx(self, session: Session, tx_id: int = None, tx_hash: str = None) -> Tx:
-        options = (
-            joinedload(Tx.inputs)
-            .joinedload(Input.prev_out)
-            .joinedload(Output.address),
-            joinedload(Tx.outputs)
-            .joinedload(Output.address)
-        )
+        if not block:
+            # If block not found in the database, raise error
+            raise FileNotFoundError(f"Block with height {height} not found in database")
+
+        txs = self.__load_txs(session, Tx.block_height == height)
+        set_committed_value(block, 'transactions', txs)
+        for tx in txs:
+            set_committed_value(tx, 'block', block)
 
+        return block
+
+    def __load_txs(self, session: Session, *tx_criteria, buffer: int = 10_000) -> list[Tx]:
+        """Load all transactions matching the criteria, with their inputs, previous outputs,
+        outputs, and addresses.
+
+        Joined eager loading of both inputs and outputs makes the database return
+        inputs * outputs rows per transaction. Instead, each kind of object is
+        streamed in its own query, and the relationships are assembled here.
+        This is a fixed number of queries, and the number of rows grows linearly
+        with the number of inputs and outputs.
+
+        Returns:
+            list[Tx]: Transactions ordered by block height and index in block.
+        """
+        txs = list(session.query(Tx)
+                          .filter(*tx_criteria)
+                          .order_by(Tx.block_height, Tx.index_in_block)
+                          .yield_per(buffer))
+        if not txs:
+            return txs
+
+        # each query is streamed straight into the lookups the relationships are assembled from
+        tx_dict = {tx.id: tx for tx in txs}
+        inputs_by_tx = {tx.id: [] for tx in txs}
+        outputs_by_tx = {tx.id: [] for tx in txs}
+        output_dict = {}
+
+        prev_outs = session.query(Output)\
+                           .join(Input, Input.prev_out_id == Output.id)\
+                           .join(Tx, Input.tx_id == Tx.id)\
+                           .filter(*tx_criteria)\
+                           .yield_per(buffer)
+        for output in prev_outs:
+            output_dict[output.id] = output
+
+        outputs = session.query(Output)\
+                         .join(Tx, Output.tx_id == Tx.id)\
+                         .filter(*tx_criteria)\
+                         .order_by(Output.tx_id, Output.index_in_tx)\
+                         .yield_per(buffer)
+        for output in outputs:
+            output_dict[output.id] = output
+            set_committed_value(output, 'transaction', tx_dict[output.tx_id])
+            outputs_by_tx[output.tx_id].append(output)
+
+        output_address_ids = select(Output.address_id)\
+            .join(Tx, Output.tx_id == Tx.id)\
+            .where(*tx_criteria)
+        prev_out_address_ids = select(Output.address_id)\
+            .join(Input, Input.prev_out_id == Output.id)\
+            .join(Tx, Input.tx_id == Tx.id)\
+            .where(*tx_criteria)
+        addresses = session.query(Address)\
+                           .filter(Address.id.in_(output_address_ids) | Address.id.in_(prev_out_address_ids))\
+                           .yield_per(buffer)
+        address_dict = {address.id: address for address in addresses}
+        for output in output_dict.values():
+            set_committed_value(output, 'address', address_dict.get(output.address_id))
+
+        inputs = session.query(Input)\
+                        .join(Tx, Input.tx_id == Tx.id)\
+                        .filter(*tx_criteria)\
+                        .order_by(Input.tx_id, Input.index_in_tx)\
+                        .yield_per(buffer)
+        for input in inputs:
+            set_committed_value(input, 'transaction', tx_dict[input.tx_id])
+            set_committed_value(input, 'prev_out', output_dict.get(input.prev_out_id))
+            inputs_by_tx[input.tx_id].append(input)
+
+        for tx in txs:
+            set_committed_value(tx, 'inputs', inputs_by_tx[tx.id])
+            set_committed_value(tx, 'outputs', outputs_by_tx[tx.id])
+
+        return txs
+
+    def get_tx(self, session: Session, tx_id: int = None, tx_hash: str = None) -> Tx:
         if not (tx_id is not None or tx_hash is not None):
             raise ValueError("Must provide either tx_id or tx_hash")
         if tx_id:
-            tx_obj = session.query(Tx).options(
-                options
-            ).filter_by(id=tx_id).first()
+            txs = self.__load_txs(session, Tx.id == tx_id)
 
-            if not tx_obj:
+            if not txs:
                 raise FileNotFoundError(f"Transaction with ID {tx_id} not found in database")
         else:
-            tx_obj = session.query(Tx).options(
-                options
-            ).filter_by(hash=tx_hash).first()
+            txs = self.__load_txs(session, Tx.hash == tx_hash)
 
-            if not tx_obj:
+            if not txs:
                 raise FileNotFoundError(f"Transaction with hash {tx_hash} not found in database")
 
-        return tx_obj
+        return txs[0]
 
     def get_txs_for_blocks(self, session: Session, min_height: int, max_height: int, buffer: int = 100) -> Generator[Tx, None, None]:
 
-        options = (
-            joinedload(Tx.inputs)
-            .joinedload(Input.prev_out),
-            joinedload(Tx.outputs)
-            .joinedload(Output.address)
-        )
+        # Transaction IDs are assigned in chain order, so the transactions in a height range
+        # normally have a contiguous range of IDs to page through. The height criteria leave out
+        # any others in the range, e.g. transactions inserted again after delete_above_height.
+        height_criteria = (Tx.block_height <= max_height, Tx.block_height >= min_height)
+        lowest_tx_id, highest_tx_id = session.query(func.min(Tx.id), func.max(Tx.id))\
+                                             .filter(*height_criteria)\
+                                             .one()
+        if lowest_tx_id is None:
+            return
 
-        tx_count = session.query(Tx.id)\
-                          .filter(Tx.block_height <= max_height, Tx.block_height >= min_height)\
-                          .count()
-
-        # Iterate through the blocks in the specified range
-        for offset in range(0, tx_count, buffer):
-            # Fetch transactions in chunks
-            txs = session.query(Tx)\
-                         .options(options)\
-                         .filter(Tx.block_height <= max_height, Tx.block_height >= min_height)\
-                         .order_by(Tx.id)\
-                         .offset(offset)\
-                         .limit(buffer)\
-                         .all()
-            for tx in txs:
+        # Fetch transactions in chunks
+        for start, end in chunked_ranges(lowest_tx_id, highest_tx_id, buffer):
+            for tx in self.__load_txs(session, Tx.id >= start, Tx.id <= end, *height_criteria):
                 yield tx
 
     def get_outputs_for_blocks(self, session: Session, min_height: int, max_height: int, buffer: int = 100) -> Generator[Output, None, None]:
@@ -655,6 +737,7 @@ class PersistentBlockchainAPIData(BlockchainDataProviderADT):
             # Fetch outputs in batches
             outputs_batch = session.query(Output) \
                                    .join(Tx, Output.tx_id == Tx.id) \
+                                   .options(contains_eager(Output.transaction)) \
                                    .filter(Tx.block_height >= min_height, Tx.block_height <= max_height) \
                                    .order_by(Output.id) \
                                    .offset(offset).limit(buffer).all()
@@ -662,6 +745,56 @@ class PersistentBlockchainAPIData(BlockchainDataProviderADT):
             for output in outputs_batch:
                 yield output
 
+    def get_address_flows(self, session: Session, min_height: int, max_height: int) -> list:
+        """Aggregate the haircut value sent between addresses by transactions in a height range.
+
+        The haircut value from an input to an output is input value / tx input value * output value,
+        so summed over a transaction's inputs from one address and outputs to another, it is
+        (value the first address spent) / tx input value * (value the second address received).
+        This is summed per pair of addresses in SQL, so no edges between outputs are needed.
+        Value an address sends back to itself is left out.
+
+        Returns:
+            list: Rows of (from_address_id, to_address_id, value, tx_count, first_height, last_height).
+        """
+        tx_criteria = (Tx.block_height >= min_height, Tx.block_height <= max_height, Tx.index_in_block > 0)
+
+        tx_input_values = select(Input.tx_id, func.sum(Output.value).label('value'))\
+            .join(Output, Input.prev_out_id == Output.id)\
+            .join(Tx, Input.tx_id == Tx.id)\
+            .where(*tx_criteria)\
+            .group_by(Input.tx_id)\
+            .subquery()
+        spent = select(Input.tx_id, Output.address_id, func.sum(Output.value).label('value'))\
+            .join(Output, Input.prev_out_id == Output.id)\
+            .join(Tx, Input.tx_id == Tx.id)\
+            .where(*tx_criteria, Output.address_id.isnot(None))\
+            .group_by(Input.tx_id, Output.address_id)\
+            .subquery()
+        received = select(Output.tx_id, Output.address_id, func.sum(Output.value).label('value'))\
+            .join(Tx, Output.tx_id == Tx.id)\
+            .where(*tx_criteria, Output.address_id.isnot(None))\
+            .group_by(Output.tx_id, Output.address_id)\
+            .subquery()
+
+        haircut_value = cast(spent.c.value, Float) / tx_input_values.c.value * received.c.value
+        flows = select(
+            spent.c.address_id.label('from_address_id'),
+            received.c.address_id.label('to_address_id'),
+            func.sum(haircut_value).label('value'),
+            func.count(spent.c.tx_id).label('tx_count'),
+            func.min(Tx.block_height).label('first_height'),
+            func.max(Tx.block_height).label('last_height')
+        )\
+            .join(received, received.c.tx_id == spent.c.tx_id)\
+            .join(tx_input_values, tx_input_values.c.tx_id == spent.c.tx_id)\
+            .join(Tx, Tx.id == spent.c.tx_id)\
+            .where(tx_input_values.c.value > 0, spent.c.address_id != received.c.address_id)\
+            .group_by(spent.c.address_id, received.c.address_id)\
+            .order_by(spent.c.address_id, received.c.address_id)
+
+        return session.execute(flows).all()
+
     def get_input(self, session: Session, input_id: int) -> Input:
         input_obj = session.query(Input).options(
             joinedload(Input.prev_out)
@@ -696,6 +829,100 @@ class PersistentBlockchainAPIData(BlockchainDataProviderADT):
 
         return address_obj
 
+    def __get_many(self, session: Session, model, key_column, keys, options, use_cache: bool) -> dict:
+        """Load all objects whose key_column is in keys, in chunked queries.
+
+        Returns:
+            dict: Objects keyed by the value of key_column. Keys which weren't found are left out.
+        """
+        keys = list(dict.fromkeys(keys))
+        cache = None
+        if use_cache:
+            cache = session.info.setdefault(LOOKUP_CACHE_KEY, {}).setdefault((model, key_column.key), {})
+
+        found = {}
+        missing = []
+        for key in keys:
+            if cache is not None and key in cache:
+                found[key] = cache[key]
+            else:
+                missing.append(key)
+
+        if missing:
+            for start, end in chunked_indices(missing, LOOKUP_CHUNK_SIZE):
+                objs = session.query(model)\
+                              .options(*options)\
+                              .filter(any_of(session, key_column, missing[start:end]))\
+                              .order_by(*model.__mapper__.primary_key)\
+                              .all()
+                for obj in objs:
+                    # if a key isn't unique (e.g. duplicate tx hashes), keep the first one
+                    found.setdefault(getattr(obj, key_column.key), obj)
+
+            if cache is not None:
+                cache.update({key: found[key] for key in missing if key in found})
+
+        return {key: found[key] for key in keys if key in found}
+
+    def clear_lookup_cache(self, session: Session):
+        """Forget all objects cached by batch lookups in this session."""
+        session.info.pop(LOOKUP_CACHE_KEY, None)
+
+    def get_txs(self, session: Session, tx_ids: list[int] = None, tx_hashes: list[str] = None,
+                use_cache: bool = False) -> dict[object, Tx]:
+        """Get many transactions by their IDs or hashes, with inputs, outputs, and addresses loaded.
+
+        Args:
+            tx_ids (list[int], optional): Defaults to None.
+            tx_hashes (list[str], optional): Defaults to None.
+            use_cache (bool, optional): Reuse transactions already loaded by batch lookups
+                                        in this session. Defaults to False.
+
+        Returns:
+            dict[object, Tx]: Transactions keyed by ID or hash, whichever was given.
+        """
+        if not (tx_ids is not None or tx_hashes is not None):
+            raise ValueError("Must provide either tx_ids or tx_hashes")
+
+        options = (
+            selectinload(Tx.inputs)
+            .selectinload(Input.prev_out)
+            .selectinload(Output.address),
+            selectinload(Tx.outputs)
+            .selectinload(Output.address)
+        )
+
+        if tx_ids is not None:
+            return self.__get_many(session, Tx, Tx.id, tx_ids, options, use_cache)
+        return self.__get_many(session, Tx, Tx.hash, tx_hashes, options, use_cache)
+
+    def get_inputs(self, session: Session, input_ids: list[int], use_cache: bool = False) -> dict[int, Input]:
+        options = (selectinload(Input.prev_out),)
+        return self.__get_many(session, Input, Input.id, input_ids, options, use_cache)
+
+    def get_outputs(self, session: Session, output_ids: list[int], use_cache: bool = False) -> dict[int, Output]:
+        """Get many outputs by their IDs, with addresses loaded.
+
+        Returns:
+            dict[int, Output]: Outputs keyed by ID.
+        """
+        options = (selectinload(Output.address),)
+        return self.__get_many(session, Output, Output.id, output_ids, options, use_cache)
+
+    def get_addresses(self, session: Session, addresses: list[str] = None, address_ids: list[int] = None,
+                      use_cache: bool = False) -> dict[object, Address]:
+        """Get many addresses by their address strings or IDs.
+
+        Returns:
+            dict[object, Address]: Addresses keyed by address string or ID, whichever was given.
+        """
+        if not (addresses is not None or address_ids is not None):
+            raise ValueError("Must provide either addresses or address_ids")
+
+        if address_ids is not None:
+            return self.__get_many(session, Address, Address.id, address_ids, (), use_cache)
+        return self.__get_many(session, Address, Address.addr, addresses, (), use_cache)
+
     def __populate_addresses(self, session: Session, block: Block):
 
         address_start_time = time.perf_counter()
@@ -836,27 +1063,170 @@ class PersistentBlockchainAPIData(BlockchainDataProviderADT):
 
         return block
 
-    def repopulate_addresses(self, session: Session,
-                             block_heights: list[int] = None,
-                             show_progressbar=False):
+    def clear_database(self, session: Session):
+        """Wipe all populated blockchain data.
 
-        if block_heights is None:
-            block_heights = session.query(Block.height).distinct()
-            block_heights = [height for (height,) in block_heights]
-        else:
-            block_heights = list(block_heights)
-            block_heights.sort()
+        TRUNCATE doesn't scan the tables or write a WAL record per row, so this
+        is much faster than running DELETE FROM on each table. Tables referencing
+        these (e.g. manual proportions, address owners) are truncated too.
+        ID sequences are restarted.
+        """
+        inspector = inspect(session.get_bind())
+        tables = [table for table in BLOCKCHAIN_TABLES if inspector.has_table(table)]
+        if not tables:
+            return
 
-        # highest_block = block_heights[-1]
+        session.execute(text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE"))
+        session.commit()
 
-        if show_progressbar:
-            from tqdm import tqdm
-            block_heights = tqdm(block_heights)
+    def delete_above_height(self, session: Session, height: int):
+        """Delete all blocks higher than the given height, along with their
+        transactions, inputs, outputs, and any addresses which first appeared in them.
+        This allows rebuilding part of the chain without wiping everything.
+
+        Args:
+            height (int): The highest block height to keep.
+        """
+        txs_above = select(Tx.id).where(Tx.block_height > height)
+        outputs_above = select(Output.id).where(Output.tx_id.in_(txs_above))
+        inputs_above = select(Input.id).where(Input.tx_id.in_(txs_above))
+
+        session.query(ManualProportion)\
+               .filter(ManualProportion.output_id.in_(outputs_above) | ManualProportion.input_id.in_(inputs_above))\
+               .delete(synchronize_session=False)
+        session.query(Input).filter(Input.tx_id.in_(txs_above)).delete(synchronize_session=False)
+        session.query(Output).filter(Output.tx_id.in_(txs_above)).delete(synchronize_session=False)
+        session.query(Tx).filter(Tx.block_height > height).delete(synchronize_session=False)
+        session.query(Block).filter(Block.height > height).delete(synchronize_session=False)
+
+        # Address IDs are assigned in order of first appearance, so every address
+        # above the highest one still in use first appeared in a deleted block.
+        highest_address = session.query(func.max(Output.address_id)).scalar()
+        highest_address = highest_address if highest_address is not None else -1
+        session.query(AddressOwnerAssociation)\
+               .filter(AddressOwnerAssociation.address_id > highest_address)\
+               .delete(synchronize_session=False)
+        session.query(Address).filter(Address.id > highest_address).delete(synchronize_session=False)
+
+        session.commit()
+
+    def repopulate_addresses(self, session: Session,
+                             block_heights: list[int] = None,
+                             show_progressbar=False,
+                             chunk_size: int = 1_000_000,
+                             workers: int = 1):
+        """Re-derive all addresses and output address IDs from the outputs.address_addr staging column.
+
+        This is done with a few set-based statements rather than one round trip per block:
+        1. The distinct addresses are collected in a single pass, and given IDs in order of
+           first appearance (the lowest output ID they appear in) with a window function.
+        2. Addresses which don't exist yet are inserted.
+        3. outputs.address_id is updated with chunked UPDATE ... FROM statements over output ID
+           ranges, which can be run in parallel.
+
+        Since IDs are assigned deterministically, existing addresses keep their IDs. If any existing
+        address has a different ID than it is rebuilt with, e.g. because IDs weren't assigned in order
+        of first appearance, a ValueError is raised before anything is changed.
+
+        Args:
+            block_heights (list[int], optional): Only update outputs in the range of these block heights.
+                                                 Address IDs are still derived from the whole chain.
+                                                 Defaults to None.
+            chunk_size (int, optional): Number of output IDs updated per statement. Defaults to 1,000,000.
+            workers (int, optional): Number of chunks updated at the same time, each on its own
+                                     connection. Defaults to 1, which updates them in order on the session's.
+        """
+        bind = session.get_bind()
+        unlogged = "UNLOGGED " if bind.dialect.name == 'postgresql' else ""
+
+        session.execute(text("DROP TABLE IF EXISTS address_rebuild"))
+        session.execute(text(f"""
+            CREATE {unlogged}TABLE address_rebuild AS
+            SELECT ROW_NUMBER() OVER (ORDER BY first_output_id) - 1 AS id, addr
+            FROM (
+                SELECT address_addr AS addr, MIN(id) AS first_output_id
+                FROM outputs
+                WHERE address_addr IS NOT NULL
+                GROUP BY address_addr
+            ) AS first_appearances
+        """))
+        try:
+            session.execute(text("CREATE INDEX ix_address_rebuild_addr ON address_rebuild (addr)"))
+
+            # outputs are pointed at addresses by their rebuilt IDs, so existing addresses must have them
+            mismatched = session.execute(text("""
+                SELECT a.id, a.addr, r.id FROM address_rebuild r
+                JOIN addresses a ON a.id = r.id
+                WHERE a.addr IS NULL OR a.addr <> r.addr
+                UNION ALL
+                SELECT a.id, a.addr, r.id FROM address_rebuild r
+                JOIN addresses a ON a.addr = r.addr
+                WHERE a.id <> r.id
+                LIMIT 10
+            """)).all()
+            if mismatched:
+                raise ValueError(f"Existing addresses don't match the IDs they are rebuilt with, "
+                                 f"as (ID, address, rebuilt ID): {[tuple(row) for row in mismatched]}. "
+                                 f"Delete the addresses, and their owner associations, and repopulate them.")
+
+            session.execute(text("""
+                INSERT INTO addresses (id, addr)
+                SELECT r.id, r.addr FROM address_rebuild r
+                WHERE NOT EXISTS (SELECT 1 FROM addresses a WHERE a.id = r.id AND a.addr = r.addr)
+            """))
+            session.commit()
+
+            output_id_query = session.query(func.min(Output.id), func.max(Output.id))
+            if block_heights is not None:
+                block_heights = list(block_heights)
+                output_id_query = output_id_query.join(Tx, Output.tx_id == Tx.id)\
+                                                 .filter(Tx.block_height >= min(block_heights),
+                                                         Tx.block_height <= max(block_heights))
+            lowest_output_id, highest_output_id = output_id_query.one()
+
+            update_statement = text("""
+                UPDATE outputs SET address_id = r.id
+                FROM address_rebuild r
+                WHERE outputs.address_addr = r.addr
+                  AND outputs.id BETWEEN :start AND :end
+            """)
+
+            def update_chunk(connection, chunk):
+                start, end = chunk
+                connection.execute(update_statement, {'start': start, 'end': end})
+
+            def update_chunk_on_own_connection(chunk):
+                with bind.begin() as connection:
+                    update_chunk(connection, chunk)
+
+            if lowest_output_id is not None:
+                chunks = chunked_ranges(lowest_output_id, highest_output_id, chunk_size)
+
+                if show_progressbar:
+                    from tqdm import tqdm
+                    progressbar = tqdm(total=len(chunks), desc="Updating output addresses", unit="chunk")
+
+                if workers > 1:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                        for _ in executor.map(update_chunk_on_own_connection, chunks):
+                            if show_progressbar:
+                                progressbar.update(1)
+                else:
+                    for chunk in chunks:
+                        update_chunk(session.connection(), chunk)
+                        if show_progressbar:
+                            progressbar.update(1)
+                    session.commit()
+
+                if show_progressbar:
+                    progressbar.close()
+        finally:
+            session.rollback()
+            session.execute(text("DROP TABLE IF EXISTS address_rebuild"))
+            session.commit()
 
-        for block_height in block_heights:
-            self.__populate_addresses(session, block_height)  # , commit=False)
-            # if (block_height > 0 and block_height % 100 == 0) or block_height == highest_block:
-            #     session.commit()
+        highest_address = session.query(func.max(Address.id)).scalar()
+        self.current_address_id = int(highest_address) + 1 if highest_address is not None else 0
 
     def populate_block(self, session: Session, block_height: int, populate_addresses=True, block_json=None):
 
@@ -17,7 +17,6 @@ from models.bitcoin_data import Block
 # see if database tables exist. if not, create them
 from models import base
 from sqlalchemy import inspect
-from sqlalchemy.sql import text
 
 
 if __name__ == "__main__":
@@ -26,6 +25,8 @@ if __name__ == "__main__":
     parser.add_argument('-e', '--endpoint', default=BLOCKCHAIN_INFO_BLOCK_ENDPOINT,
                         type=str, help='API endpoint for blockchain data population')
     parser.add_argument('--delete', default=False, action='store_true', help='Delete all data in database before populating')
+    parser.add_argument('--delete-above', default=None, type=int, dest='delete_above',
+                        help='Delete all blocks above this height before populating, for partial rebuilds')
 
     parser.add_argument('--async', default=False, dest='use_async',
                         action='store_true', help='Use async API provider'
@@ -41,19 +42,15 @@ if __name__ == "__main__":
         print("Deleting all data in database...")
         # wipe the database
         with SessionLocal() as session:
-            if inspector.has_table("inputs"):
-                session.execute(text('DELETE FROM inputs'))
-            if inspector.has_table("outputs"):
-                session.execute(text('DELETE FROM outputs'))
-            if inspector.has_table("transactions"):
-                session.execute(text('DELETE FROM transactions'))
-            if inspector.has_table("blocks"):
-                session.execute(text('DELETE FROM blocks'))
-            if inspector.has_table("addresses"):
-                session.execute(text('DELETE FROM addresses'))
-            session.commit()
+            PersistentBlockchainAPIData().clear_database(session)
 
         print("Database wiped.")
+    elif args.delete_above is not None:
+        print(f"Deleting all blocks above height {args.delete_above}...")
+        with SessionLocal() as session:
+            PersistentBlockchainAPIData().delete_above_height(session, args.delete_above)
+
+        print(f"Blocks above height {args.delete_above} deleted.")
 
     if not inspector.has_table("blocks"):
         print("No data found. Database created.")
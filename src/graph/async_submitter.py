@@ -0,0 +1,114 @@
+"""Keep several graph writes in flight on one connection.
+
+Waiting for each batch to be written before building the next one serialises
+reading from postgres, computing haircuts and the round trip to the gremlin
+server. The submitter sends each batch asynchronously and only waits once
+max_in_flight batches are outstanding, so the producer keeps streaming
+transactions while the server works.
+
+Batches are waited on in the order they were submitted, so everything up to
+the last one waited on has been written, and the population checkpoint can
+follow it.
+"""
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+
+from graph.batch_writer import GremlinBatchWriter
+from graph.batch_sizer import AdaptiveBatchSizer
+
+
+class AsyncBatchSubmitter:
+
+    def __init__(self, writer: GremlinBatchWriter, max_in_flight: int = 4):
+        """
+        Args:
+            writer: Writes the batches. Its connection's pool should have at least max_in_flight
+                    connections, otherwise submitting blocks until one is free.
+            max_in_flight (int, optional): Number of batches sent without waiting for them. Defaults to 4.
+        """
+        self.writer = writer
+        self.max_in_flight = max_in_flight
+        self.in_flight = deque()
+        self.completed_output_id = None
+        self.reported_output_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __wait_oldest(self):
+        future, last_output_id, context, retry = self.in_flight.popleft()
+        try:
+            error = future.exception()
+            if error is not None:
+                if retry is None:
+                    raise error
+                # written again synchronously, while later batches stay in flight
+                retry(error)
+        except Exception as e:
+            print(f"Error writing {context}")
+            raise e
+        self.completed_output_id = last_output_id
+
+    def submit(
+        self,
+        write: Callable[[GremlinBatchWriter], Future],
+        last_output_id: int,
+        context: str = '',
+        retry: Callable[[Exception], None] = None,
+        sizer: AdaptiveBatchSizer = None
+    ):
+        """Send a batch, waiting for the oldest ones first if too many are in flight.
+
+        Args:
+            write: Sends the batch using the writer it is given, and returns a future for it.
+            last_output_id (int): The highest output ID the batch covers.
+            context (str, optional): Describes the batch in error messages.
+            retry (optional): Called with the error if the batch fails, to write it again.
+                It raises if the batch can't be written.
+            sizer (AdaptiveBatchSizer, optional): Told how long the batch took to be written.
+        """
+        while len(self.in_flight) >= self.max_in_flight:
+            self.__wait_oldest()
+
+        start = time.perf_counter()
+        try:
+            future = write(self.writer)
+        except Exception as e:
+            print(f"Error writing {context}")
+            raise e
+
+        if sizer is not None:
+            def record_latency(future):
+                if future.exception() is None:
+                    sizer.record_success(time.perf_counter() - start)
+            future.add_done_callback(record_latency)
+        self.in_flight.append((future, last_output_id, context, retry))
+
+        # move past anything that has finished already, without waiting
+        while self.in_flight and self.in_flight[0][0].done():
+            self.__wait_oldest()
+
+    def join(self):
+        """Wait for all batches in flight to be written."""
+        while self.in_flight:
+            self.__wait_oldest()
+
+    def pop_completed_output_id(self) -> int:
+        """Get the highest output ID up to which all batches have been written,
+        or None if it hasn't changed since the last call.
+        """
+        if self.completed_output_id == self.reported_output_id:
+            return None
+        self.reported_output_id = self.completed_output_id
+        return self.completed_output_id
+
+    def close(self):
+        # let outstanding writes finish, but don't raise their errors over one already being raised
+        for future, _, _, _ in self.in_flight:
+            future.exception()
+        self.in_flight.clear()
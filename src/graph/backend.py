@@ -0,0 +1,220 @@
+"""The graph operations population and analysis need, independent of where the graph is stored.
+
+GremlinBatchWriter (graph/batch_writer.py) implements them on JanusGraph, and
+InMemoryGraphBackend (graph/memory_backend.py) on NumPy arrays in the current
+process, so the populator and analyzer can run without a Gremlin server.
+
+Backends only need to implement a few primitives: creating output vertices and
+sent edges, looking them up, and dropping them. Upserting and replacing edges
+are built on those here. Vertices are addressed by backend-specific vertex IDs,
+which output_vertex_ids maps output IDs to.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+import math
+
+import numpy as np
+
+
+def gather(futures: list[Future]) -> Future:
+    """Combine futures into one which resolves to the list of their results,
+    or fails with the first error.
+    """
+    combined = Future()
+    results = [None] * len(futures)
+    remaining = [len(futures)]
+
+    if not futures:
+        combined.set_result(results)
+        return combined
+
+    def done(index, future):
+        if combined.done():
+            return
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            combined.set_exception(e)
+            return
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            combined.set_result(results)
+
+    for index, future in enumerate(futures):
+        future.add_done_callback(lambda future, index=index: done(index, future))
+    return combined
+
+
+def resolved(result=None) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class GraphBackend(ABC):
+
+    # Whether the graph outlives the process. Population checkpoints only apply to graphs which do.
+    persistent = True
+
+    @abstractmethod
+    def existing_output_vertices(self, output_ids: list[int]) -> dict[int, int]:
+        """Find which of the given outputs already have vertices.
+
+        Returns:
+            dict[int, int]: Vertex IDs keyed by output ID, for outputs which have vertices.
+        """
+
+    @abstractmethod
+    def add_output_vertices_async(self, rows: list[dict]) -> Future:
+        """Create a vertex for each row, without checking whether they already exist.
+
+        Args:
+            rows (list[dict]): Each has an 'output_id', and optionally an 'address_id', the output's
+                'value' and 'block_height', and a 'pruned_value' (see graph/pruning.py).
+
+        Returns:
+            Future: Resolves to the IDs of the new vertices, in the same order as rows.
+        """
+
+    @abstractmethod
+    def output_vertex_ids(self, output_ids: list[int]) -> dict[int, int]:
+        """Get the vertex IDs of outputs. Raises ValueError if any of them don't have vertices."""
+
+    @abstractmethod
+    def sent_edge_values(self, output_ids: list[int]) -> dict[tuple[int, int], list[float]]:
+        """Find the sent edges going to the given outputs, with their values.
+
+        Returns:
+            dict: (previous output vertex ID, output vertex ID) -> the values of the edges between them.
+                  There is more than one value only if the edge is duplicated.
+        """
+
+    @abstractmethod
+    def drop_sent_edges(self, vertex_pairs: list[tuple[int, int]]):
+        """Drop the sent edges between each (previous output vertex ID, output vertex ID) pair."""
+
+    @abstractmethod
+    def add_sent_edges_async(self, edges: list[tuple[int, int, float]]) -> Future:
+        """Create a sent edge for each (previous output ID, output ID, value), without
+        checking whether they already exist.
+
+        Returns:
+            Future: Resolves to the number of edges created.
+        """
+
+    @abstractmethod
+    def drop_vertices(self, label: str, key: str, values: list):
+        """Drop the vertices with the given label whose key, e.g. output_id, is one of values, with their edges."""
+
+    @abstractmethod
+    def has_vertices(self) -> bool:
+        """Whether the graph has any vertices left."""
+
+    @abstractmethod
+    def drop_any_vertices(self, limit: int):
+        """Drop up to limit vertices of any kind, with their edges."""
+
+    @abstractmethod
+    def forget_vertex_ids(self, lowest_output_id: int = 0):
+        """Forget the vertex IDs known for outputs from lowest_output_id up, after their vertices
+        were dropped. From 0, anything else known about the graph is forgotten too.
+        """
+
+    @abstractmethod
+    def sent_edges(self, output_ids: list[int], direction: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find the sent edges going to ('incoming') or coming from ('outgoing') the given outputs.
+
+        Returns:
+            (previous output IDs, output IDs, values): One entry per edge.
+        """
+
+    @abstractmethod
+    def output_properties(self, output_ids: list[int]) -> dict[int, dict]:
+        """Get the properties of the given outputs' vertices, other than output_id, keyed by output ID.
+        Outputs without vertices are left out.
+        """
+
+    @abstractmethod
+    def address_output_ids(self, address_id: int) -> list[int]:
+        """Find the outputs with vertices which were sent to an address."""
+
+    def upsert_output_vertices_async(self, rows: list[dict]) -> Future:
+        """Create vertices for the rows whose outputs don't already have one.
+        Existing vertices are looked up before this returns.
+
+        Returns:
+            Future: Resolves to the IDs of the new vertices.
+        """
+        existing = self.existing_output_vertices([row['output_id'] for row in rows])
+        return self.add_output_vertices_async([row for row in rows if row['output_id'] not in existing])
+
+    def upsert_output_vertices(self, rows: list[dict]) -> list[int]:
+        """Create vertices for the rows whose outputs don't already have one.
+
+        Returns:
+            list[int]: The vertex IDs for all rows, in the same order as rows.
+        """
+        self.upsert_output_vertices_async(rows).result()
+        vertex_ids = self.output_vertex_ids([row['output_id'] for row in rows])
+        return [vertex_ids[row['output_id']] for row in rows]
+
+    def existing_sent_edges(self, output_ids: list[int]) -> set[tuple[int, int]]:
+        """Find the sent edges going to the given outputs.
+
+        Returns:
+            set[tuple[int, int]]: (previous output vertex ID, output vertex ID) pairs.
+        """
+        return set(self.sent_edge_values(output_ids))
+
+    def replace_sent_edges(self, edges: list[tuple[int, int, float]], output_ids: list[int]) -> tuple[int, int]:
+        """Make edges, given as (previous output ID, output ID, value), the only sent edges going to output_ids.
+
+        Only edges which are missing, have a different value, or shouldn't exist are written:
+        edges are dropped and created again to change their value.
+
+        Returns:
+            (int, int): The number of edges dropped and created.
+        """
+        vertex_ids = self.output_vertex_ids({output_id for edge in edges for output_id in edge[:2]} | set(output_ids))
+        existing = self.sent_edge_values(list(output_ids))
+        wanted = {(vertex_ids[prev_out_id], vertex_ids[output_id]): value for prev_out_id, output_id, value in edges}
+
+        unchanged = {
+            pair for pair, values in existing.items()
+            if len(values) == 1 and pair in wanted and math.isclose(values[0], wanted[pair], rel_tol=1e-9)
+        }
+        to_drop = [pair for pair in existing if pair not in unchanged]
+        to_add = [
+            (prev_out_id, output_id, value) for prev_out_id, output_id, value in edges
+            if (vertex_ids[prev_out_id], vertex_ids[output_id]) not in unchanged
+        ]
+
+        # dropped first, so the replacements aren't dropped with the edges they replace
+        if to_drop:
+            self.drop_sent_edges(to_drop)
+        self.add_sent_edges(to_add)
+        return len(to_drop), len(to_add)
+
+    def add_sent_edges(self, edges: list[tuple[int, int, float]]):
+        """Create a sent edge for each (previous output ID, output ID, value), without
+        checking whether they already exist.
+        """
+        self.add_sent_edges_async(edges).result()
+
+    def upsert_sent_edges_async(self, edges: list[tuple[int, int, float]]) -> Future:
+        """Create the sent edges which don't already exist.
+        Existing edges are looked up before this returns.
+        """
+        if not edges:
+            return resolved(0)
+
+        existing = self.existing_sent_edges({output_id for _, output_id, _ in edges})
+        vertex_ids = self.output_vertex_ids({output_id for edge in edges for output_id in edge[:2]})
+        return self.add_sent_edges_async([
+            (prev_out_id, output_id, value) for prev_out_id, output_id, value in edges
+            if (vertex_ids[prev_out_id], vertex_ids[output_id]) not in existing
+        ])
+
+    def upsert_sent_edges(self, edges: list[tuple[int, int, float]]):
+        """Create the sent edges which don't already exist."""
+        self.upsert_sent_edges_async(edges).result()
@@ -1,4 +1,5 @@
 import os
+import threading
 from importlib.metadata import version
 
 from dotenv import load_dotenv
@@ -25,12 +26,17 @@ GRAPH_DB_PASSWORD = os.getenv("GRAPH_DB_PASSWORD")
 GREMLIN_SEVER_PORT = os.getenv("GREMLIN_SEVER_PORT")
 GRAPH_DB_URL = f"ws://{GRAPH_DB_HOST}:{GREMLIN_SEVER_PORT}/gremlin"
 
-assert GRAPH_DB_HOST is not None and GREMLIN_SEVER_PORT is not None and GRAPH_DB_USER is not None \
-    and GRAPH_DB_PASSWORD is not None, \
-    "GRAPH_DB_HOST, GREMLIN_DB_USER, GREMLIN_DB_PASSWORD, and GREMLIN_SEVER_PORT must be set in .env file"
+
+def check_gremlin_settings():
+    assert GRAPH_DB_HOST is not None and GREMLIN_SEVER_PORT is not None and GRAPH_DB_USER is not None \
+        and GRAPH_DB_PASSWORD is not None, \
+        "GRAPH_DB_HOST, GREMLIN_DB_USER, GREMLIN_DB_PASSWORD, and GREMLIN_SEVER_PORT must be set in .env file"
+
+
 gremlin_version = tuple([int(x) for x in version('gremlinpython').split('.')])
 if (gremlin_version < (3, 5, 0)):
     def create_gremlin_connection() -> GraphTraversalSource:
+        check_gremlin_settings()
         graph = Graph()
         g = graph.traversal().withRemote(
             DriverRemoteConnection(GRAPH_DB_URL, 'g',
@@ -48,6 +54,7 @@ if (gremlin_version < (3, 5, 0)):
 else: # gremlin_version >= (3, 6, 0) e.g. 3.6.10 or 3.7.1
     from gremlin_python.process.anonymous_traversal import traversal
     def create_gremlin_connection() -> GraphTraversalSource:
+        check_gremlin_settings()
         g = traversal().withRemote(
             DriverRemoteConnection(GRAPH_DB_URL, 'g',
                                    username=GRAPH_DB_USER,
@@ -67,4 +74,29 @@ def reset_gremlin_connection(g: GraphTraversalSource):
                                    username=GRAPH_DB_USER,
                                    password=GRAPH_DB_PASSWORD)
 
-g = create_gremlin_connection()
+
+class LazyGraphTraversalSource:
+    """Stands in for the GraphTraversalSource returned by create_gremlin_connection,
+    and only connects the first time it is used. Modules can import g without a Gremlin
+    server being reachable, e.g. to populate or analyze an in-process graph (see graph/backend.py).
+    """
+
+    def __init__(self, connect=create_gremlin_connection):
+        object.__setattr__(self, '_connect', connect)
+        object.__setattr__(self, '_source', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get_source(self) -> GraphTraversalSource:
+        with self._lock:
+            if self._source is None:
+                object.__setattr__(self, '_source', self._connect())
+            return self._source
+
+    def __getattr__(self, name):
+        return getattr(self._get_source(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_source(), name, value)
+
+
+g = LazyGraphTraversalSource()
@@ -0,0 +1,115 @@
+"""Adjust graph write batch sizes from how the server copes with them.
+
+The best batch size depends on the server's memory, its evaluationTimeout and
+how large the elements being written are, so it isn't known up front. The
+sizer grows the batch size additively while batches are written within a
+target latency, and halves it when a write fails with a server error or
+times out (additive increase, multiplicative decrease). A batch which
+failed is retried split in two, and each half is split again if it fails too.
+
+Writes aren't atomic: a batch may be sent as several traversals, and some of
+them can be committed before another fails. Halves are therefore written with
+a write which skips elements that already exist, such as an upsert, so the
+part which was committed isn't written twice.
+"""
+import threading
+import time
+from typing import Callable
+
+from gremlin_python.driver.protocol import GremlinServerError
+
+from graph.writer_pool import is_lock_conflict
+
+
+def is_split_retryable(error: Exception) -> bool:
+    """Whether a failed write might succeed with a smaller batch. Lock conflicts are
+    retried whole by the writer pool instead, since they have nothing to do with size.
+    """
+    if isinstance(error, GremlinServerError):
+        return not is_lock_conflict(error)
+    return isinstance(error, TimeoutError)
+
+
+class AdaptiveBatchSizer:
+
+    def __init__(
+        self,
+        initial_size: int = 1_000,
+        min_size: int = 1,
+        max_size: int = 50_000,
+        increment: int = None,
+        target_latency: float = 5.0,
+        adaptive: bool = True
+    ):
+        """
+        Args:
+            initial_size (int, optional): Defaults to 1,000.
+            min_size (int, optional): The size is never halved below this. Defaults to 1.
+            max_size (int, optional): The size never grows above this. Defaults to 50,000.
+            increment (int, optional): How much the size grows after each fast batch.
+                Defaults to a tenth of the initial size.
+            target_latency (float, optional): Seconds a batch may take for the size to grow. Defaults to 5.
+            adaptive (bool, optional): If False, the size stays at initial_size,
+                though failed batches are still split. Defaults to True.
+        """
+        self.min_size = min_size
+        self.max_size = max(max_size, initial_size)
+        self.increment = increment if increment is not None else max(1, initial_size // 10)
+        self.target_latency = target_latency
+        self.adaptive = adaptive
+
+        self.lock = threading.Lock()
+        self.size = initial_size
+        self.failures = 0
+
+    def record_success(self, latency: float):
+        """Grow the batch size if the batch was written within the target latency."""
+        if not self.adaptive or latency >= self.target_latency:
+            return
+        with self.lock:
+            self.size = min(self.max_size, self.size + self.increment)
+
+    def record_failure(self):
+        """Halve the batch size after a batch failed."""
+        with self.lock:
+            self.failures += 1
+            if self.adaptive:
+                self.size = max(self.min_size, self.size // 2)
+
+
+def write_in_halves(
+    write: Callable[[list], None],
+    items: list,
+    sizer: AdaptiveBatchSizer,
+    rewrite: Callable[[list], None] = None
+):
+    """Write items in one batch, timing it. If it fails with an error which a smaller batch
+    might avoid, halve the batch size and write each half the same way.
+
+    Args:
+        write: Writes a batch.
+        rewrite (optional): Writes the halves of a failed batch, skipping elements which
+            already exist. Defaults to write, which must then be safe to repeat.
+    """
+    start = time.perf_counter()
+    try:
+        write(items)
+    except Exception as e:
+        retry_in_halves(e, rewrite if rewrite is not None else write, items, sizer)
+    else:
+        sizer.record_success(time.perf_counter() - start)
+
+
+def retry_in_halves(error: Exception, write: Callable[[list], None], items: list, sizer: AdaptiveBatchSizer):
+    """Handle a failed write of items, by writing each half of them separately.
+    Raises the error again if splitting can't help.
+
+    Part of the failed write may have been committed, so write must skip elements which already exist.
+    """
+    if not is_split_retryable(error) or len(items) <= 1:
+        raise error
+
+    sizer.record_failure()
+    middle = len(items) // 2
+    write_in_halves(write, items[:middle], sizer)
+    write_in_halves(write, items[middle:], sizer)
@@ -0,0 +1,433 @@
+"""Batched writes of output vertices and sent edges.
+
+Chaining one get-or-create traversal per element onto a single traversal
+(g.V()...coalesce(...).V()...) makes the bytecode, and the server's work to
+plan it, grow with the batch size. Instead, each batch here is written with
+one short traversal whose size doesn't depend on the number of elements:
+the elements are sent as a list of maps with inject(), and properties are
+taken from each map with select().
+
+    g.inject([{'output_id': 1}, {'output_id': 2}, ...]).unfold().as_('m')
+     .addV('output').property('output_id', __.select('m').select('output_id'))
+
+Edges are written the same way, with their endpoints given as vertex references,
+so no index lookups are needed to find them. In the tx projection (see
+graph/projection.py), each tx vertex is written together with its edges.
+
+Writes are submitted asynchronously: the *_async methods return a future as
+soon as the traversal is sent, so the caller can prepare the next batch while
+the server works on this one (see graph/async_submitter.py). The other methods
+wait for the write to finish.
+
+GremlinBatchWriter is the JanusGraph implementation of GraphBackend (see
+graph/backend.py), which also builds upserts and edge replacement on these writes.
+"""
+from concurrent.futures import Future
+
+import numpy as np
+
+from gremlin_python.process.traversal import T, P
+from gremlin_python.process.graph_traversal import __, GraphTraversalSource
+from gremlin_python.structure.graph import Vertex
+
+from graph.backend import GraphBackend, gather, resolved
+from graph.vertex_ids import VertexIdCache
+
+
+# properties output vertex rows may have besides output_id
+OPTIONAL_OUTPUT_PROPERTIES = ('address_id', 'value', 'block_height', 'pruned_value')
+
+
+class GremlinBatchWriter(GraphBackend):
+
+    def __init__(self, g: GraphTraversalSource, vertex_ids: VertexIdCache = None):
+        self.g = g
+        self.vertex_ids = vertex_ids if vertex_ids is not None else VertexIdCache()
+        # address ID -> address vertex ID
+        self.address_vertex_id_cache = VertexIdCache(initial_size=1_000)
+
+    def existing_output_vertices(self, output_ids: list[int]) -> dict[int, int]:
+        """Find which of the given outputs already have vertices, with one batched index lookup.
+
+        Returns:
+            dict[int, int]: Vertex IDs keyed by output ID, for outputs which have vertices.
+        """
+        output_ids = list(output_ids)
+        if not output_ids:
+            return {}
+
+        results = self.g.V().has('output', 'output_id', P.within(output_ids)) \
+                            .project('output_id', 'vertex_id') \
+                            .by('output_id') \
+                            .by(T.id) \
+                            .toList()
+
+        existing = {result['output_id']: result['vertex_id'] for result in results}
+        self.vertex_ids.set_many(list(existing.keys()), list(existing.values()))
+        return existing
+
+    def add_output_vertices_async(self, rows: list[dict]) -> Future:
+        """Create a vertex for each row, without checking whether they already exist.
+
+        Args:
+            rows (list[dict]): Each has an 'output_id', and optionally an 'address_id', the output's
+                'value' and 'block_height', and a 'pruned_value' (see graph/pruning.py).
+
+        Returns:
+            Future: Resolves to the IDs of the new vertices, in the same order as rows,
+                    once they have been remembered in vertex_ids.
+        """
+        groups = []
+        futures = []
+
+        # every row in a traversal must have the same properties,
+        # so rows with and without each optional property are written separately
+        indices_by_keys = {}
+        for i, row in enumerate(rows):
+            keys = tuple(key for key in OPTIONAL_OUTPUT_PROPERTIES if row.get(key) is not None)
+            indices_by_keys.setdefault(keys, []).append(i)
+
+        for keys, indices in indices_by_keys.items():
+            traversal = self.g.inject([rows[i] for i in indices]).unfold().as_('m') \
+                              .addV('output') \
+                              .property('output_id', __.select('m').select('output_id'))
+            for key in keys:
+                traversal = traversal.property(key, __.select('m').select(key))
+
+            groups.append(indices)
+            futures.append(traversal.id().promise(lambda traversal: traversal.toList()))
+
+        result = Future()
+
+        def remember(combined):
+            try:
+                vertex_ids = [None] * len(rows)
+                for indices, new_vertex_ids in zip(groups, combined.result()):
+                    for i, vertex_id in zip(indices, new_vertex_ids):
+                        vertex_ids[i] = vertex_id
+                self.vertex_ids.set_many([row['output_id'] for row in rows], vertex_ids)
+            except Exception as e:
+                result.set_exception(e)
+            else:
+                result.set_result(vertex_ids)
+
+        gather(futures).add_done_callback(remember)
+        return result
+
+    def add_output_vertices(self, rows: list[dict]) -> list[int]:
+        """Create a vertex for each row, without checking whether they already exist.
+
+        Returns:
+            list[int]: The IDs of the new vertices, in the same order as rows.
+        """
+        return self.add_output_vertices_async(rows).result()
+
+    def output_vertex_ids(self, output_ids: list[int]) -> dict[int, int]:
+        """Get the vertex IDs of outputs, looking up any which aren't cached in one query."""
+        vertex_ids = {output_id: self.vertex_ids.get(output_id) for output_id in output_ids}
+        unknown = [output_id for output_id, vertex_id in vertex_ids.items() if vertex_id is None]
+        if unknown:
+            vertex_ids.update(self.existing_output_vertices(unknown))
+
+        missing = [output_id for output_id in output_ids if vertex_ids.get(output_id) is None]
+        if missing:
+            raise ValueError(f"Outputs {missing[:10]} do not have vertices in the graph")
+        return vertex_ids
+
+    def sent_edge_values(self, output_ids: list[int]) -> dict[tuple[int, int], list[float]]:
+        """Find the sent edges going to the given outputs, with their values.
+
+        Returns:
+            dict: (previous output vertex ID, output vertex ID) -> the values of the edges between them.
+                  There is more than one value only if the edge is duplicated.
+        """
+        vertex_ids = list(set(self.output_vertex_ids(output_ids).values()))
+        if not vertex_ids:
+            return {}
+
+        results = self.g.V(*vertex_ids).inE('sent') \
+                                       .project('from', 'to', 'value') \
+                                       .by(__.outV().id()) \
+                                       .by(__.inV().id()) \
+                                       .by(__.values('value')) \
+                                       .toList()
+        edges = {}
+        for result in results:
+            edges.setdefault((result['from'], result['to']), []).append(result['value'])
+        return edges
+
+    def drop_sent_edges(self, vertex_pairs: list[tuple[int, int]]):
+        """Drop the sent edges between each (previous output vertex ID, output vertex ID) pair.
+
+        Outputs whose edges are dropped from the same previous outputs are dropped in one traversal.
+        When a transaction's edges all change, that's one traversal for the whole transaction.
+        """
+        self.drop_edges('sent', vertex_pairs)
+
+    def drop_edges(self, label: str, vertex_pairs: list[tuple[int, int]]):
+        """Drop the edges with the given label between each (from vertex ID, to vertex ID) pair,
+        grouping pairs like drop_sent_edges.
+        """
+        from_by_to = {}
+        for from_vertex_id, to_vertex_id in vertex_pairs:
+            from_by_to.setdefault(to_vertex_id, set()).add(from_vertex_id)
+
+        to_by_from = {}
+        for to_vertex_id, from_vertex_ids in from_by_to.items():
+            to_by_from.setdefault(frozenset(from_vertex_ids), []).append(to_vertex_id)
+
+        for from_vertex_ids, to_vertex_ids in to_by_from.items():
+            self.g.V(*to_vertex_ids).inE(label) \
+                  .where(__.outV().hasId(P.within(*from_vertex_ids))) \
+                  .drop() \
+                  .iterate()
+
+    def add_sent_edges_async(self, edges: list[tuple[int, int, float]]) -> Future:
+        """Create a sent edge for each (previous output ID, output ID, value), without
+        checking whether they already exist.
+
+        Returns:
+            Future: Resolves to the number of edges created.
+        """
+        if not edges:
+            return resolved(0)
+
+        vertex_ids = self.output_vertex_ids({output_id for edge in edges for output_id in edge[:2]})
+        rows = [
+            {'from': Vertex(vertex_ids[prev_out_id]), 'to': Vertex(vertex_ids[output_id]), 'value': float(value)}
+            for prev_out_id, output_id, value in edges
+        ]
+
+        return self.g.inject(rows).unfold().as_('e') \
+                     .addE('sent') \
+                     .from_(__.select('e').select('from')) \
+                     .to(__.select('e').select('to')) \
+                     .property('value', __.select('e').select('value')) \
+                     .count() \
+                     .promise(lambda traversal: traversal.next())
+
+    def drop_vertices(self, label: str, key: str, values: list):
+        self.g.V().has(label, key, P.within(list(values))).drop().iterate()
+
+    def has_vertices(self) -> bool:
+        return self.g.V().limit(1).count().next() > 0
+
+    def drop_any_vertices(self, limit: int):
+        self.g.V().limit(limit).drop().iterate()
+
+    def forget_vertex_ids(self, lowest_output_id: int = 0):
+        self.vertex_ids.clear(lowest_output_id)
+        if lowest_output_id == 0:
+            self.address_vertex_id_cache.clear()
+
+    def sent_edges(self, output_ids: list[int], direction: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        output_ids = list(output_ids)
+        if not output_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        edges = self.g.V().has('output', 'output_id', P.within(output_ids))
+        edges = edges.inE('sent') if direction == 'incoming' else edges.outE('sent')
+        results = edges.project('from', 'to', 'value') \
+                       .by(__.outV().values('output_id')) \
+                       .by(__.inV().values('output_id')) \
+                       .by(__.values('value')) \
+                       .toList()
+        return (
+            np.array([result['from'] for result in results], dtype=np.int64),
+            np.array([result['to'] for result in results], dtype=np.int64),
+            np.array([result['value'] for result in results], dtype=np.float64)
+        )
+
+    def output_properties(self, output_ids: list[int]) -> dict[int, dict]:
+        output_ids = list(output_ids)
+        if not output_ids:
+            return {}
+        results = self.g.V().has('output', 'output_id', P.within(output_ids)).valueMap().toList()
+        return {
+            result['output_id'][0]: {key: values[0] for key, values in result.items() if key != 'output_id'}
+            for result in results
+        }
+
+    def address_output_ids(self, address_id: int) -> list[int]:
+        return self.g.V().has('output', 'address_id', address_id).values('output_id').toList()
+
+    def existing_tx_vertices(self, tx_ids: list[int]) -> set[int]:
+        """Find which of the given transactions already have tx vertices (see graph/projection.py)."""
+        tx_ids = list(tx_ids)
+        if not tx_ids:
+            return set()
+        return set(self.g.V().has('tx', 'tx_id', P.within(tx_ids)).values('tx_id').toList())
+
+    def add_tx_vertices_async(self, rows: list[dict]) -> Future:
+        """Create a tx vertex for each row, with its spent and created edges, without checking
+        whether they already exist. Each transaction is written with its edges, so a tx vertex
+        never exists without them.
+
+        Args:
+            rows (list[dict]): Each has a 'tx_id', the 'input_value' of the transaction, and 'spent' and
+                'created' lists of (output ID, value) for its inputs' previous outputs and its outputs.
+
+        Returns:
+            Future: Resolves to the number of tx vertices created.
+        """
+        if not rows:
+            return resolved(0)
+
+        vertex_ids = self.output_vertex_ids({
+            output_id for row in rows for output_id, _ in row['spent'] + row['created']
+        })
+        rows = [{
+            'tx_id': row['tx_id'],
+            'input_value': float(row['input_value']),
+            'spent': [{'from': Vertex(vertex_ids[output_id]), 'value': float(value)}
+                      for output_id, value in row['spent']],
+            'created': [{'to': Vertex(vertex_ids[output_id]), 'value': float(value)}
+                        for output_id, value in row['created']]
+        } for row in rows]
+
+        return self.g.inject(rows).unfold().as_('m') \
+                     .addV('tx') \
+                     .property('tx_id', __.select('m').select('tx_id')) \
+                     .property('input_value', __.select('m').select('input_value')).as_('tx') \
+                     .sideEffect(__.select('m').select('spent').unfold().as_('e')
+                                 .addE('spent')
+                                 .from_(__.select('e').select('from'))
+                                 .to('tx')
+                                 .property('value', __.select('e').select('value'))) \
+                     .sideEffect(__.select('m').select('created').unfold().as_('e')
+                                 .addE('created')
+                                 .from_('tx')
+                                 .to(__.select('e').select('to'))
+                                 .property('value', __.select('e').select('value'))) \
+                     .count() \
+                     .promise(lambda traversal: traversal.next())
+
+    def upsert_tx_vertices_async(self, rows: list[dict]) -> Future:
+        """Create the tx vertices, with their edges, for the rows whose transactions don't already have one.
+        Existing tx vertices are looked up before this returns.
+        """
+        existing = self.existing_tx_vertices([row['tx_id'] for row in rows])
+        return self.add_tx_vertices_async([row for row in rows if row['tx_id'] not in existing])
+
+    def address_vertex_ids(self, address_ids: list[int]) -> dict[int, int]:
+        """Get the vertex IDs of address vertices, creating any which don't exist."""
+        address_ids = set(address_ids)
+        vertex_ids = {address_id: self.address_vertex_id_cache.get(address_id) for address_id in address_ids}
+        unknown = [address_id for address_id, vertex_id in vertex_ids.items() if vertex_id is None]
+        if unknown:
+            results = self.g.V().has('address', 'address_id', P.within(unknown)) \
+                                .project('address_id', 'vertex_id') \
+                                .by('address_id') \
+                                .by(T.id) \
+                                .toList()
+            vertex_ids.update({result['address_id']: result['vertex_id'] for result in results})
+
+        missing = sorted(address_id for address_id, vertex_id in vertex_ids.items() if vertex_id is None)
+        if missing:
+            new_vertex_ids = self.g.inject([{'address_id': address_id} for address_id in missing]).unfold().as_('m') \
+                                   .addV('address') \
+                                   .property('address_id', __.select('m').select('address_id')) \
+                                   .id() \
+                                   .toList()
+            vertex_ids.update(zip(missing, new_vertex_ids))
+
+        self.address_vertex_id_cache.set_many(list(vertex_ids.keys()), list(vertex_ids.values()))
+        return vertex_ids
+
+    def address_flow_edges(self, vertex_pairs: list[tuple[int, int]]) -> dict[tuple[int, int], list[dict]]:
+        """Find the flow edges between (from address vertex ID, to address vertex ID) pairs.
+
+        Returns:
+            dict: Each pair with flow edges -> the properties of its edges. There is more than one
+                  only if the edge is duplicated.
+        """
+        to_by_from = {}
+        for from_vertex_id, to_vertex_id in vertex_pairs:
+            to_by_from.setdefault(from_vertex_id, set()).add(to_vertex_id)
+        if not to_by_from:
+            return {}
+
+        # may find edges between pairs which weren't asked for, which are left out below
+        to_vertex_ids = set().union(*to_by_from.values())
+        results = self.g.V(*to_by_from.keys()).outE('flow') \
+                        .where(__.inV().hasId(P.within(*to_vertex_ids))) \
+                        .project('from', 'to', 'value', 'tx_count', 'first_height', 'last_height') \
+                        .by(__.outV().id()) \
+                        .by(__.inV().id()) \
+                        .by('value') \
+                        .by('tx_count') \
+                        .by('first_height') \
+                        .by('last_height') \
+                        .toList()
+
+        edges = {}
+        for result in results:
+            pair = (result.pop('from'), result.pop('to'))
+            if pair[1] in to_by_from[pair[0]]:
+                edges.setdefault(pair, []).append(result)
+        return edges
+
+    def merge_address_flows(self, flows: list, lowest_height: int) -> int:
+        """Add flows aggregated over a range of blocks starting at lowest_height to the address flow graph.
+
+        Ranges must be merged in height order. An edge whose last_height is already in the range
+        has had the range merged into it, so merging a range again doesn't count it twice.
+
+        Args:
+            flows (list): (from address ID, to address ID, value, tx_count, first_height, last_height)
+                for each pair of addresses, as from PersistentBlockchainAPIData.get_address_flows.
+
+        Returns:
+            int: The number of flow edges written.
+        """
+        if not flows:
+            return 0
+
+        vertex_ids = self.address_vertex_ids({address_id for flow in flows for address_id in flow[:2]})
+        rows = {
+            (vertex_ids[from_address_id], vertex_ids[to_address_id]): {
+                'value': float(value),
+                'tx_count': int(tx_count),
+                'first_height': int(first_height),
+                'last_height': int(last_height)
+            }
+            for from_address_id, to_address_id, value, tx_count, first_height, last_height in flows
+        }
+
+        existing = self.address_flow_edges(list(rows.keys()))
+        to_drop = []
+        for pair, edges in existing.items():
+            if any(edge['last_height'] >= lowest_height for edge in edges):
+                del rows[pair]
+                continue
+            # edges are replaced rather than updated in place, since their IDs can't be sent back to the server
+            to_drop.append(pair)
+            row = rows[pair]
+            for edge in edges:
+                row['value'] += edge['value']
+                row['tx_count'] += edge['tx_count']
+                row['first_height'] = min(row['first_height'], edge['first_height'])
+                row['last_height'] = max(row['last_height'], edge['last_height'])
+
+        if to_drop:
+            self.drop_edges('flow', to_drop)
+        self.add_address_flow_edges(rows)
+        return len(rows)
+
+    def add_address_flow_edges(self, rows: dict[tuple[int, int], dict]):
+        """Create a flow edge for each (from address vertex ID, to address vertex ID) pair, with the given
+        value, tx_count, first_height and last_height, without checking whether they already exist.
+        """
+        if not rows:
+            return
+
+        self.g.inject([{'from': Vertex(from_vertex_id), 'to': Vertex(to_vertex_id), **row}
+                       for (from_vertex_id, to_vertex_id), row in rows.items()]).unfold().as_('e') \
+              .addE('flow') \
+              .from_(__.select('e').select('from')) \
+              .to(__.select('e').select('to')) \
+              .property('value', __.select('e').select('value')) \
+              .property('tx_count', __.select('e').select('tx_count')) \
+              .property('first_height', __.select('e').select('first_height')) \
+              .property('last_height', __.select('e').select('last_height')) \
+              .iterate()
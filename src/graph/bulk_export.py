@@ -0,0 +1,213 @@
+"""Offline export of the output proportion graph to files which JanusGraph can bulk load.
+
+Populating the graph through Gremlin sends every vertex and edge over a websocket
+as its own get-or-create traversal. For a full rebuild, it is much faster to stream
+the vertices and haircut edges out of postgres into CSV files, then load them
+directly into JanusGraph with janusgraph/bulk_load.groovy, which opens the graph
+with storage.batch-loading enabled.
+
+Vertex IDs are pre-assigned from output IDs, so edges can be written without
+looking anything up: the vertex for output n has ID n + VERTEX_ID_OFFSET, which the
+loader converts to a JanusGraph vertex ID with IDManager.toVertexId. Setting vertex IDs
+needs graph.set-vertex-id=true, which the gremlin server in docker-compose.yml leaves off,
+so the loader opens the graph with it set while the server is stopped.
+
+Files are sharded by output ID. Edges are placed in the shard of the output they go to.
+"""
+import csv
+import json
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from models.bitcoin_data import Tx, Output
+from blockchain_data_provider import BlockchainDataProviderADT
+from graph.haircut import haircut_edges_for_txs
+
+
+# JanusGraph vertex IDs must be positive, while output IDs start at 0
+VERTEX_ID_OFFSET = 1
+
+VERTEX_HEADER = ['vertex_id', 'output_id', 'address_id', 'value', 'block_height']
+EDGE_HEADER = ['out_vertex_id', 'in_vertex_id', 'value']
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def output_vertex_id(output_id: int) -> int:
+    return output_id + VERTEX_ID_OFFSET
+
+
+class ShardedCSVWriter:
+    """Write rows to a sequence of CSV files, starting a new file for each
+    range of shard_size output IDs. Rows must be written in output ID order.
+    """
+
+    def __init__(self, directory: Path, prefix: str, header: list[str], shard_size: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.header = header
+        self.shard_size = shard_size
+
+        self.shards = []
+        self.current_shard = None
+        self.file = None
+        self.writer = None
+
+    def write(self, output_id: int, row: list):
+        shard = output_id // self.shard_size
+        if shard != self.current_shard:
+            self.__open_shard(shard)
+        self.writer.writerow(row)
+        self.shards[-1]['rows'] += 1
+
+    def __open_shard(self, shard: int):
+        if self.current_shard is not None and shard < self.current_shard:
+            raise ValueError(f"Output IDs of shard {shard} were written after shard {self.current_shard}. "
+                             "Rows must be written in output ID order.")
+        self.close()
+        filename = f"{self.prefix}-{shard:05d}.csv"
+        self.file = open(self.directory / filename, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.header)
+        self.current_shard = shard
+        self.shards.append({'file': filename, 'shard': shard, 'rows': 0})
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class GraphBulkExporter:
+
+    def __init__(self, data_provider: BlockchainDataProviderADT):
+        self.data_provider = data_provider
+
+    def export_vertices(self, session: Session, writer: ShardedCSVWriter, min_height: int, max_height: int,
+                        buffer: int = 100_000):
+        outputs = session.query(Output.id, Output.address_id, Output.value, Tx.block_height)\
+                         .join(Tx, Output.tx_id == Tx.id)\
+                         .filter(Tx.block_height >= min_height, Tx.block_height <= max_height)\
+                         .order_by(Output.id)\
+                         .yield_per(buffer)
+
+        for output_id, address_id, value, block_height in outputs:
+            writer.write(output_id, [
+                output_vertex_id(output_id),
+                output_id,
+                address_id if address_id is not None else '',
+                value,
+                block_height
+            ])
+
+    def export_edges(self, session: Session, writer: ShardedCSVWriter, min_height: int, max_height: int,
+                     buffer: int = 20_000, progressbar=None):
+        def write_edges(txs):
+            prev_out_ids, output_ids, values = haircut_edges_for_txs(txs)
+            for prev_out_id, output_id, value in zip(prev_out_ids.tolist(), output_ids.tolist(), values.tolist()):
+                writer.write(output_id, [output_vertex_id(prev_out_id), output_vertex_id(output_id), repr(value)])
+
+        # edges are computed for many transactions at once
+        txs = []
+        tx: Tx
+        for tx in self.data_provider.get_txs_for_blocks(session, min_height, max_height, buffer=buffer):
+            txs.append(tx)
+            if len(txs) == buffer:
+                write_edges(txs)
+                txs = []
+
+            if progressbar is not None:
+                progressbar.update(1)
+
+        if txs:
+            write_edges(txs)
+
+    def export(
+        self,
+        session: Session,
+        output_dir,
+        min_height: int = 0,
+        max_height: int = None,
+        shard_size: int = 1_000_000,
+        show_progressbar: bool = False
+    ) -> dict:
+        """Export all output vertices and haircut edges in a height range.
+
+        Args:
+            output_dir: Directory to write the files and manifest to. Created if needed.
+            min_height (int, optional): Defaults to 0.
+            max_height (int, optional): Defaults to the highest block in the database.
+            shard_size (int, optional): Number of output IDs per file. Defaults to 1,000,000.
+
+        Returns:
+            dict: The manifest, which is also written to manifest.json.
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        if max_height is None:
+            max_height = session.query(Tx.block_height).order_by(Tx.block_height.desc()).limit(1).scalar()
+            if max_height is None:
+                max_height = -1
+
+        vertex_writer = ShardedCSVWriter(output_dir, 'vertices', VERTEX_HEADER, shard_size)
+        edge_writer = ShardedCSVWriter(output_dir, 'edges', EDGE_HEADER, shard_size)
+
+        progressbar = None
+        if show_progressbar:
+            from tqdm import tqdm
+            tx_count = session.query(Tx.id)\
+                              .filter(Tx.block_height >= min_height, Tx.block_height <= max_height)\
+                              .count()
+            progressbar = tqdm(total=tx_count, desc="Exporting haircut edges", unit="tx")
+
+        try:
+            self.export_vertices(session, vertex_writer, min_height, max_height)
+            self.export_edges(session, edge_writer, min_height, max_height, progressbar=progressbar)
+        finally:
+            vertex_writer.close()
+            edge_writer.close()
+            if progressbar is not None:
+                progressbar.close()
+
+        manifest = {
+            'min_height': min_height,
+            'max_height': max_height,
+            'shard_size': shard_size,
+            'vertex_id_offset': VERTEX_ID_OFFSET,
+            'vertices': vertex_writer.shards,
+            'edges': edge_writer.shards
+        }
+        with open(output_dir / MANIFEST_FILENAME, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        return manifest
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from models.base import SessionLocal
+    from blockchain_data_provider import PersistentBlockchainAPIData
+
+    parser = argparse.ArgumentParser(description="Export the graph to files for JanusGraph bulk loading")
+    parser.add_argument('output_dir', type=str, help='Directory to write exported files to')
+    parser.add_argument('--start-height', default=0, type=int, dest='start_height',
+                        help='Block height to start exporting from')
+    parser.add_argument('--height', default=None, type=int, help='Block height up to which to export')
+    parser.add_argument('--shard-size', default=1_000_000, type=int, dest='shard_size',
+                        help='Number of output IDs per exported file')
+
+    args = parser.parse_args()
+
+    exporter = GraphBulkExporter(PersistentBlockchainAPIData())
+    with SessionLocal() as session:
+        manifest = exporter.export(session, args.output_dir,
+                                   min_height=args.start_height,
+                                   max_height=args.height,
+                                   shard_size=args.shard_size,
+                                   show_progressbar=True)
+
+    print(f"Exported {sum(shard['rows'] for shard in manifest['vertices'])} vertices and "
+          f"{sum(shard['rows'] for shard in manifest['edges'])} edges to {args.output_dir}")
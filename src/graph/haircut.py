@@ -0,0 +1,210 @@
+"""Functions for dividing the value of a transaction's inputs between its outputs.
+
+haircut() gives the value of a single edge. For whole transactions, and whole
+blocks of them, the edges are computed with NumPy instead: each transaction's
+edges form the outer product of its input and output values, divided by the
+sum of its inputs. Many transactions are handled at once by laying their
+inputs and outputs out in flat arrays, with CSR-style offsets marking where
+each transaction's inputs and outputs start.
+"""
+import numpy as np
+
+
+def haircut(input_value: float, sum_of_inputs: int, output_value: float) -> float:
+    """
+    Generic haircut function that finds the contribution of a single input to an output.
+    haircut_value = (input_value / sum_of_inputs) * output_value
+    """
+    return (input_value / sum_of_inputs) * output_value
+
+
+def haircut_matrix(input_values, output_values) -> np.ndarray:
+    """Haircut values of every edge in a transaction, as an (inputs x outputs) matrix.
+    All zero if the inputs sum to 0.
+    """
+    input_values = np.asarray(input_values, dtype=np.float64)
+    output_values = np.asarray(output_values, dtype=np.float64)
+    tx_sum = input_values.sum()
+    if tx_sum == 0:
+        return np.zeros((len(input_values), len(output_values)))
+    return np.outer(input_values / tx_sum, output_values)
+
+
+def segment_sums(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Sum each segment values[offsets[k]:offsets[k + 1]]. Empty segments sum to 0."""
+    if len(offsets) <= 1:
+        return np.zeros(0)
+    # reduceat needs every start to be a valid index, and gives values[start] for empty segments
+    padded = np.append(np.asarray(values, dtype=np.float64), 0.0)
+    sums = np.add.reduceat(padded, offsets[:-1])
+    sums[np.diff(offsets) == 0] = 0
+    return sums
+
+
+def haircut_edges(
+    input_values: np.ndarray,
+    input_offsets: np.ndarray,
+    output_values: np.ndarray,
+    output_offsets: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the haircut edges of many transactions at once.
+
+    Transaction k's inputs are input_values[input_offsets[k]:input_offsets[k + 1]],
+    and likewise for its outputs. Transactions whose inputs sum to 0 have no edges.
+
+    Returns:
+        (input indices, output indices, values): One entry per edge, indexing into the flat
+            input and output arrays. Edges are ordered by transaction, then output, then input.
+    """
+    input_values = np.asarray(input_values, dtype=np.float64)
+    output_values = np.asarray(output_values, dtype=np.float64)
+    input_offsets = np.asarray(input_offsets, dtype=np.int64)
+    output_offsets = np.asarray(output_offsets, dtype=np.int64)
+
+    tx_sums = segment_sums(input_values, input_offsets)
+    input_counts = np.diff(input_offsets)
+    output_counts = np.diff(output_offsets)
+    edge_counts = np.where(tx_sums > 0, input_counts * output_counts, 0)
+
+    edge_tx = np.repeat(np.arange(len(edge_counts)), edge_counts)
+    edge_offsets = np.concatenate(([0], np.cumsum(edge_counts)))
+    # position of each edge within its transaction
+    local = np.arange(edge_offsets[-1]) - edge_offsets[:-1][edge_tx]
+    tx_input_counts = input_counts[edge_tx]
+
+    input_index = input_offsets[:-1][edge_tx] + local % tx_input_counts
+    output_index = output_offsets[:-1][edge_tx] + local // tx_input_counts
+    values = (input_values[input_index] / tx_sums[edge_tx]) * output_values[output_index]
+
+    return input_index, output_index, values
+
+
+class TxArrays:
+    """The inputs' previous outputs and the outputs of transactions, laid out in flat arrays
+    with offsets marking where each transaction's inputs and outputs start.
+    Coinbase inputs, and inputs whose previous output isn't known, are left out.
+    """
+
+    def __init__(self, txs):
+        input_outputs, input_offsets = [], [0]
+        outputs, output_offsets = [], [0]
+
+        for tx in txs:
+            if not tx.is_coinbase():
+                input_outputs.extend(input.prev_out for input in tx.inputs if input.prev_out is not None)
+            input_offsets.append(len(input_outputs))
+
+            outputs.extend(tx.outputs)
+            output_offsets.append(len(outputs))
+
+        self.input_ids = np.array([output.id for output in input_outputs], dtype=np.int64)
+        self.input_values = np.array([output.value for output in input_outputs], dtype=np.float64)
+        self.input_valid = np.array([output.valid is not False for output in input_outputs], dtype=bool)
+        self.input_offsets = np.array(input_offsets, dtype=np.int64)
+
+        self.output_ids = np.array([output.id for output in outputs], dtype=np.int64)
+        self.output_values = np.array([output.value for output in outputs], dtype=np.float64)
+        self.output_valid = np.array([output.valid is not False for output in outputs], dtype=bool)
+        self.output_offsets = np.array(output_offsets, dtype=np.int64)
+
+    def haircut_edges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compute the haircut edges of the transactions, as indices into the flat arrays. See haircut_edges."""
+        return haircut_edges(self.input_values, self.input_offsets, self.output_values, self.output_offsets)
+
+
+def haircut_edges_for_txs(txs) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the haircut edges of transactions, with their inputs' previous outputs and outputs loaded.
+
+    Returns:
+        (previous output IDs, output IDs, values): One entry per edge, ordered by transaction,
+            then output, then input.
+    """
+    arrays = TxArrays(txs)
+    input_index, output_index, values = arrays.haircut_edges()
+    return arrays.input_ids[input_index], arrays.output_ids[output_index], values
+
+
+def calculate_proportions(input_values, output_values, manual_proportions):
+    """
+    We are using the haircut method to proportionally distribute input values
+    to output values. But sometimes it is also important that manual proportions
+    can be set.
+
+    This function takes in a transaction and a list of manual input-to-output
+    proportions and returns a list of input-to-output values.
+
+    The output format will be an adjacency matrix specifying the values
+    for each input-to-output pair. The input and output indices are the
+    indices of the input_values and output_values lists.
+
+    For example, if we have an input at index 0 with value 5, and an output
+    at index 2 with value 6, and we send 0.5 of the input to the output, then
+    the output of this function will include 2.5 at index (0, 2).
+
+    This process is tricky since we have to force certain input-to-output
+    pairs to have certain proportions, while also maintaining the haircut
+    distributions. For instances, if we send 0.5 of an input to an output,
+    the haircut method will try to force more from that input to the output.
+    So we need to re-distribute the remainder of this input-to-output
+    amount to the other outputs.
+
+    It is easy to check the correctness of the final values. The sum of the
+    final values for each input-to-output pair should equal the sum
+    of the output values. And the values for the manual proportions should
+    be as specified.
+
+    The manual proportions can be given as objects with input, output and proportion
+    attributes, or as (input index, output index, proportion) tuples. The result is an
+    (inputs x outputs) NumPy array.
+    """
+    input_values = np.asarray(input_values, dtype=np.float64)
+    output_values = np.asarray(output_values, dtype=np.float64)
+    result = np.zeros((len(input_values), len(output_values)))
+
+    manual = [
+        (p.input.index_in_tx, p.output.index_in_tx, p.proportion) if hasattr(p, 'proportion') else p
+        for p in manual_proportions
+    ]
+    if manual:
+        i, o, p = (np.asarray(column) for column in zip(*manual))
+        i, o, p = i.astype(np.int64), o.astype(np.int64), p.astype(np.float64)
+    else:
+        i, o, p = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # First, we distribute the manual proportions
+    # If any proportion is greater than 1, or causes the input value to
+    # be greater than the output value, then we raise an error
+    manual_values = input_values[i] * p
+    errors = [
+        (p > 1, "Manual proportion cannot be greater than 1"),
+        (manual_values > input_values[i], "Manual proportion cannot be greater than input value"),
+        (manual_values > output_values[o], "Manual proportion cannot be greater than output value"),
+    ]
+    invalid = np.any([mask for mask, _ in errors], axis=0)
+    if invalid.any():
+        first = np.argmax(invalid)
+        raise ValueError(next(message for mask, message in errors if mask[first]))
+
+    result[i, o] = manual_values
+    remaining_input_values = input_values.copy()
+    remaining_output_values = output_values.copy()
+    np.subtract.at(remaining_input_values, i, manual_values)
+    np.subtract.at(remaining_output_values, o, manual_values)
+
+    remaining_values_sum = remaining_input_values.sum()
+    if remaining_values_sum > 0:
+        # Next, distribute the remaining values proportionally. But the share of an
+        # input-to-output pair that has a manual proportion has to go to the other
+        # outputs, so it is set aside, and distributed in proportion to the other pairs' shares.
+        shares = np.outer(remaining_input_values, remaining_output_values) / remaining_values_sum
+        manual_edges = result > 0
+        amount_remaining = shares[manual_edges].sum()
+
+        non_manual_edges = ~manual_edges
+        non_manual_sum = shares[non_manual_edges].sum()
+        result[non_manual_edges] = shares[non_manual_edges]
+        # if every other pair's share is zero, there is nothing to distribute the remainder to
+        if non_manual_sum != 0:
+            result[non_manual_edges] += amount_remaining * (shares[non_manual_edges] / non_manual_sum)
+
+    return result
@@ -0,0 +1,276 @@
+"""A graph backend keeping output vertices and sent edges in NumPy arrays in the current process.
+
+Output IDs are dense, so they double as vertex IDs, and vertex properties are
+arrays indexed by them. Edges are kept in the order they were added, in growable
+arrays of previous output IDs, output IDs and values, with a flag marking edges
+which were dropped.
+
+Upserting edges looks up the edges going to each batch's outputs. Those lookups
+binary search runs of edge positions sorted by output ID: each batch of edges
+adds a run, and runs are merged like the digits of a binary counter, so there
+are only O(log E) of them. Outgoing edges are found through a CSR index over
+all edges, rebuilt when it is first needed after edges were added.
+
+adjacency() gives the live edges as a CSR (outgoing) or CSC (incoming) adjacency,
+for analysis over the whole graph.
+
+Nothing here is thread-safe, so batches are written one at a time
+(see PopulateOutputProportionGraph.writer_pool).
+"""
+from concurrent.futures import Future
+
+import numpy as np
+
+from graph.backend import GraphBackend, resolved
+
+
+# address_ids of outputs without an address
+NO_ADDRESS = -1
+# values and block_heights of outputs whose rows didn't have them
+UNKNOWN = -1
+
+
+def expand_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenate np.arange(start, end) for each start and end."""
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = starts - np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.arange(lengths.sum()) + np.repeat(offsets, lengths)
+
+
+def grown(array: np.ndarray, size: int, fill=0) -> np.ndarray:
+    """Copy array into a larger one, at least twice as large so appends stay cheap."""
+    larger = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+    larger[:len(array)] = array
+    return larger
+
+
+class InMemoryGraphBackend(GraphBackend):
+
+    persistent = False
+
+    def __init__(self, initial_vertices: int = 1_000_000, initial_edges: int = 1_000_000):
+        self.vertex_exists = np.zeros(initial_vertices, dtype=bool)
+        self.address_ids = np.full(initial_vertices, NO_ADDRESS, dtype=np.int64)
+        self.values = np.full(initial_vertices, UNKNOWN, dtype=np.int64)
+        self.block_heights = np.full(initial_vertices, UNKNOWN, dtype=np.int32)
+        self.pruned_values = np.zeros(initial_vertices)
+
+        self.edge_count = 0
+        self.edge_from = np.zeros(initial_edges, dtype=np.int64)
+        self.edge_to = np.zeros(initial_edges, dtype=np.int64)
+        self.edge_values = np.zeros(initial_edges)
+        self.edge_alive = np.zeros(initial_edges, dtype=bool)
+
+        # (output IDs, edge positions) sorted by output ID, for edges going to outputs
+        self.incoming_runs = []
+        # (number of edges covered, indptr, edge positions) for edges coming from outputs
+        self.outgoing_index = (0, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        # incremented by every write, so adjacency() knows when to rebuild
+        self.version = 0
+        self.adjacencies = {}
+
+    def __ensure_vertices(self, highest_output_id: int):
+        if highest_output_id < len(self.vertex_exists):
+            return
+        self.vertex_exists = grown(self.vertex_exists, highest_output_id + 1, False)
+        self.address_ids = grown(self.address_ids, highest_output_id + 1, NO_ADDRESS)
+        self.values = grown(self.values, highest_output_id + 1, UNKNOWN)
+        self.block_heights = grown(self.block_heights, highest_output_id + 1, UNKNOWN)
+        self.pruned_values = grown(self.pruned_values, highest_output_id + 1)
+
+    def __ensure_edges(self, edge_count: int):
+        if edge_count <= len(self.edge_from):
+            return
+        self.edge_from = grown(self.edge_from, edge_count)
+        self.edge_to = grown(self.edge_to, edge_count)
+        self.edge_values = grown(self.edge_values, edge_count)
+        self.edge_alive = grown(self.edge_alive, edge_count, False)
+
+    def __present(self, output_ids) -> np.ndarray:
+        """The given output IDs which have vertices."""
+        output_ids = np.unique(np.fromiter(output_ids, dtype=np.int64))
+        output_ids = output_ids[(output_ids >= 0) & (output_ids < len(self.vertex_exists))]
+        return output_ids[self.vertex_exists[output_ids]]
+
+    def __index_incoming(self, start: int, end: int):
+        to = self.edge_to[start:end]
+        order = np.argsort(to, kind='stable')
+        self.incoming_runs.append((to[order], np.arange(start, end)[order]))
+
+        while len(self.incoming_runs) > 1 and len(self.incoming_runs[-2][0]) <= 2 * len(self.incoming_runs[-1][0]):
+            (to_a, positions_a), (to_b, positions_b) = self.incoming_runs[-2:]
+            to = np.concatenate((to_a, to_b))
+            positions = np.concatenate((positions_a, positions_b))
+            order = np.argsort(to, kind='stable')
+            self.incoming_runs[-2:] = [(to[order], positions[order])]
+
+    def __incoming_positions(self, output_ids) -> np.ndarray:
+        output_ids = np.unique(np.fromiter(output_ids, dtype=np.int64))
+        found = [np.zeros(0, dtype=np.int64)]
+        for to, positions in self.incoming_runs:
+            starts = np.searchsorted(to, output_ids, 'left')
+            ends = np.searchsorted(to, output_ids, 'right')
+            found.append(positions[expand_ranges(starts, ends)])
+        positions = np.concatenate(found)
+        return positions[self.edge_alive[positions]]
+
+    def __outgoing_positions(self, output_ids) -> np.ndarray:
+        covered, indptr, positions = self.outgoing_index
+        if covered != self.edge_count:
+            order = np.argsort(self.edge_from[:self.edge_count], kind='stable')
+            counts = np.bincount(self.edge_from[:self.edge_count], minlength=len(self.vertex_exists))
+            indptr = np.concatenate(([0], np.cumsum(counts)))
+            positions = order
+            self.outgoing_index = (self.edge_count, indptr, positions)
+
+        output_ids = np.unique(np.fromiter(output_ids, dtype=np.int64))
+        output_ids = output_ids[(output_ids >= 0) & (output_ids < len(indptr) - 1)]
+        found = positions[expand_ranges(indptr[output_ids], indptr[output_ids + 1])]
+        return found[self.edge_alive[found]]
+
+    def existing_output_vertices(self, output_ids: list[int]) -> dict[int, int]:
+        return {output_id: output_id for output_id in self.__present(output_ids).tolist()}
+
+    def add_output_vertices_async(self, rows: list[dict]) -> Future:
+        if not rows:
+            return resolved([])
+
+        output_ids = np.array([row['output_id'] for row in rows], dtype=np.int64)
+        self.__ensure_vertices(output_ids.max())
+        self.vertex_exists[output_ids] = True
+        self.address_ids[output_ids] = [
+            row['address_id'] if row.get('address_id') is not None else NO_ADDRESS for row in rows
+        ]
+        for key, array in (('value', self.values), ('block_height', self.block_heights)):
+            array[output_ids] = [row[key] if row.get(key) is not None else UNKNOWN for row in rows]
+        self.pruned_values[output_ids] = [row.get('pruned_value') or 0 for row in rows]
+        self.version += 1
+        return resolved(output_ids.tolist())
+
+    def output_vertex_ids(self, output_ids: list[int]) -> dict[int, int]:
+        vertex_ids = self.existing_output_vertices(output_ids)
+        missing = [output_id for output_id in output_ids if output_id not in vertex_ids]
+        if missing:
+            raise ValueError(f"Outputs {missing[:10]} do not have vertices in the graph")
+        return vertex_ids
+
+    def sent_edge_values(self, output_ids: list[int]) -> dict[tuple[int, int], list[float]]:
+        positions = self.__incoming_positions(output_ids)
+        edges = {}
+        for prev_out_id, output_id, value in zip(self.edge_from[positions].tolist(),
+                                                 self.edge_to[positions].tolist(),
+                                                 self.edge_values[positions].tolist()):
+            edges.setdefault((prev_out_id, output_id), []).append(value)
+        return edges
+
+    def drop_sent_edges(self, vertex_pairs: list[tuple[int, int]]):
+        vertex_pairs = set(vertex_pairs)
+        positions = self.__incoming_positions({output_id for _, output_id in vertex_pairs})
+        pairs = zip(self.edge_from[positions].tolist(), self.edge_to[positions].tolist())
+        dropped = [position for position, pair in zip(positions.tolist(), pairs) if pair in vertex_pairs]
+        self.edge_alive[dropped] = False
+        self.version += 1
+
+    def add_sent_edges_async(self, edges: list[tuple[int, int, float]]) -> Future:
+        if not edges:
+            return resolved(0)
+
+        # like JanusGraph, edges can only be added between vertices which exist
+        self.output_vertex_ids({output_id for edge in edges for output_id in edge[:2]})
+
+        start, end = self.edge_count, self.edge_count + len(edges)
+        self.__ensure_edges(end)
+        prev_out_ids, output_ids, values = zip(*edges)
+        self.edge_from[start:end] = prev_out_ids
+        self.edge_to[start:end] = output_ids
+        self.edge_values[start:end] = values
+        self.edge_alive[start:end] = True
+        self.edge_count = end
+
+        self.__index_incoming(start, end)
+        self.version += 1
+        return resolved(len(edges))
+
+    def drop_vertices(self, label: str, key: str, values: list):
+        # only output vertices are kept, so there is nothing else to drop
+        if (label, key) != ('output', 'output_id'):
+            return
+
+        output_ids = self.__present(values)
+        self.edge_alive[self.__incoming_positions(output_ids)] = False
+        self.edge_alive[self.__outgoing_positions(output_ids)] = False
+        self.vertex_exists[output_ids] = False
+        self.address_ids[output_ids] = NO_ADDRESS
+        self.values[output_ids] = UNKNOWN
+        self.block_heights[output_ids] = UNKNOWN
+        self.pruned_values[output_ids] = 0
+        self.version += 1
+
+        if not self.vertex_exists.any():
+            # every edge is gone, so start the edge arrays and their indexes over
+            self.edge_count = 0
+            self.edge_alive[:] = False
+            self.incoming_runs = []
+            self.outgoing_index = (0, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def has_vertices(self) -> bool:
+        return bool(self.vertex_exists.any())
+
+    def drop_any_vertices(self, limit: int):
+        self.drop_vertices('output', 'output_id', np.flatnonzero(self.vertex_exists)[:limit])
+
+    def forget_vertex_ids(self, lowest_output_id: int = 0):
+        # vertex IDs are output IDs, so nothing is cached
+        pass
+
+    def sent_edges(self, output_ids: list[int], direction: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if direction == 'incoming':
+            positions = self.__incoming_positions(output_ids)
+        else:
+            positions = self.__outgoing_positions(output_ids)
+        return self.edge_from[positions], self.edge_to[positions], self.edge_values[positions]
+
+    def output_properties(self, output_ids: list[int]) -> dict[int, dict]:
+        properties = {}
+        for output_id in self.__present(output_ids).tolist():
+            properties[output_id] = {}
+            if self.address_ids[output_id] != NO_ADDRESS:
+                properties[output_id]['address_id'] = int(self.address_ids[output_id])
+            if self.values[output_id] != UNKNOWN:
+                properties[output_id]['value'] = int(self.values[output_id])
+            if self.block_heights[output_id] != UNKNOWN:
+                properties[output_id]['block_height'] = int(self.block_heights[output_id])
+            if self.pruned_values[output_id] > 0:
+                properties[output_id]['pruned_value'] = float(self.pruned_values[output_id])
+        return properties
+
+    def address_output_ids(self, address_id: int) -> list[int]:
+        return np.flatnonzero(self.vertex_exists & (self.address_ids == address_id)).tolist()
+
+    def adjacency(self, direction: str = 'outgoing') -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the live sent edges as a CSR adjacency over output IDs.
+
+        Args:
+            direction: 'outgoing' gives each output's edges to the outputs it sent value to,
+                'incoming' (the CSC adjacency) its edges from the outputs it received value from.
+
+        Returns:
+            (indptr, neighbour output IDs, values): The edges of output i are at indptr[i]:indptr[i + 1].
+        """
+        cached = self.adjacencies.get(direction)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        alive = np.flatnonzero(self.edge_alive[:self.edge_count])
+        if direction == 'incoming':
+            rows, neighbours = self.edge_to[alive], self.edge_from[alive]
+        else:
+            rows, neighbours = self.edge_from[alive], self.edge_to[alive]
+        order = np.argsort(rows, kind='stable')
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(self.vertex_exists)))))
+        adjacency = (indptr, neighbours[order], self.edge_values[alive][order])
+
+        self.adjacencies[direction] = (self.version, adjacency)
+        return adjacency
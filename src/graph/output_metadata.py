@@ -0,0 +1,105 @@
+"""Look up what trace graphs show about outputs, a chunk at a time, and remember it.
+
+Adding data to a trace graph used to load whole Output rows with their transactions and
+addresses through one IN list of every output in the graph, and did it again for pretty
+labels. OutputMetadataService reads only the columns graphs show, as compact records, with
+one "id = ANY(:ids)" query per chunk of outputs (see any_of), and keeps the most recently
+used records, so outputs shared by the graphs of a session are only read once.
+
+Output vertices also carry their value and block height (see GremlinBatchWriter.add_output_vertices_async),
+so tracing needs no records at all unless labels or addresses are wanted.
+"""
+from collections import OrderedDict
+import threading
+from typing import NamedTuple
+
+from models.base import SessionLocal
+from models.bitcoin_data import Tx, Output, Address, BITCOIN_TO_SATOSHI
+from blockchain_data_provider import any_of, chunked_indices
+
+
+class OutputRecord(NamedTuple):
+    block_height: int
+    tx_index_in_block: int
+    index_in_tx: int
+    value: int
+    address_id: int
+    address: str
+
+    def pretty_label(self) -> str:
+        """The label Output.pretty_label gives."""
+        location = f"{self.block_height}:{self.tx_index_in_block}:{self.index_in_tx}"
+        value_str = "{:.8f}".format(self.value / BITCOIN_TO_SATOSHI)
+        addr_str = self.address[:4] if self.address is not None else "No Address"
+        return f"{location} {addr_str} ({value_str})"
+
+
+class OutputMetadataService:
+
+    def __init__(self, sqlalchemy_session_factory: SessionLocal, max_entries: int = 1_000_000,
+                 chunk_size: int = 10_000):
+        """
+        Args:
+            max_entries (int, optional): Most output records remembered.
+            chunk_size (int, optional): Most outputs looked up in one query.
+        """
+        self.sqlalchemy_session_factory = sqlalchemy_session_factory
+        self.max_entries = max_entries
+        self.chunk_size = chunk_size
+
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, output_ids) -> dict[int, OutputRecord]:
+        """Get the records of outputs, keyed by output ID. Outputs which don't exist are left out."""
+        output_ids = list(dict.fromkeys(output_ids))
+        found = {}
+        with self.lock:
+            for output_id in output_ids:
+                record = self.records.get(output_id)
+                if record is not None:
+                    self.records.move_to_end(output_id)
+                    found[output_id] = record
+            missing = [output_id for output_id in output_ids if output_id not in found]
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if not missing:
+            return found
+
+        with self.sqlalchemy_session_factory() as session:
+            for start, end in chunked_indices(missing, self.chunk_size):
+                rows = session.query(Output.id, Tx.block_height, Tx.index_in_block, Output.index_in_tx,
+                                     Output.value, Output.address_id, Address.addr)\
+                              .join(Tx, Output.tx_id == Tx.id)\
+                              .outerjoin(Address, Output.address_id == Address.id)\
+                              .filter(any_of(session, Output.id, missing[start:end]))\
+                              .all()
+                for output_id, *fields in rows:
+                    found[output_id] = OutputRecord(*fields)
+
+        with self.lock:
+            for output_id in missing:
+                if output_id in found:
+                    self.records[output_id] = found[output_id]
+            while len(self.records) > self.max_entries:
+                self.records.popitem(last=False)
+
+        return found
+
+    def addresses(self, address_ids) -> dict[int, str]:
+        """Get the addresses with the given IDs, keyed by ID."""
+        address_ids = list(dict.fromkeys(address_ids))
+        found = {}
+        if not address_ids:
+            return found
+
+        with self.sqlalchemy_session_factory() as session:
+            for start, end in chunked_indices(address_ids, self.chunk_size):
+                rows = session.query(Address.id, Address.addr)\
+                              .filter(any_of(session, Address.id, address_ids[start:end]))\
+                              .all()
+                found.update(dict(rows))
+        return found
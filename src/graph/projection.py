@@ -0,0 +1,78 @@
+"""The ways transactions can be projected onto the graph.
+
+In the output projection, a transaction is a sent edge from each of its inputs'
+previous outputs to each of its outputs, carrying the haircut value. A transaction
+with m inputs and n outputs has m * n edges, which makes large transactions
+dominate the size of the graph (see docs/LARGE_TRANSACTIONS.md).
+
+In the tx projection, a transaction is a tx vertex. Each previous output it spends
+has a spent edge to it, carrying the input's value, and it has a created edge to
+each of its outputs, carrying the output's value, so it has m + n edges. The haircut
+value from a previous output to an output is derived when the graph is read:
+
+    spent value / tx input_value * created value
+
+where input_value, the sum of the transaction's inputs, is stored on the tx vertex.
+"""
+import networkx as nx
+from gremlin_python.process.graph_traversal import __
+
+
+OUTPUT_PROJECTION = 'output'
+TX_PROJECTION = 'tx'
+PROJECTIONS = (OUTPUT_PROJECTION, TX_PROJECTION)
+
+
+def check_projection(projection: str):
+    if projection not in PROJECTIONS:
+        raise ValueError(f"projection must be one of {PROJECTIONS}, not {projection!r}")
+
+
+def forward_step(projection: str):
+    """A traversal step from outputs to the outputs their value was sent to, keeping the edges in the path."""
+    if projection == TX_PROJECTION:
+        return __.outE('spent').inV().outE('created').inV()
+    return __.outE('sent').inV()
+
+
+def backward_step(projection: str):
+    """A traversal step from outputs to the outputs their value came from, keeping the edges in the path."""
+    if projection == TX_PROJECTION:
+        return __.inE('created').outV().inE('spent').outV()
+    return __.inE('sent').outV()
+
+
+def both_step(projection: str):
+    """A traversal step from outputs to the outputs they sent value to or received it from."""
+    if projection == TX_PROJECTION:
+        return __.union(forward_step(projection), backward_step(projection))
+    return __.bothE('sent').otherV()
+
+
+def collapse_tx_vertices(graph: nx.DiGraph) -> nx.DiGraph:
+    """Replace tx vertices in a networkx graph with sent edges between the outputs around them.
+
+    Each sent edge gets the haircut value derived from the spent and created edges it replaces.
+    Only edges whose spent and created edges are both in the graph are created.
+    Graphs without tx vertices are returned unchanged.
+
+    Returns:
+        nx.DiGraph: A copy of graph, if it had tx vertices.
+    """
+    tx_nodes = [node for node, label in graph.nodes(data='label') if label == 'tx']
+    if not tx_nodes:
+        return graph
+
+    graph = graph.copy()
+    for tx_node in tx_nodes:
+        input_value = graph.nodes[tx_node].get('input_value') or 0
+        if input_value > 0:
+            for prev_out in graph.predecessors(tx_node):
+                spent_value = graph.edges[prev_out, tx_node]['value']
+                for output in graph.successors(tx_node):
+                    created_value = graph.edges[tx_node, output]['value']
+                    graph.add_edge(prev_out, output, label='sent',
+                                   value=spent_value / input_value * created_value)
+        graph.remove_node(tx_node)
+
+    return graph
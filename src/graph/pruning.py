@@ -0,0 +1,113 @@
+"""Leave dust, unspendable outputs and negligible haircut edges out of the graph.
+
+Much of the graph carries almost no value: outputs which can never be spent,
+outputs worth a few satoshis, and haircut edges worth a tiny fraction of their
+input, which large transactions produce by the hundred thousand. A PruningPolicy
+leaves them out during batch population.
+
+An output can receive value over edges which are pruned. Their total is stored in
+the output vertex's pruned_value property, so tracing can still account for all of
+the value the output received (see GraphAnalyzer.get_coin_traces). Edges are pruned
+the same way when vertices and edges are populated, so vertices get their
+pruned_value before their edges exist.
+"""
+import numpy as np
+
+from graph.haircut import TxArrays
+
+
+class PruningPolicy:
+
+    def __init__(
+        self,
+        min_edge_value: float = 0,
+        min_input_fraction: float = 0,
+        skip_unspendable: bool = False,
+        min_output_value: int = 0,
+        top_k_inputs: int = None
+    ):
+        """
+        Args:
+            min_edge_value (float, optional): Edges worth fewer satoshis than this are pruned. Defaults to 0.
+            min_input_fraction (float, optional): Edges carrying less than this fraction of their input's
+                value are pruned. Defaults to 0.
+            skip_unspendable (bool, optional): Leave out outputs which aren't valid, i.e. can never be spent.
+                Defaults to False.
+            min_output_value (int, optional): Leave out outputs worth fewer satoshis than this. 1 leaves out
+                outputs with no value. Defaults to 0.
+            top_k_inputs (int, optional): Only keep the edges from the k inputs which send each output the most.
+                Defaults to keeping all of them.
+        """
+        if top_k_inputs is not None and top_k_inputs < 1:
+            raise ValueError("top_k_inputs must be at least 1")
+
+        self.min_edge_value = min_edge_value
+        self.min_input_fraction = min_input_fraction
+        self.skip_unspendable = skip_unspendable
+        self.min_output_value = min_output_value
+        self.top_k_inputs = top_k_inputs
+
+    @property
+    def prunes_outputs(self) -> bool:
+        return self.skip_unspendable or self.min_output_value > 0
+
+    @property
+    def prunes_haircut_edges(self) -> bool:
+        """Whether edges between outputs which are kept can be pruned."""
+        return self.min_edge_value > 0 or self.min_input_fraction > 0 or self.top_k_inputs is not None
+
+    @property
+    def prunes_edges(self) -> bool:
+        return self.prunes_outputs or self.prunes_haircut_edges
+
+    def keep_output(self, output) -> bool:
+        """Whether an output gets a vertex."""
+        if self.skip_unspendable and output.valid is False:
+            return False
+        return output.value >= self.min_output_value
+
+    def __keep_outputs(self, values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        keep = values >= self.min_output_value
+        if self.skip_unspendable:
+            keep &= valid
+        return keep
+
+    def haircut_edges(self, txs) -> tuple[np.ndarray, np.ndarray, np.ndarray, dict[int, float]]:
+        """Compute the haircut edges of transactions, leaving out those the policy prunes.
+
+        Edges to or from outputs which are left out are pruned too.
+
+        Returns:
+            (previous output IDs, output IDs, values, pruned values): The kept edges, ordered like
+                haircut_edges_for_txs, and the total value of the pruned edges going to each output
+                which is kept, for outputs with any.
+        """
+        arrays = TxArrays(txs)
+        input_index, output_index, values = arrays.haircut_edges()
+        if not self.prunes_edges:
+            return arrays.input_ids[input_index], arrays.output_ids[output_index], values, {}
+
+        output_kept = self.__keep_outputs(arrays.output_values, arrays.output_valid)
+        keep = output_kept[output_index] & self.__keep_outputs(arrays.input_values, arrays.input_valid)[input_index]
+        keep &= values >= self.min_edge_value
+        if self.min_input_fraction > 0:
+            keep &= values >= self.min_input_fraction * arrays.input_values[input_index]
+
+        if self.top_k_inputs is not None:
+            # rank each output's kept edges by value, largest first
+            candidates = np.flatnonzero(keep)
+            order = candidates[np.lexsort((-values[candidates], output_index[candidates]))]
+            sorted_outputs = output_index[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_outputs[1:] != sorted_outputs[:-1]])
+            group_sizes = np.diff(np.r_[group_starts, len(order)])
+            ranks = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+            keep[order[ranks >= self.top_k_inputs]] = False
+
+        pruned = ~keep & output_kept[output_index]
+        pruned_values = np.bincount(output_index[pruned], weights=values[pruned], minlength=len(arrays.output_ids))
+        residuals = {
+            int(arrays.output_ids[o]): float(pruned_values[o])
+            for o in np.flatnonzero(pruned_values > 0)
+        }
+
+        return arrays.input_ids[input_index[keep]], arrays.output_ids[output_index[keep]], values[keep], residuals
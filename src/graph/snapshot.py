@@ -0,0 +1,333 @@
+"""An on-disk snapshot of the output proportion graph as CSR and CSC arrays, for whole-graph analytics.
+
+Gremlin traversals visit the graph an element at a time over a websocket, which is far
+too slow for centrality, components or tracing many outputs at once. A snapshot holds
+the haircut edges computed from postgres in flat binary files which readers open with
+np.memmap, so nothing is loaded until it is touched, and processes share the page cache.
+
+Output IDs are dense, so they index the vertex arrays directly:
+
+    address_id  int64  the output's address, or NO_ADDRESS
+    height      int32  the height of the block the output was created in, or -1 for gaps
+    value       int64  the output's value in satoshis
+
+Edges are stored twice, as (indptr, indices, weights) arrays in the scipy.sparse layout:
+
+    csc_*  grouped by the output an edge goes to; indices are the previous outputs
+    csr_*  grouped by the previous output an edge comes from; indices are the outputs
+
+A transaction's edges all go to its own outputs, whose IDs are higher than any earlier
+transaction's, so edges are computed in CSC order. Appending new blocks appends to the
+CSC files in place. The CSR files are regenerated from the CSC ones with a counting sort,
+a chunk at a time, so neither has to fit in memory.
+
+manifest.json is written last, and records how many vertices and edges the files hold.
+Anything past that, left by an interrupted append, is ignored and overwritten.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models.bitcoin_data import Tx
+from blockchain_data_provider import BlockchainDataProviderADT
+from graph.haircut import haircut_edges_for_txs
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# address_id of outputs without an address
+NO_ADDRESS = -1
+
+VERTEX_ARRAYS = {'address_id': np.int64, 'height': np.int32, 'value': np.int64}
+INDPTR_DTYPE = np.int64
+INDICES_DTYPE = np.int64
+WEIGHTS_DTYPE = np.float64
+
+
+def empty_manifest() -> dict:
+    return {'max_height': -1, 'vertex_count': 0, 'edge_count': 0, 'csr_edge_count': 0}
+
+
+def open_array(path: Path, dtype, length: int, mode: str = 'r') -> np.ndarray:
+    """Memory-map the first length items of a binary file."""
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(length,))
+
+
+class GraphSnapshot:
+    """Read-only access to a snapshot, memory-mapped from its files."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / MANIFEST_FILENAME) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.max_height = self.manifest['max_height']
+        self.vertex_count = self.manifest['vertex_count']
+        self.edge_count = self.manifest['edge_count']
+
+        self.address_ids = open_array(self.path / 'address_id.bin', VERTEX_ARRAYS['address_id'], self.vertex_count)
+        self.heights = open_array(self.path / 'height.bin', VERTEX_ARRAYS['height'], self.vertex_count)
+        self.values = open_array(self.path / 'value.bin', VERTEX_ARRAYS['value'], self.vertex_count)
+
+    def __arrays(self, prefix: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (
+            open_array(self.path / f'{prefix}_indptr.bin', INDPTR_DTYPE, self.vertex_count + 1),
+            open_array(self.path / f'{prefix}_indices.bin', INDICES_DTYPE, self.edge_count),
+            open_array(self.path / f'{prefix}_weights.bin', WEIGHTS_DTYPE, self.edge_count)
+        )
+
+    def csc(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(indptr, previous output IDs, values): the edges going to output i are at indptr[i]:indptr[i + 1]."""
+        return self.__arrays('csc')
+
+    def csr(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(indptr, output IDs, values): the edges coming from output i are at indptr[i]:indptr[i + 1]."""
+        if self.manifest['csr_edge_count'] != self.edge_count:
+            raise ValueError(f"The CSR arrays of the snapshot at {self.path} weren't built. "
+                             "Build it again with build_csr=True.")
+        return self.__arrays('csr')
+
+    def in_edges(self, output_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """The previous outputs which sent value to an output, and the values they sent."""
+        indptr, indices, weights = self.csc()
+        start, end = indptr[output_id], indptr[output_id + 1]
+        return np.asarray(indices[start:end]), np.asarray(weights[start:end])
+
+    def out_edges(self, output_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """The outputs an output sent value to, and the values it sent."""
+        indptr, indices, weights = self.csr()
+        start, end = indptr[output_id], indptr[output_id + 1]
+        return np.asarray(indices[start:end]), np.asarray(weights[start:end])
+
+
+class GraphSnapshotBuilder:
+
+    def __init__(self, data_provider: BlockchainDataProviderADT):
+        self.data_provider = data_provider
+
+    @staticmethod
+    def read_manifest(path: Path) -> dict:
+        manifest_path = path / MANIFEST_FILENAME
+        if not manifest_path.exists():
+            return empty_manifest()
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    @staticmethod
+    def write_manifest(path: Path, manifest: dict):
+        # replaced in one step, so readers never see a partly written manifest
+        temporary_path = path / f'{MANIFEST_FILENAME}.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        temporary_path.replace(path / MANIFEST_FILENAME)
+
+    @staticmethod
+    def truncate(path: Path, dtype, length: int):
+        """Cut a file down to length items, dropping anything an interrupted append left behind."""
+        with open(path, 'ab') as file:
+            file.truncate(length * np.dtype(dtype).itemsize)
+
+    def build(
+        self,
+        session: Session,
+        path,
+        max_height: int = None,
+        build_csr: bool = True,
+        buffer: int = 20_000,
+        show_progressbar: bool = False
+    ) -> dict:
+        """Build a snapshot up to a height, appending the blocks above the height it already covers.
+
+        Args:
+            path: Directory of the snapshot. Created if needed.
+            max_height (int, optional): Defaults to the highest block in the database.
+            build_csr (bool, optional): Regenerate the CSR arrays, which reading outgoing edges needs.
+                When appending several times in a row, it can be left until the last. Defaults to True.
+            buffer (int, optional): Number of transactions read and whose edges are computed at once.
+
+        Returns:
+            dict: The manifest.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        manifest = self.read_manifest(path)
+
+        if max_height is None:
+            max_height = session.query(Tx.block_height).order_by(Tx.block_height.desc()).limit(1).scalar()
+            if max_height is None:
+                max_height = -1
+
+        if max_height > manifest['max_height']:
+            self.append_blocks(session, path, manifest, manifest['max_height'] + 1, max_height,
+                               buffer, show_progressbar)
+            manifest['max_height'] = max_height
+            self.write_manifest(path, manifest)
+
+        if build_csr and manifest['csr_edge_count'] != manifest['edge_count']:
+            self.build_csr(path, manifest)
+            manifest['csr_edge_count'] = manifest['edge_count']
+            self.write_manifest(path, manifest)
+
+        return manifest
+
+    def append_blocks(
+        self,
+        session: Session,
+        path: Path,
+        manifest: dict,
+        min_height: int,
+        max_height: int,
+        buffer: int,
+        show_progressbar: bool
+    ):
+        """Append the vertices and CSC edges of the outputs in a height range, updating the counts in manifest."""
+        for name, dtype in VERTEX_ARRAYS.items():
+            self.truncate(path / f'{name}.bin', dtype, manifest['vertex_count'])
+        self.truncate(path / 'csc_indptr.bin', INDPTR_DTYPE, manifest['vertex_count'] + 1)
+        self.truncate(path / 'csc_indices.bin', INDICES_DTYPE, manifest['edge_count'])
+        self.truncate(path / 'csc_weights.bin', WEIGHTS_DTYPE, manifest['edge_count'])
+
+        if manifest['vertex_count'] == 0:
+            np.zeros(1, dtype=INDPTR_DTYPE).tofile(path / 'csc_indptr.bin')
+
+        progressbar = None
+        if show_progressbar:
+            from tqdm import tqdm
+            tx_count = session.query(Tx.id)\
+                              .filter(Tx.block_height >= min_height, Tx.block_height <= max_height)\
+                              .count()
+            progressbar = tqdm(total=tx_count, desc="Building graph snapshot", unit="tx")
+
+        names = list(VERTEX_ARRAYS) + ['csc_indptr', 'csc_indices', 'csc_weights']
+        files = {name: open(path / f'{name}.bin', 'ab') for name in names}
+        try:
+            txs = []
+            tx: Tx
+            for tx in self.data_provider.get_txs_for_blocks(session, min_height, max_height, buffer=buffer):
+                txs.append(tx)
+                if len(txs) == buffer:
+                    self.append_txs(files, manifest, txs)
+                    txs = []
+
+                if progressbar is not None:
+                    progressbar.update(1)
+
+            if txs:
+                self.append_txs(files, manifest, txs)
+        finally:
+            for file in files.values():
+                file.close()
+            if progressbar is not None:
+                progressbar.close()
+
+    @staticmethod
+    def append_txs(files: dict, manifest: dict, txs: list[Tx]):
+        outputs = [(output, tx.block_height) for tx in txs for output in tx.outputs]
+        if not outputs:
+            return
+
+        output_ids = np.array([output.id for output, _ in outputs], dtype=np.int64)
+        vertex_count = manifest['vertex_count']
+        if output_ids.min() < vertex_count:
+            raise ValueError(f"Output {output_ids.min()} is already in the snapshot. "
+                             "Snapshots can only be appended to with higher blocks.")
+        new_vertex_count = int(output_ids.max()) + 1
+
+        # outputs missing from the database leave gaps, which get no address, height or value
+        arrays = {
+            'address_id': np.full(new_vertex_count - vertex_count, NO_ADDRESS, dtype=VERTEX_ARRAYS['address_id']),
+            'height': np.full(new_vertex_count - vertex_count, -1, dtype=VERTEX_ARRAYS['height']),
+            'value': np.zeros(new_vertex_count - vertex_count, dtype=VERTEX_ARRAYS['value'])
+        }
+        positions = output_ids - vertex_count
+        arrays['address_id'][positions] = [
+            output.address_id if output.address_id is not None else NO_ADDRESS for output, _ in outputs
+        ]
+        arrays['height'][positions] = [height for _, height in outputs]
+        arrays['value'][positions] = [output.value for output, _ in outputs]
+
+        prev_out_ids, edge_output_ids, values = haircut_edges_for_txs(txs)
+        order = np.argsort(edge_output_ids, kind='stable')
+        prev_out_ids, edge_output_ids, values = prev_out_ids[order], edge_output_ids[order], values[order]
+        counts = np.bincount(edge_output_ids - vertex_count, minlength=new_vertex_count - vertex_count)
+        indptr = manifest['edge_count'] + np.cumsum(counts)
+
+        for name, array in arrays.items():
+            array.tofile(files[name])
+        indptr.astype(INDPTR_DTYPE).tofile(files['csc_indptr'])
+        prev_out_ids.astype(INDICES_DTYPE).tofile(files['csc_indices'])
+        values.astype(WEIGHTS_DTYPE).tofile(files['csc_weights'])
+
+        manifest['vertex_count'] = new_vertex_count
+        manifest['edge_count'] += len(values)
+
+    @staticmethod
+    def build_csr(path: Path, manifest: dict, chunk_size: int = 10_000_000):
+        """Regenerate the CSR arrays from the CSC ones with a counting sort, a chunk of edges at a time.
+        Each output's edges stay in the order of the outputs they go to.
+        """
+        vertex_count, edge_count = manifest['vertex_count'], manifest['edge_count']
+        csc_indptr = open_array(path / 'csc_indptr.bin', INDPTR_DTYPE, vertex_count + 1)
+        csc_indices = open_array(path / 'csc_indices.bin', INDICES_DTYPE, edge_count)
+        csc_weights = open_array(path / 'csc_weights.bin', WEIGHTS_DTYPE, edge_count)
+
+        chunks = [(start, min(start + chunk_size, edge_count)) for start in range(0, edge_count, chunk_size)]
+
+        counts = np.zeros(vertex_count, dtype=np.int64)
+        for start, end in chunks:
+            counts += np.bincount(csc_indices[start:end], minlength=vertex_count)
+        csr_indptr = np.concatenate(([0], np.cumsum(counts))).astype(INDPTR_DTYPE)
+        csr_indptr.tofile(path / 'csr_indptr.bin')
+
+        for name, dtype in (('csr_indices', INDICES_DTYPE), ('csr_weights', WEIGHTS_DTYPE)):
+            with open(path / f'{name}.bin', 'wb') as file:
+                file.truncate(edge_count * np.dtype(dtype).itemsize)
+        csr_indices = open_array(path / 'csr_indices.bin', INDICES_DTYPE, edge_count, mode='r+')
+        csr_weights = open_array(path / 'csr_weights.bin', WEIGHTS_DTYPE, edge_count, mode='r+')
+
+        # where the next edge from each previous output goes
+        cursor = csr_indptr[:-1].copy()
+        for start, end in chunks:
+            prev_out_ids = np.asarray(csc_indices[start:end])
+            output_ids = np.searchsorted(csc_indptr, np.arange(start, end), side='right') - 1
+
+            order = np.argsort(prev_out_ids, kind='stable')
+            sorted_prev_out_ids = prev_out_ids[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_prev_out_ids[1:] != sorted_prev_out_ids[:-1]])
+            ranks = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(order)]))
+            destinations = cursor[sorted_prev_out_ids] + ranks
+
+            csr_indices[destinations] = output_ids[order]
+            csr_weights[destinations] = np.asarray(csc_weights[start:end])[order]
+            cursor += np.bincount(prev_out_ids, minlength=vertex_count)
+
+        if edge_count:
+            csr_indices.flush()
+            csr_weights.flush()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from models.base import SessionLocal
+    from blockchain_data_provider import PersistentBlockchainAPIData
+
+    parser = argparse.ArgumentParser(description="Build or extend a memory-mapped snapshot of the graph")
+    parser.add_argument('path', type=str, help='Directory of the snapshot')
+    parser.add_argument('--height', default=None, type=int, help='Block height up to which to build')
+    parser.add_argument('--skip-csr', default=False, action='store_true', dest='skip_csr',
+                        help='Only append to the CSC arrays, leaving the CSR arrays to be built later')
+
+    args = parser.parse_args()
+
+    builder = GraphSnapshotBuilder(PersistentBlockchainAPIData())
+    with SessionLocal() as session:
+        manifest = builder.build(session, args.path, max_height=args.height, build_csr=not args.skip_csr,
+                                 show_progressbar=True)
+
+    print(f"Snapshot at {args.path} has {manifest['vertex_count']} vertices and {manifest['edge_count']} edges "
+          f"up to block {manifest['max_height']}")
@@ -0,0 +1,164 @@
+"""Extract the n-hop neighbourhood of outputs level by level, rather than path by path.
+
+get_vertex_history and the like repeat a step with emit(), and traversal_to_networkx
+serializes every path the traversal found, so a vertex reachable over many paths, and
+each path's shared prefix, is sent over and over. SubgraphExtractor runs the breadth-first
+search from the client instead: each level fetches the edges of the whole frontier in one
+batched g.V(ids).bothE(...) request, and only vertices which weren't visited yet go on to
+the next level. Every vertex and edge is fetched once, and the search stops at a depth or
+when the graph grows past a vertex or edge budget.
+
+In the tx projection (see graph/projection.py), an output's neighbours are two levels away,
+through a tx vertex, so depth is still counted in hops between outputs. Searching in both directions
+there also reaches the other outputs spent by the same transaction within a hop.
+"""
+import networkx as nx
+from gremlin_python.process.traversal import T, Direction
+from gremlin_python.process.graph_traversal import GraphTraversalSource
+
+from graph.projection import OUTPUT_PROJECTION, TX_PROJECTION, check_projection, collapse_tx_vertices
+
+
+EDGE_LABELS = {OUTPUT_PROJECTION: ('sent',), TX_PROJECTION: ('spent', 'created')}
+DIRECTIONS = ('incoming', 'outgoing', 'both')
+
+
+class Subgraph:
+    """The vertices and edges a SubgraphExtractor found, each once.
+
+    Attributes:
+        vertices: Properties of each vertex, including its 'label', keyed by vertex ID.
+        edges: The 'label' and 'value' of each edge, keyed by (from vertex ID, to vertex ID).
+        truncated: Whether the extraction stopped at the vertex or edge budget with vertices left to visit.
+    """
+
+    def __init__(self):
+        self.vertices: dict[int, dict] = {}
+        self.edges: dict[tuple[int, int], dict] = {}
+        self.truncated = False
+
+    def to_networkx(self, collapse_txs: bool = True) -> nx.DiGraph:
+        """The subgraph as the networkx graph traversal_to_networkx would give for it.
+
+        Args:
+            collapse_txs: In the tx projection, whether to replace tx vertices with sent edges
+                          carrying haircut values, so the graph looks like the output projection.
+        """
+        nx_graph = nx.DiGraph()
+        nx_graph.add_nodes_from(self.vertices.items())
+        nx_graph.add_edges_from((u, v, data) for (u, v), data in self.edges.items())
+        if collapse_txs:
+            nx_graph = collapse_tx_vertices(nx_graph)
+        return nx_graph
+
+
+class SubgraphExtractor:
+
+    def __init__(self, g: GraphTraversalSource, projection: str = OUTPUT_PROJECTION, batch_size: int = 1_000):
+        """
+        Args:
+            projection (str, optional): How the graph was populated. See graph/projection.py.
+            batch_size (int, optional): Most vertex IDs sent in one request. Larger frontiers take several.
+        """
+        check_projection(projection)
+        self.g = g
+        self.projection = projection
+        self.batch_size = batch_size
+
+    def start_vertices(self, vertex_id: int, vertex_type: str) -> list:
+        """The IDs of the output vertex, or of an address's output vertices, to start from."""
+        key = 'output_id' if vertex_type == 'output' else 'address_id'
+        return self.g.V().has('output', key, vertex_id).id_().toList()
+
+    def frontier_edges(self, vertex_ids: list, direction: str) -> list[tuple]:
+        """Fetch the edges of vertices, each once.
+
+        Returns:
+            list[tuple]: (from vertex ID, to vertex ID, label, value) for each edge.
+        """
+        labels = EDGE_LABELS[self.projection]
+        edges = []
+        for start in range(0, len(vertex_ids), self.batch_size):
+            traversal = self.g.V(*vertex_ids[start:start + self.batch_size])
+            if direction == 'incoming':
+                traversal = traversal.inE(*labels)
+            elif direction == 'outgoing':
+                traversal = traversal.outE(*labels)
+            else:
+                traversal = traversal.bothE(*labels)
+            for edge in traversal.dedup().elementMap().toList():
+                edges.append((edge[Direction.OUT][T.id], edge[Direction.IN][T.id], edge[T.label], edge['value']))
+        return edges
+
+    def vertex_properties(self, vertex_ids: list) -> dict:
+        """Fetch the properties of vertices, including their 'label', keyed by vertex ID."""
+        properties = {}
+        for start in range(0, len(vertex_ids), self.batch_size):
+            for element in self.g.V(*vertex_ids[start:start + self.batch_size]).elementMap().toList():
+                vertex_id = element.pop(T.id)
+                properties[vertex_id] = {'label': element.pop(T.label), **element}
+        return properties
+
+    def extract(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str = 'both',
+        depth: int = None,
+        max_vertices: int = None,
+        max_edges: int = None
+    ) -> Subgraph:
+        """Extract the neighbourhood of an output, or of an address's outputs, breadth first.
+
+        Args:
+            vertex_id: The ID of the output or address to start from.
+            vertex_type: The type of ID being provided ('output' or 'address').
+            direction: 'incoming' to follow where the coins came from, like get_vertex_history,
+                'outgoing' where they went, like get_vertex_path, or 'both', like get_vertex_subgraph.
+            depth (int, optional): The maximum number of hops between outputs. Defaults to no limit.
+            max_vertices (int, optional): Stop once the subgraph has this many vertices.
+            max_edges (int, optional): Stop once the subgraph has this many edges.
+
+        Returns:
+            Subgraph: Edges to vertices past the budgets are left out.
+        """
+        assert vertex_type in ['output', 'address'], "vertex_type must be 'output' or 'address'"
+        assert direction in DIRECTIONS, f"direction must be one of {DIRECTIONS}"
+        if depth is not None:
+            assert isinstance(depth, int) and depth > 0, "depth must be a positive integer"
+
+        # each hop between outputs passes through a tx vertex in the tx projection
+        levels = None if depth is None else depth * len(EDGE_LABELS[self.projection])
+
+        subgraph = Subgraph()
+        frontier = list(dict.fromkeys(self.start_vertices(vertex_id, vertex_type)))
+        if max_vertices is not None and len(frontier) > max_vertices:
+            frontier = frontier[:max_vertices]
+            subgraph.truncated = True
+        visited = set(frontier)
+
+        level = 0
+        while frontier and (levels is None or level < levels) and not subgraph.truncated:
+            next_frontier = []
+            for from_id, to_id, label, value in self.frontier_edges(frontier, direction):
+                if (from_id, to_id) in subgraph.edges:
+                    continue
+                if max_edges is not None and len(subgraph.edges) >= max_edges:
+                    subgraph.truncated = True
+                    break
+
+                other_id = to_id if from_id in visited else from_id
+                if other_id not in visited:
+                    if max_vertices is not None and len(visited) >= max_vertices:
+                        subgraph.truncated = True
+                        continue
+                    visited.add(other_id)
+                    next_frontier.append(other_id)
+
+                subgraph.edges[(from_id, to_id)] = {'label': label, 'value': float(value)}
+
+            frontier = next_frontier
+            level += 1
+
+        subgraph.vertices = self.vertex_properties(list(visited))
+        return subgraph
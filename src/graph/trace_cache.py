@@ -0,0 +1,150 @@
+"""Cache GraphAnalyzer's trace graphs and coin traces between calls.
+
+Building a trace graph runs traversals against the graph and enrichment queries against
+postgres, and notebooks tend to ask for the same ones again and again. A TraceCache keeps
+recent results in memory, evicting the least recently used, and, if given a directory,
+every result on disk as a gzipped pickle, so they survive restarts.
+
+Results are keyed by what was asked for and the height the graph was populated to when
+they were computed. Once population moves past that height, a result may be missing
+value which was sent since, so invalidate() drops everything computed at lower heights.
+
+Callers get copies of the results kept, so modifying a graph, e.g. with add_output_data,
+doesn't change what later lookups get.
+"""
+from collections import OrderedDict
+import copy
+import gzip
+import hashlib
+import pickle
+import threading
+from pathlib import Path
+
+import networkx as nx
+
+
+# what get gives for results which aren't cached, since None can be a result
+MISSING = object()
+
+
+def copied(value):
+    """A copy of a result which can be modified without changing the original."""
+    # attribute values are numbers and strings, so copying the graph's attribute dicts is enough
+    if isinstance(value, nx.Graph):
+        return value.copy()
+    return copy.deepcopy(value)
+
+
+class TraceCache:
+
+    def __init__(self, max_entries: int = 128, path=None):
+        """
+        Args:
+            max_entries (int, optional): Most results kept in memory.
+            path (optional): Directory to also keep results in, on disk. Defaults to keeping them only in memory.
+        """
+        self.max_entries = max_entries
+        self.path = Path(path) if path is not None else None
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def file_path(self, key: tuple, height: int) -> Path:
+        # the height leads the name, so stale files can be found without opening them
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.path / f'{height}-{digest}.pkl.gz'
+
+    def __remember(self, key: tuple, height: int, value):
+        self.entries[(key, height)] = value
+        self.entries.move_to_end((key, height))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: tuple, height: int):
+        """Get a copy of the result for key computed at height, or MISSING if there isn't one."""
+        with self.lock:
+            if (key, height) in self.entries:
+                self.entries.move_to_end((key, height))
+                self.hits += 1
+                return copied(self.entries[(key, height)])
+
+            if self.path is not None and self.file_path(key, height).exists():
+                with gzip.open(self.file_path(key, height), 'rb') as file:
+                    stored_key, value = pickle.load(file)
+                # a different key whose repr hashes the same is a miss
+                if stored_key == key:
+                    self.__remember(key, height, value)
+                    self.disk_hits += 1
+                    return copied(value)
+
+            self.misses += 1
+            return MISSING
+
+    def put(self, key: tuple, height: int, value):
+        """Keep a copy of the result for key computed at height."""
+        with self.lock:
+            self.__remember(key, height, copied(value))
+            if self.path is not None:
+                # written under another name and renamed, so readers never see a partial file
+                temporary_path = self.file_path(key, height).with_suffix('.tmp')
+                with gzip.open(temporary_path, 'wb') as file:
+                    pickle.dump((key, value), file, protocol=pickle.HIGHEST_PROTOCOL)
+                temporary_path.replace(self.file_path(key, height))
+
+    def get_or_compute(self, key: tuple, height: int, compute):
+        """Get the result for key computed at height, computing and keeping it if there isn't one."""
+        value = self.get(key, height)
+        if value is MISSING:
+            value = compute()
+            self.put(key, height, value)
+        return value
+
+    def invalidate(self, height: int):
+        """Drop the results computed at heights below height, which the graph has been populated past."""
+        with self.lock:
+            stale = [entry for entry in self.entries if entry[1] < height]
+            for entry in stale:
+                del self.entries[entry]
+
+            if self.path is None:
+                self.invalidations += len(stale)
+                return
+
+            # every result in memory is on disk too, so counting files counts each result once
+            for file_path in self.path.glob('*.pkl.gz'):
+                if int(file_path.name.split('-', 1)[0]) < height:
+                    file_path.unlink(missing_ok=True)
+                    self.invalidations += 1
+
+    def clear(self):
+        """Drop every result, in memory and on disk."""
+        with self.lock:
+            self.entries.clear()
+            if self.path is not None:
+                for file_path in self.path.glob('*.pkl.gz'):
+                    file_path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Hit and miss counts, with the share of lookups which were hits, in memory or on disk."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
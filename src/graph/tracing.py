@@ -0,0 +1,218 @@
+"""Tracing how value flows between outputs, following haircut edges.
+
+An output passes on the value it received in proportion to the values of its edges:
+if an output sends half its value to another, half of everything traced into it is
+traced on through that edge. Outputs are created in chain order, and can only spend
+outputs created before them, so the sent graph is a DAG. Tracing it in topological
+order visits each vertex and edge once, however many paths lead to them.
+
+trace_sources traces from one set of outputs over a networkx graph. BatchTracer
+traces many at once: the split is a sparse matrix, and tracing a block of
+sources one hop further is a sparse matrix product.
+"""
+from collections import defaultdict
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+
+# key of the value traced back to edges left out by a pruning policy, in trace results
+PRUNED_SOURCE = 'pruned'
+
+
+def trace_sources(graph: nx.DiGraph, start_fractions: dict, pruned_values: dict = None) -> dict:
+    """Propagate fractions of value from start nodes along the edges of a graph, in a single topological pass.
+
+    Each node passes on its fraction, split over its out-edges in proportion to their 'value'.
+    A node's pruned value (see graph/pruning.py) counts towards the split but isn't traced further.
+
+    Args:
+        graph: A DAG of outputs, with edges pointing the way to trace: from outputs to the
+            outputs they were spent into for outgoing traces, and the reverse for incoming ones.
+        start_fractions: The fraction of the traced value each start node holds, keyed by node.
+        pruned_values (dict, optional): Value each node received over pruned edges, keyed by node.
+
+    Returns:
+        dict: The value each reached node received, keyed by its 'output_id', and the value
+              traced to pruned edges under PRUNED_SOURCE if any was.
+    """
+    pruned_values = pruned_values or {}
+
+    reachable = set(start_fractions)
+    stack = list(start_fractions)
+    while stack:
+        for child in graph.successors(stack.pop()):
+            if child not in reachable:
+                reachable.add(child)
+                stack.append(child)
+    subgraph = graph.subgraph(reachable)
+
+    # the total each node passes on, computed once
+    transfer_totals = {
+        node: sum(value for _, _, value in subgraph.out_edges(node, data='value')) + pruned_values.get(node, 0)
+        for node in subgraph
+    }
+
+    fractions = defaultdict(float, start_fractions)
+    sources_record = {}
+    for node in nx.topological_sort(subgraph):
+        fraction = fractions[node]
+
+        # the value which came from pruned edges can't be traced further
+        if pruned_values.get(node, 0) > 0:
+            sources_record[PRUNED_SOURCE] = sources_record.get(PRUNED_SOURCE, 0) + pruned_values[node] * fraction
+
+        for child, value in subgraph.succ[node].items():
+            transfer = value['value'] * fraction
+            child_output_id = subgraph.nodes[child]['output_id']
+            sources_record[child_output_id] = sources_record.get(child_output_id, 0) + transfer
+            if transfer_totals[child] > 0:
+                fractions[child] += transfer / transfer_totals[child]
+
+    return sources_record
+
+
+class BatchTracer:
+    """Trace many sets of outputs at once, with the haircut split as a sparse matrix.
+
+    Outputs are numbered 0 to n - 1. Column v of the transfer matrix holds the values v
+    sends to each output, in the direction traced. Each hop multiplies the fractions of
+    the sources' value the outputs hold, one column per source, by the transfer matrix,
+    giving the value each output receives on that hop.
+    """
+
+    def __init__(
+        self,
+        transfers: sparse.csc_matrix,
+        output_ids: np.ndarray,
+        values: np.ndarray,
+        pruned_values: np.ndarray = None
+    ):
+        """
+        Args:
+            transfers: transfers[u, v] is the value v sends to u, in the direction traced.
+            output_ids: The output ID of each index.
+            values: The value of each output, which weights the outputs of a source.
+            pruned_values (optional): Value each output received over pruned edges, when
+                tracing incoming value (see graph/pruning.py). It isn't traced further.
+        """
+        self.transfers = sparse.csc_matrix(transfers)
+        self.output_ids = np.asarray(output_ids)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.pruned_values = np.zeros(len(self.output_ids)) if pruned_values is None \
+            else np.asarray(pruned_values, dtype=np.float64)
+
+        # the total each output passes on, which its fraction is split over
+        transfer_totals = np.asarray(self.transfers.sum(axis=0)).ravel() + self.pruned_values
+        inverse_totals = np.divide(1.0, transfer_totals, out=np.zeros_like(transfer_totals),
+                                   where=transfer_totals > 0)
+        self.inverse_totals = sparse.diags(inverse_totals)
+
+        self.index = {output_id: index for index, output_id in enumerate(self.output_ids.tolist())}
+
+    @classmethod
+    def from_graph(cls, graph: nx.DiGraph, direction: str) -> 'BatchTracer':
+        """Trace over a networkx graph of outputs, from get_trace_graph or traversal_to_networkx
+        with include_data, whose edges point from previous outputs to outputs.
+        """
+        assert direction in ['incoming', 'outgoing'], "direction must be 'incoming' or 'outgoing'"
+        nodes = list(graph.nodes)
+        positions = {node: position for position, node in enumerate(nodes)}
+        edges = [(positions[u], positions[v], value) for u, v, value in graph.edges(data='value')]
+        prev_outs, outputs, values = (np.array(column) for column in zip(*edges)) if edges \
+            else (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        senders, receivers = (outputs, prev_outs) if direction == 'incoming' else (prev_outs, outputs)
+
+        pruned_values = None
+        if direction == 'incoming':
+            pruned_values = [graph.nodes[node].get('pruned_value') or 0 for node in nodes]
+
+        return cls(
+            sparse.csc_matrix((values, (receivers, senders)), shape=(len(nodes), len(nodes))),
+            np.array([graph.nodes[node]['output_id'] for node in nodes]),
+            [graph.nodes[node]['value'] for node in nodes],
+            pruned_values
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot, direction: str) -> 'BatchTracer':
+        """Trace over a whole GraphSnapshot (see graph/snapshot.py), whose indices are output IDs."""
+        assert direction in ['incoming', 'outgoing'], "direction must be 'incoming' or 'outgoing'"
+        # an output's incoming edges are the CSC arrays, and its outgoing edges the CSR arrays
+        indptr, indices, weights = snapshot.csc() if direction == 'incoming' else snapshot.csr()
+        shape = (snapshot.vertex_count, snapshot.vertex_count)
+        return cls(
+            sparse.csc_matrix((weights, indices, indptr), shape=shape),
+            np.arange(snapshot.vertex_count),
+            snapshot.values
+        )
+
+    def trace_matrix(
+        self,
+        sources: list,
+        depth: int = None,
+        min_value: float = 0
+    ) -> tuple[sparse.csc_matrix, np.ndarray]:
+        """Trace a batch of sources.
+
+        Args:
+            sources: Each source is an output ID, or a list of output IDs (e.g. an address's outputs)
+                whose value is traced together, weighted by their values like get_coin_traces.
+            depth (int, optional): The maximum number of hops. Defaults to following every path to its end.
+            min_value (float, optional): Value received on a hop below this is dropped, and not traced
+                further. Defaults to 0, which keeps everything.
+
+        Returns:
+            (contributions, pruned): contributions[i, s] is the value output i received from source s,
+                and pruned[s] is the value of source s traced to pruned edges.
+        """
+        rows, columns, fractions = [], [], []
+        for column, source in enumerate(sources):
+            output_ids = [source] if np.isscalar(source) else list(source)
+            indices = np.array([self.index[output_id] for output_id in output_ids], dtype=np.int64)
+            values = self.values[indices]
+            if values.sum() <= 0:
+                continue
+            keep = values > 0
+            rows.extend(indices[keep].tolist())
+            columns.extend([column] * int(keep.sum()))
+            fractions.extend((values[keep] / values.sum()).tolist())
+
+        shape = (len(self.output_ids), len(sources))
+        held = sparse.csc_matrix((fractions, (rows, columns)), shape=shape)
+        contributions = sparse.csc_matrix(shape)
+        pruned = np.zeros(len(sources))
+
+        hops = 0
+        while held.nnz and (depth is None or hops < depth):
+            pruned += held.T @ self.pruned_values
+            received = (self.transfers @ held).tocsc()
+            if min_value > 0:
+                received.data[received.data < min_value] = 0
+            received.eliminate_zeros()
+
+            contributions = contributions + received
+            held = (self.inverse_totals @ received).tocsc()
+            held.eliminate_zeros()
+            hops += 1
+
+        return contributions.tocsc(), pruned
+
+    def trace(self, sources: list, depth: int = None, min_value: float = 0) -> list[dict]:
+        """Trace a batch of sources, like trace_matrix.
+
+        Returns:
+            list[dict]: For each source, the value each output received from it keyed by output ID,
+                and the value traced to pruned edges under PRUNED_SOURCE if any was.
+        """
+        contributions, pruned = self.trace_matrix(sources, depth, min_value)
+        results = []
+        for column in range(len(sources)):
+            start, end = contributions.indptr[column], contributions.indptr[column + 1]
+            result = dict(zip(self.output_ids[contributions.indices[start:end]].tolist(),
+                              contributions.data[start:end].tolist()))
+            if pruned[column] > 0:
+                result[PRUNED_SOURCE] = float(pruned[column])
+            results.append(result)
+        return results
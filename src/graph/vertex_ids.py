@@ -0,0 +1,95 @@
+"""Map output IDs to JanusGraph vertex IDs.
+
+Looking up an output vertex with V().has('output_id', ...) goes through the
+composite index. Addressing it by its vertex ID with V(vid) doesn't, so keeping
+track of the vertex IDs returned when vertices are created lets edges be
+written without any index lookups.
+
+Output IDs are dense and start from 0, so the mapping is kept as a flat int64
+array indexed by output ID. If a path is given, the array is memory-mapped
+from that file so the mapping survives between runs.
+"""
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+# JanusGraph vertex IDs are always positive
+MISSING_VERTEX_ID = 0
+
+
+class VertexIdCache:
+
+    def __init__(self, path=None, initial_size: int = 1_000_000):
+        self.path = Path(path) if path is not None else None
+        # writers may run in several threads (see graph/writer_pool.py), and growing the array replaces it
+        self.lock = threading.Lock()
+
+        if self.path is None:
+            self.vertex_ids = np.zeros(initial_size, dtype=np.int64)
+        else:
+            if not self.path.exists() or self.path.stat().st_size == 0:
+                self.__resize_file(initial_size)
+            self.vertex_ids = np.memmap(self.path, dtype=np.int64, mode='r+')
+
+    def __len__(self):
+        return len(self.vertex_ids)
+
+    def __resize_file(self, size: int):
+        with open(self.path, 'ab') as file:
+            file.truncate(size * np.dtype(np.int64).itemsize)
+
+    def __ensure_size(self, highest_output_id: int):
+        if highest_output_id < len(self.vertex_ids):
+            return
+
+        # grow geometrically so appends stay cheap
+        new_size = max(highest_output_id + 1, 2 * len(self.vertex_ids))
+        if self.path is None:
+            grown = np.zeros(new_size, dtype=np.int64)
+            grown[:len(self.vertex_ids)] = self.vertex_ids
+            self.vertex_ids = grown
+        else:
+            self.vertex_ids.flush()
+            del self.vertex_ids
+            self.__resize_file(new_size)
+            self.vertex_ids = np.memmap(self.path, dtype=np.int64, mode='r+')
+
+    def get(self, output_id: int) -> int:
+        """Get the vertex ID for an output, or None if it isn't known."""
+        if output_id >= len(self.vertex_ids):
+            return None
+        vertex_id = int(self.vertex_ids[output_id])
+        return vertex_id if vertex_id != MISSING_VERTEX_ID else None
+
+    def get_many(self, output_ids) -> np.ndarray:
+        """Get the vertex IDs for many outputs. Unknown ones are MISSING_VERTEX_ID."""
+        output_ids = np.asarray(output_ids, dtype=np.int64)
+        result = np.full(len(output_ids), MISSING_VERTEX_ID, dtype=np.int64)
+        in_range = output_ids < len(self.vertex_ids)
+        result[in_range] = self.vertex_ids[output_ids[in_range]]
+        return result
+
+    def set(self, output_id: int, vertex_id: int):
+        with self.lock:
+            self.__ensure_size(output_id)
+            self.vertex_ids[output_id] = vertex_id
+
+    def set_many(self, output_ids, vertex_ids):
+        output_ids = np.asarray(output_ids, dtype=np.int64)
+        if len(output_ids) == 0:
+            return
+        with self.lock:
+            self.__ensure_size(int(output_ids.max()))
+            self.vertex_ids[output_ids] = np.asarray(vertex_ids, dtype=np.int64)
+
+    def clear(self, lowest_output_id: int = 0):
+        """Forget the vertex IDs of all outputs from lowest_output_id upwards."""
+        with self.lock:
+            self.vertex_ids[lowest_output_id:] = MISSING_VERTEX_ID
+        self.flush()
+
+    def flush(self):
+        if self.path is not None:
+            self.vertex_ids.flush()
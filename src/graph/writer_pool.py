@@ -0,0 +1,200 @@
+"""Write batches to the graph over several connections at once.
+
+JanusGraph handles many transactions concurrently, but a single websocket
+connection only runs one traversal at a time. The pool opens one connection
+per worker thread, and each worker takes batches from a shared queue. Batches
+cover disjoint ranges of output IDs, so workers never write the same elements.
+
+Batches are numbered in the order they are submitted, and complete out of order.
+The pool keeps track of the highest output ID below which every batch has been
+written, so the population checkpoint only ever moves over a contiguous range.
+
+A batch which fails on a lock conflict may have had some of its traversals
+committed already, so it is only retried if it was submitted with a rewrite,
+which writes it again skipping the elements that already exist.
+"""
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from gremlin_python.driver.protocol import GremlinServerError
+from gremlin_python.process.graph_traversal import GraphTraversalSource
+
+from graph.batch_writer import GremlinBatchWriter
+from graph.vertex_ids import VertexIdCache
+
+
+# JanusGraph's locking exceptions. Server errors echo the request, so a bare 'lock'
+# would also match the 'block_height' of output vertices.
+LOCK_CONFLICT_PATTERN = re.compile(
+    r'PermanentLockingException|TemporaryLockingException|Lock expired|\block contention\b',
+    re.IGNORECASE
+)
+
+
+def is_lock_conflict(error: Exception) -> bool:
+    """Whether a server error was caused by JanusGraph failing to acquire a lock,
+    in which case the batch can be retried.
+    """
+    return isinstance(error, GremlinServerError) and LOCK_CONFLICT_PATTERN.search(str(error)) is not None
+
+
+class WriteTask:
+
+    def __init__(
+        self,
+        index: int,
+        write: Callable[[GremlinBatchWriter], None],
+        last_output_id: int,
+        context: str,
+        rewrite: Callable[[GremlinBatchWriter], None] = None
+    ):
+        self.index = index
+        self.write = write
+        self.last_output_id = last_output_id
+        self.context = context
+        self.rewrite = rewrite
+
+
+class GraphWriterPool:
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], GraphTraversalSource],
+        workers: int = 4,
+        vertex_ids: VertexIdCache = None,
+        max_retries: int = 5,
+        retry_delay: float = 0.5
+    ):
+        """
+        Args:
+            connection_factory: Opens a new connection, e.g. graph.base.create_gremlin_connection.
+            workers (int, optional): Number of connections and threads. Defaults to 4.
+            vertex_ids (VertexIdCache, optional): Shared by all workers.
+            max_retries (int, optional): Number of times a batch submitted with a rewrite
+                is retried after a lock conflict.
+            retry_delay (float, optional): Seconds to wait before the first retry. Doubles on each retry.
+        """
+        self.vertex_ids = vertex_ids if vertex_ids is not None else VertexIdCache()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        # bounded, so the producer can't read far ahead of the workers
+        self.tasks = queue.Queue(maxsize=2 * workers)
+        self.lock = threading.Lock()
+        self.error = None
+        self.failed_task = None
+
+        self.next_index = 0
+        self.completed = {}
+        self.contiguous_index = -1
+        self.completed_output_id = None
+        self.reported_output_id = None
+
+        self.connections = [connection_factory() for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self.__work, args=(GremlinBatchWriter(connection, self.vertex_ids),), daemon=True)
+            for connection in self.connections
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __work(self, writer: GremlinBatchWriter):
+        while True:
+            task: WriteTask = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                return
+
+            try:
+                # after a failure, drain the queue without writing anything
+                if self.error is None:
+                    self.__write_with_retries(writer, task)
+                    self.__complete(task)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                        self.failed_task = task
+            finally:
+                self.tasks.task_done()
+
+    def __write_with_retries(self, writer: GremlinBatchWriter, task: WriteTask):
+        write = task.write
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = write(writer)
+                if isinstance(result, Future):
+                    result.result()
+                return
+            except GremlinServerError as e:
+                if not is_lock_conflict(e) or task.rewrite is None or attempt == self.max_retries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+                # part of the batch may have been committed before the conflict
+                write = task.rewrite
+
+    def __complete(self, task: WriteTask):
+        with self.lock:
+            self.completed[task.index] = task.last_output_id
+            while self.contiguous_index + 1 in self.completed:
+                self.contiguous_index += 1
+                self.completed_output_id = self.completed.pop(self.contiguous_index)
+
+    def __raise_error(self):
+        if self.error is not None:
+            print(f"Error writing {self.failed_task.context}")
+            raise self.error
+
+    def submit(
+        self,
+        write: Callable[[GremlinBatchWriter], None],
+        last_output_id: int,
+        context: str = '',
+        rewrite: Callable[[GremlinBatchWriter], None] = None
+    ):
+        """Queue a batch to be written. Blocks while the queue is full.
+
+        Args:
+            write: Writes the batch using the writer it is given. If it returns a future,
+                   the batch is complete when the future is.
+            last_output_id (int): The highest output ID the batch covers.
+            context (str, optional): Describes the batch in error messages.
+            rewrite (optional): Writes the batch again after a lock conflict, like write but
+                skipping the elements which already exist. Without it, lock conflicts are raised.
+        """
+        self.__raise_error()
+        self.tasks.put(WriteTask(self.next_index, write, last_output_id, context, rewrite))
+        self.next_index += 1
+
+    def join(self):
+        """Wait for all queued batches to be written."""
+        self.tasks.join()
+        self.__raise_error()
+
+    def pop_completed_output_id(self) -> int:
+        """Get the highest output ID up to which all batches have been written,
+        or None if it hasn't changed since the last call.
+        """
+        with self.lock:
+            if self.completed_output_id == self.reported_output_id:
+                return None
+            self.reported_output_id = self.completed_output_id
+            return self.completed_output_id
+
+    def close(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        for connection in self.connections:
+            connection.remote_connection.close()
@@ -1,19 +1,93 @@
+import hashlib
 import time
 import networkx as nx
-from sqlalchemy.orm import joinedload
 from gremlin_python.process.traversal import T, Direction, Order
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.graph_traversal import GraphTraversalSource
 
 from models.base import SessionLocal
 from models.bitcoin_data import Block, Tx, Address, Input, Output, BITCOIN_TO_SATOSHI
+from models.graph_data import GraphPopulationCheckpoint
 from graph.base import g
+from graph.backend import GraphBackend
+from graph.batch_writer import GremlinBatchWriter
+from graph.vertex_ids import VertexIdCache
+from graph.subgraph import SubgraphExtractor
+from graph.trace_cache import TraceCache
+from graph.output_metadata import OutputMetadataService
+from graph.tracing import PRUNED_SOURCE, trace_sources
+from graph.projection import OUTPUT_PROJECTION, check_projection, forward_step, backward_step, both_step, \
+    collapse_tx_vertices
+
+
+def graph_digest(graph: nx.DiGraph) -> str:
+    """A digest of a graph's nodes and edges with their data, which equal graphs built the same way share."""
+    digest = hashlib.sha1()
+    digest.update(repr(list(graph.nodes(data=True))).encode())
+    digest.update(repr(list(graph.edges(data=True))).encode())
+    return digest.hexdigest()
 
 
 class GraphAnalyzer:
-    def __init__(self, g: GraphTraversalSource, sqlalchemy_session_factory: SessionLocal):
+    def __init__(
+        self,
+        g: GraphTraversalSource,
+        sqlalchemy_session_factory: SessionLocal,
+        projection: str = OUTPUT_PROJECTION,
+        backend: GraphBackend = None,
+        cache: TraceCache = None,
+        output_metadata: OutputMetadataService = None
+    ):
+        """
+        Args:
+            projection (str, optional): How the graph was populated, with sent edges between outputs
+                or with tx vertices between them. See graph/projection.py. Defaults to OUTPUT_PROJECTION.
+            backend (GraphBackend, optional): Where get_trace_graph reads the graph from, e.g. an
+                InMemoryGraphBackend. Defaults to JanusGraph, over g. The methods returning gremlin
+                traversals always use g.
+            cache (TraceCache, optional): Where to keep the graphs and traces built by traversal_to_networkx,
+                get_trace_graph, extract_subgraph, get_coin_traces and trace_coins, so asking for them
+                again doesn't rebuild them. Defaults to not caching.
+            output_metadata (OutputMetadataService, optional): Where data about outputs is read from,
+                e.g. to share its records between analyzers. Defaults to a new one.
+        """
+        check_projection(projection)
         self.g = g
         self.sqlalchemy_session_factory = sqlalchemy_session_factory
+        self.projection = projection
+        self.backend = backend if backend is not None else GremlinBatchWriter(g, VertexIdCache(initial_size=1_000))
+        self.cache = cache
+        self.output_metadata = output_metadata if output_metadata is not None \
+            else OutputMetadataService(sqlalchemy_session_factory)
+
+    def populated_height(self) -> int:
+        """The height up to which the graph's edges are populated, or None if nothing is."""
+        with self.sqlalchemy_session_factory() as session:
+            checkpoint = GraphPopulationCheckpoint.get(session, GraphPopulationCheckpoint.EDGES)
+        return checkpoint.block_height if checkpoint is not None else None
+
+    def cached(self, key, compute, persistent: bool = True):
+        """Get a result from the cache, keyed by key and the height the graph is populated to,
+        or compute and cache it. Results computed at lower heights are dropped from the cache.
+        Cached results are copies, which callers are free to modify.
+
+        Args:
+            key (tuple or callable): The cache key, or a function building it, for keys which are expensive
+                to build. It is only called once the graph is known to be populated.
+            persistent (bool, optional): Whether the result is read from the persistent graph, which population
+                checkpoints describe. Results read from anything else, e.g. an InMemoryGraphBackend, aren't cached.
+        """
+        if self.cache is None or not persistent:
+            return compute()
+
+        height = self.populated_height()
+        if height is None:
+            return compute()
+
+        if callable(key):
+            key = key()
+        self.cache.invalidate(height)
+        return self.cache.get_or_compute(key, height, compute)
 
     def highest_degree_centralities(self, centrality_type: str, n: int = 10):
         assert centrality_type in ['in', 'out', 'both'], "centrality_type must be 'in', 'out', or 'both'"
@@ -27,7 +101,7 @@ class GraphAnalyzer:
 
         start = time.perf_counter()
 
-        results = g.V() \
+        results = self.g.V() \
                    .project("v", "degree") \
                    .by(__.elementMap()) \
                    .by(degree_count_step) \
@@ -53,19 +127,19 @@ class GraphAnalyzer:
 
         # Start the traversal at the specified vertex or vertices
         if vertex_type == 'output':
-            vertex_traversal = self.g.V().has('output_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'output_id', vertex_id)
         elif vertex_type == 'address':
-            vertex_traversal = self.g.V().has('address_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'address_id', vertex_id)
 
         # Collect history by traversing sent edges backwards
         if depth is not None:
             assert isinstance(depth, int) and depth > 0, "depth must be a positive integer"
             history = vertex_traversal.repeat(
-                __.inE('sent').otherV()
+                backward_step(self.projection)
             ).times(depth).emit()
         else:
             history = vertex_traversal.repeat(
-                __.inE('sent').otherV()
+                backward_step(self.projection)
             ).emit()
 
         return history
@@ -86,18 +160,18 @@ class GraphAnalyzer:
 
         # Start the traversal at the specified vertex or vertices
         if vertex_type == 'output':
-            vertex_traversal = self.g.V().has('output_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'output_id', vertex_id)
         elif vertex_type == 'address':
-            vertex_traversal = self.g.V().has('address_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'address_id', vertex_id)
 
         if depth is not None:
             assert isinstance(depth, int) and depth > 0, "depth must be a positive integer"
             history = vertex_traversal.repeat(
-                __.outE('sent').otherV()
+                forward_step(self.projection)
             ).times(depth).emit()
         else:
             history = vertex_traversal.repeat(
-                __.outE('sent').otherV()
+                forward_step(self.projection)
             ).emit()
 
         return history
@@ -118,22 +192,82 @@ class GraphAnalyzer:
 
         # Start the traversal at the specified vertex or vertices
         if vertex_type == 'output':
-            vertex_traversal = self.g.V().has('output_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'output_id', vertex_id)
         elif vertex_type == 'address':
-            vertex_traversal = self.g.V().has('address_id', vertex_id)
+            vertex_traversal = self.g.V().has('output', 'address_id', vertex_id)
 
         if depth is not None:
             assert isinstance(depth, int) and depth > 0, "depth must be a positive integer"
             history = vertex_traversal.repeat(
-                __.bothE('sent').otherV()
+                both_step(self.projection)
             ).times(depth).emit()
         else:
             history = vertex_traversal.repeat(
-                __.bothE('sent').otherV()
+                both_step(self.projection)
             ).emit()
 
         return history
 
+    def extract_subgraph(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str = 'both',
+        depth: int = None,
+        max_vertices: int = None,
+        max_edges: int = None,
+        include_data: bool = False,
+        collapse_txs: bool = True
+    ) -> nx.DiGraph:
+        """
+        Build the networkx graph around an output or address breadth first, fetching each level's
+        edges in one batched request (see graph/subgraph.py). It gives the graph traversal_to_networkx
+        gives for get_vertex_history ('incoming'), get_vertex_path ('outgoing') or get_vertex_subgraph
+        ('both'), without serializing every path, and can be cut short by budgets.
+
+        Args:
+            vertex_id: The ID of the vertex (output or address) to start from.
+            vertex_type: The type of ID being provided ('output' or 'address').
+            direction: 'incoming', 'outgoing' or 'both'.
+            depth: The maximum depth of traversal (optional).
+            max_vertices: Stop once the graph has this many vertices (optional).
+            max_edges: Stop once the graph has this many edges (optional).
+            include_data: Whether to add data from the database (see add_output_data).
+            collapse_txs: In the tx projection, whether to replace tx vertices with sent edges.
+
+        Returns:
+            A networkx graph.
+        """
+        return self.cached(
+            ('subgraph', self.projection, vertex_type, vertex_id, direction, depth, max_vertices, max_edges,
+             include_data, collapse_txs),
+            lambda: self.__build_subgraph(vertex_id, vertex_type, direction, depth, max_vertices, max_edges,
+                                          include_data, collapse_txs)
+        )
+
+    def __build_subgraph(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str,
+        depth: int,
+        max_vertices: int,
+        max_edges: int,
+        include_data: bool,
+        collapse_txs: bool
+    ) -> nx.DiGraph:
+        subgraph = SubgraphExtractor(self.g, self.projection).extract(
+            vertex_id, vertex_type, direction, depth, max_vertices, max_edges
+        )
+        if subgraph.truncated:
+            print(f"Warning: the subgraph around {vertex_type} {vertex_id} was cut short at "
+                  f"{len(subgraph.vertices)} vertices and {len(subgraph.edges)} edges")
+
+        nx_graph = subgraph.to_networkx(collapse_txs)
+        if include_data:
+            self.add_output_data(nx_graph)
+        return nx_graph
+
     def get_address_history(self, address_str: str):
         """
         Retrieve the entire history of transactions for a given address.
@@ -142,7 +276,8 @@ class GraphAnalyzer:
             address_str: The address to start the traversal.
 
         Returns:
-            Gremlin traversal of the history of the specified address.
+            Gremlin traversal of the history of the specified address. The graph traversal_to_networkx
+            builds for it is cached, if the analyzer has a cache.
         """
         with self.sqlalchemy_session_factory() as session:
             address = session.query(Address).filter_by(addr=address_str).first()
@@ -170,11 +305,111 @@ class GraphAnalyzer:
 
         return self.get_vertex_history(output.id, 'output')
 
+    def get_address_flows(self, address_id: int, direction: str = 'incoming', depth: int = 1):
+        """
+        Retrieve the addresses which sent value to, or received value from, a given address in
+        the address flow graph. It has one edge per pair of addresses rather than one per pair of
+        outputs, so this touches far fewer elements than get_vertex_history for the address.
+
+        Args:
+            address_id: The ID of the address to start the traversal.
+            direction: 'incoming' to follow where the address's coins came from, 'outgoing' for where they went.
+            depth: The number of hops between addresses. Addresses can send each other value back and forth,
+                   so paths never visit an address twice. Defaults to 1.
+
+        Returns:
+            Gremlin traversal of the addresses, which can be passed to traversal_to_networkx.
+        """
+        assert direction in ['incoming', 'outgoing'], "direction must be 'incoming' or 'outgoing'"
+        assert isinstance(depth, int) and depth > 0, "depth must be a positive integer"
+
+        if direction == 'incoming':
+            step = __.inE('flow').outV().simplePath()
+        else:
+            step = __.outE('flow').inV().simplePath()
+
+        return self.g.V().has('address', 'address_id', address_id).repeat(step).times(depth).emit()
+
+    def get_trace_graph(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str = 'incoming',
+        depth: int = None,
+        include_data: bool = False
+    ) -> nx.DiGraph:
+        """
+        Build the networkx graph of where the coins of an output or address came from, or went to,
+        by reading sent edges from the backend one hop at a time.
+
+        This is the graph traversal_to_networkx gives for get_vertex_history or get_vertex_path,
+        with output IDs as nodes, and it can be read from any backend, e.g. an InMemoryGraphBackend.
+
+        Args:
+            vertex_id: The ID of the vertex (output or address) to start from.
+            vertex_type: The type of ID being provided ('output' or 'address').
+            direction: 'incoming' to follow where the coins came from, 'outgoing' for where they went.
+            depth: The maximum depth of traversal (optional).
+            include_data: Whether to add data from the database (see add_output_data), which
+                          get_coin_traces needs.
+
+        Returns:
+            A networkx graph.
+        """
+        assert vertex_type in ['output', 'address'], "vertex_type must be 'output' or 'address'"
+        assert direction in ['incoming', 'outgoing'], "direction must be 'incoming' or 'outgoing'"
+        if self.projection != OUTPUT_PROJECTION:
+            raise ValueError("get_trace_graph reads sent edges, so it only supports the output projection")
+
+        return self.cached(
+            ('trace_graph', self.projection, vertex_type, vertex_id, direction, depth, include_data),
+            lambda: self.__build_trace_graph(vertex_id, vertex_type, direction, depth, include_data),
+            self.backend.persistent
+        )
+
+    def __build_trace_graph(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str,
+        depth: int,
+        include_data: bool
+    ) -> nx.DiGraph:
+
+        if vertex_type == 'output':
+            frontier = set(self.backend.existing_output_vertices([vertex_id]))
+        else:
+            frontier = set(self.backend.address_output_ids(vertex_id))
+
+        nx_graph = nx.DiGraph()
+        visited = set()
+        hops = 0
+        while frontier and (depth is None or hops < depth):
+            visited |= frontier
+            prev_out_ids, output_ids, values = self.backend.sent_edges(frontier, direction)
+            for prev_out_id, output_id, value in zip(prev_out_ids.tolist(), output_ids.tolist(), values.tolist()):
+                nx_graph.add_edge(prev_out_id, output_id, label='sent', value=value)
+
+            next_ids = prev_out_ids if direction == 'incoming' else output_ids
+            frontier = set(next_ids.tolist()) - visited
+            hops += 1
+
+        nx_graph.add_nodes_from(visited | frontier)
+        properties = self.backend.output_properties(list(nx_graph.nodes))
+        for node, data in nx_graph.nodes(data=True):
+            data.update(output_id=node, label='output', **properties.get(node, {}))
+
+        if include_data:
+            self.add_output_data(nx_graph)
+
+        return nx_graph
+
     def traversal_to_networkx(
         self,
         subgraph_traversal,
         limit=10_000,
-        include_data: bool = False
+        include_data: bool = False,
+        collapse_txs: bool = True
     ) -> nx.DiGraph:
         """Given a gremlin-python graph traversal, specifying a subgraph, return a networkx graph.
 
@@ -183,10 +418,21 @@ class GraphAnalyzer:
             limit: The maximum number of vertices to return.
             include_data: Whether to include all data from the database in the graph.
                           For example, block height, full addresses, etc.
+            collapse_txs: In the tx projection, whether to replace tx vertices with sent edges
+                          carrying haircut values, so the graph looks like the output projection.
 
         Returns:
             A networkx graph.
         """
+        # the same steps read the same graph, so the traversal's bytecode identifies it
+        bytecode = subgraph_traversal.bytecode
+        return self.cached(
+            ('traversal', self.projection, repr(bytecode.source_instructions), repr(bytecode.step_instructions), limit,
+             include_data, collapse_txs),
+            lambda: self.__build_networkx(subgraph_traversal, include_data, collapse_txs)
+        )
+
+    def __build_networkx(self, subgraph_traversal, include_data: bool, collapse_txs: bool) -> nx.DiGraph:
         # get the vertices and edges from the traversal
         # results = subgraph_traversal.project('vertex', 'edges')\
         #                             .by(__.elementMap())\
@@ -200,7 +446,9 @@ class GraphAnalyzer:
 
         nx_graph = nx.DiGraph()
         vertex_items = [item for item in results if item[T.label] == 'output']
-        edge_items = [item for item in results if item[T.label] == 'sent']
+        tx_items = [item for item in results if item[T.label] == 'tx']
+        address_items = [item for item in results if item[T.label] == 'address']
+        edge_items = [item for item in results if item[T.label] in ('sent', 'spent', 'created', 'flow')]
 
         # Add vertices and edges to the NetworkX graph
         for vertex_properties in vertex_items:
@@ -218,42 +466,83 @@ class GraphAnalyzer:
                 address_id = None
                 print(f"Warning: output {vertex_properties['output_id']} has no address")
 
+            if 'pruned_value' in vertex_properties:
+                nx_graph.nodes[vertex_properties[T.id]].update(
+                    {'pruned_value': float(vertex_properties['pruned_value'])})
+
+            # populated before vertices carried them, these come from the database with include_data
+            if 'value' in vertex_properties:
+                nx_graph.nodes[vertex_properties[T.id]].update({'value': int(vertex_properties['value'])})
+            if 'block_height' in vertex_properties:
+                nx_graph.nodes[vertex_properties[T.id]].update(
+                    {'block_height': int(vertex_properties['block_height'])})
+
+        for tx_properties in tx_items:
+            nx_graph.add_node(
+                int(tx_properties[T.id]),
+                tx_id=int(tx_properties['tx_id']),
+                input_value=float(tx_properties['input_value']),
+                label=tx_properties[T.label]
+            )
+
+        for address_properties in address_items:
+            nx_graph.add_node(
+                int(address_properties[T.id]),
+                address_id=int(address_properties['address_id']),
+                label=address_properties[T.label]
+            )
+
         for edge_properties in edge_items:
             in_node = edge_properties[Direction.IN]
             out_node = edge_properties[Direction.OUT]
             if nx_graph.has_node(in_node[T.id]) and nx_graph.has_node(out_node[T.id]):
                 nx_graph.add_edge(out_node[T.id], in_node[T.id], label=edge_properties[T.label])
-                if edge_properties[T.label] == 'sent':
-                    nx_graph.edges[out_node[T.id], in_node[T.id]].update({'value': float(edge_properties['value'])})
+                nx_graph.edges[out_node[T.id], in_node[T.id]].update({'value': float(edge_properties['value'])})
+                if edge_properties[T.label] == 'flow':
+                    nx_graph.edges[out_node[T.id], in_node[T.id]].update({
+                        key: int(edge_properties[key]) for key in ('tx_count', 'first_height', 'last_height')
+                    })
+
+        if collapse_txs:
+            nx_graph = collapse_tx_vertices(nx_graph)
 
         if include_data:
-            output_ids = [data['output_id'] for id_, data in nx_graph.nodes.data()]
-            with self.sqlalchemy_session_factory() as session:
-                outputs = session.query(Output)\
-                                 .filter(Output.id.in_(output_ids))\
-                                 .options(
-                                     joinedload(Output.transaction),
-                                     joinedload(Output.address)
-                                 ).all()
-
-            output_dict = {output.id: output for output in outputs}
-
-            for id_, data in nx_graph.nodes(data=True):
-                output = output_dict[data['output_id']]
-                data.update({
-                    'block_height': output.transaction.block_height,
-                    'tx_index_in_block': output.transaction.index_in_block,
-                    'index_in_tx': output.index_in_tx,
-                    'value': output.value,
-                    'address': output.address.addr if output.address is not None else None,
-                    'pretty_label': output.pretty_label()
-                })
-
-            for u, v in nx_graph.edges():
-                nx_graph.edges[u, v]['pretty_label'] = f"{round(nx_graph.edges[u, v]['value'] / BITCOIN_TO_SATOSHI, 10)}"
+            self.add_output_data(nx_graph)
 
         return nx_graph
 
+    def add_output_data(self, nx_graph: nx.DiGraph):
+        """Add data from the database to the nodes and edges of a graph from traversal_to_networkx
+        or get_trace_graph, e.g. block heights, values, full addresses and labels.
+        Records are read through output_metadata, so outputs seen before aren't read again.
+        """
+        output_ids = [data['output_id'] for id_, data in nx_graph.nodes.data() if 'output_id' in data]
+        records = self.output_metadata.get_many(output_ids)
+
+        for id_, data in nx_graph.nodes(data=True):
+            if 'output_id' not in data:
+                continue
+            record = records[data['output_id']]
+            data.update({
+                'block_height': record.block_height,
+                'tx_index_in_block': record.tx_index_in_block,
+                'index_in_tx': record.index_in_tx,
+                'value': record.value,
+                'address': record.address,
+                'pretty_label': record.pretty_label()
+            })
+
+        address_ids = [data['address_id'] for id_, data in nx_graph.nodes.data() if data.get('label') == 'address']
+        addresses = self.output_metadata.addresses(address_ids)
+
+        for id_, data in nx_graph.nodes(data=True):
+            if data.get('label') == 'address':
+                address = addresses[data['address_id']]
+                data.update({'address': address, 'pretty_label': address})
+
+        for u, v in nx_graph.edges():
+            nx_graph.edges[u, v]['pretty_label'] = f"{round(nx_graph.edges[u, v]['value'] / BITCOIN_TO_SATOSHI, 10)}"
+
     def get_coin_traces(
         self,
         vertex_id: int,
@@ -263,41 +552,35 @@ class GraphAnalyzer:
         leaves_only: bool = False,
         pretty_labels: bool = False
     ):
+        # graphs are passed in, rather than asked for, so traces are keyed by what the graph holds
+        return self.cached(
+            lambda: ('graph_coin_traces', self.projection, graph_digest(graph), vertex_type, vertex_id, direction,
+                     leaves_only, pretty_labels),
+            lambda: self.__coin_traces(vertex_id, vertex_type, direction, graph, pretty_labels)
+        )
+
+    def __coin_traces(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str,
+        graph: nx.DiGraph,
+        pretty_labels: bool
+    ):
 
         #TODO: support leaves_only flag
 
+        # traces follow haircut values between outputs, which tx vertices only hold implicitly
+        graph = collapse_tx_vertices(graph)
+
         assert vertex_type in ['output', 'address'], "vertex_type must be 'output' or 'address'"
         assert direction in ['incoming', 'outgoing'], "direction must be 'incoming' or 'outgoing'"
 
-        sources_record = {}
-
-        def traverse_sources(vertex, fraction=1.0):
-            # Traverse incoming edges
-            for child in graph.successors(vertex):
-                child_transfer = graph.edges[vertex, child]['value']
-                child_output_id = graph.nodes[child]['output_id']
-
-                # Add record for this child
-                if child_output_id in sources_record:
-                    sources_record[child_output_id] += child_transfer * fraction
-                else:
-                    sources_record[child_output_id] = child_transfer * fraction
-
-                # Recursive case
-                grandchildren = graph.successors(child)
-                if grandchildren:
-                    transfer_total = sum([graph[child][grandchild]['value'] for grandchild in grandchildren])
-                    if transfer_total > 0:
-                        amount_fraction = (child_transfer / transfer_total) * fraction
-                        traverse_sources(child, amount_fraction)
-
         # find vertices with given id
         vertices = []
-        total_contribution = 0
         for node, data in graph.nodes(data=True):
             if vertex_type == 'output' and 'output_id' in data and data['output_id'] == vertex_id:
                 vertices.append(node)
-                total_contribution += graph.nodes[node]['value']
             elif (
                 vertex_type == 'address'
                 and 'address_id' in data
@@ -306,38 +589,67 @@ class GraphAnalyzer:
             ):
                 # only consider unspent outputs if tracing backwards for an address
                 vertices.append(node)
-                total_contribution += graph.nodes[node]['value']
 
         assert vertices, f"No vertices of type '{vertex_type}' with id {vertex_id} found"
-        # Start traversal
+
+        # vertices carry their values, unless they were populated before they did and data wasn't included
+        values = {vertex: graph.nodes[vertex].get('value') for vertex in vertices}
+        missing = [graph.nodes[vertex]['output_id'] for vertex, value in values.items() if value is None]
+        if missing:
+            records = self.output_metadata.get_many(missing)
+            values.update({vertex: records[graph.nodes[vertex]['output_id']].value
+                           for vertex, value in values.items() if value is None})
+        total_contribution = sum(values.values())
+
+        # value received over edges left out by a pruning policy (see graph/pruning.py)
+        pruned_values = {}
         if direction == 'incoming':
-            graph = graph.reverse()
-        try:
-            for vertex in vertices:
-                if graph.nodes[vertex]['value'] > 0:
-                    traverse_sources(vertex, fraction=graph.nodes[vertex]['value'] / total_contribution)
-        finally:
-            if direction == 'incoming':
-                graph = graph.reverse()
+            pruned_values = {node: data.get('pruned_value') or 0 for node, data in graph.nodes(data=True)}
+            graph = graph.reverse(copy=False)
+
+        sources_record = trace_sources(
+            graph,
+            {vertex: value / total_contribution for vertex, value in values.items() if value > 0},
+            pruned_values
+        )
 
         if pretty_labels:
-            with self.sqlalchemy_session_factory() as session:
-                outputs = session.query(Output)\
-                                 .filter(Output.id.in_(sources_record.keys()))\
-                                 .options(
-                                     joinedload(Output.transaction),
-                                     joinedload(Output.address)
-                                 )\
-                                 .all()
-            output_dict = {output.id: output for output in outputs}
+            records = self.output_metadata.get_many([key for key in sources_record if key != PRUNED_SOURCE])
 
             for output_id, amount in sources_record.items():
                 sources_record[output_id] = {
                     'amount': amount / BITCOIN_TO_SATOSHI,
-                    'label': output_dict[output_id].pretty_label()
+                    'label': records[output_id].pretty_label() if output_id != PRUNED_SOURCE
+                    else "Pruned dust and negligible edges"
                 }
         return sources_record
 
+    def trace_coins(
+        self,
+        vertex_id: int,
+        vertex_type: str,
+        direction: str = 'incoming',
+        depth: int = None,
+        pretty_labels: bool = False
+    ):
+        """
+        Build the trace graph of an output or address and get its coin traces (see get_coin_traces),
+        caching the traces if the analyzer has a cache.
+
+        The graph is built with get_trace_graph in the output projection, and with extract_subgraph
+        in the tx projection.
+        """
+        def compute():
+            if self.projection == OUTPUT_PROJECTION:
+                graph = self.get_trace_graph(vertex_id, vertex_type, direction, depth)
+            else:
+                graph = self.extract_subgraph(vertex_id, vertex_type, direction, depth)
+            return self.__coin_traces(vertex_id, vertex_type, direction, graph, pretty_labels)
+
+        persistent = self.backend.persistent or self.projection != OUTPUT_PROJECTION
+        return self.cached(('coin_traces', self.projection, vertex_type, vertex_id, direction, depth, pretty_labels),
+                           compute, persistent)
+
 
 if __name__ == '__main__':
     # Create a graph analyzer
@@ -1,6 +1,14 @@
 import time
+import itertools
+import contextlib
+import functools
+import concurrent.futures
+from typing import Callable
+
+import numpy as np
+
 from sqlalchemy.orm import Session, joinedload
-from gremlin_python.process.traversal import T
+from sqlalchemy.sql.expression import func
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.driver.protocol import GremlinServerError
 
@@ -15,113 +23,289 @@ from models.bitcoin_data import (
 )
 
 from models.bitcoin_data import ManualProportion
+from models.graph_data import GraphPopulationCheckpoint
 
 from blockchain_data_provider import BlockchainDataProviderADT, chunked_indices, chunked_ranges
 
-from graph.base import g
-
-
-def haircut(input_value: float, sum_of_inputs: int, output_value: float) -> float:
-    """
-    Generic haircut function that finds the contribution of a single input to an output.
-    haircut_value = (input_value / sum_of_inputs) * output_value
-    """
-    return (input_value / sum_of_inputs) * output_value
-
-
-def calculate_proportions(input_values, output_values, manual_proportions):
-    """
-    We are using the haircut method to proportionally distribute input values
-    to output values. But sometimes it is also important that manual proportions
-    can be set.
-
-    This function takes in a transaction and a list of manual input-to-output
-    proportions and returns a list of input-to-output values.
-
-    The output format will be an adjacency matrix specifying the values
-    for each input-to-output pair. The input and output indices are the
-    indices of the input_values and output_values lists.
-
-    For example, if we have an input at index 0 with value 5, and an output
-    at index 2 with value 6, and we send 0.5 of the input to the output, then
-    the output of this function will include 2.5 at index (0, 2).
-
-    This process is tricky since we have to force certain input-to-output
-    pairs to have certain proportions, while also maintaining the haircut
-    distributions. For instances, if we send 0.5 of an input to an output,
-    the haircut method will try to force more from that input to the output.
-    So we need to re-distribute the remainder of this input-to-output
-    amount to the other outputs.
-
-    It is easy to check the correctness of the final values. The sum of the
-    final values for each input-to-output pair should equal the sum
-    of the output values. And the values for the manual proportions should
-    be as specified.
-    """
-    result = [[0 for _ in output_values] for _ in input_values]
-    remaining_input_values = input_values.copy()
-    remaining_output_values = output_values.copy()
-
-    # First, we distribute the manual proportions
-    # If any proportion is greater than 1, or causes the input value to
-    # be greater than the output value, then we raise an error
-    for manual_proportion in manual_proportions:
-        o = manual_proportion.output.index_in_tx
-        i = manual_proportion.input.index_in_tx
-        p = manual_proportion.proportion
-        result[i][o] = input_values[i] * p
-        remaining_input_values[i] -= result[i][o]
-        remaining_output_values[o] -= result[i][o]
-        if p > 1:
-            raise ValueError("Manual proportion cannot be greater than 1")
-        if result[i][o] > input_values[i]:
-            raise ValueError("Manual proportion cannot be greater than input value")
-        if result[i][o] > output_values[o]:
-            raise ValueError("Manual proportion cannot be greater than output value")
-
-    # collect together all non-manual edges, and sum their values
-    non_manual_edges = []
-    non_manual_sum = 0
-
-    remaining_values_sum = sum(remaining_input_values)
-    if remaining_values_sum > 0:
-        # Next, distribute the remaining values proportionally. But when we
-        # reach an input-to-output pair that has a manual proportion, we
-        # need to distribute the remaining values to the other outputs.
-        # This is done by first skipping these edges, then calculating the
-        # remaining values and distributing them later.
-        amount_remaining = 0
-        for o, output_value in enumerate(remaining_output_values):
-            for i, input_value in enumerate(remaining_input_values):
-                if result[i][o] > 0:
-                    amount_remaining += output_value * input_value / remaining_values_sum
-                    continue
-                result[i][o] += output_value * input_value / remaining_values_sum
-                non_manual_edges.append((i, o, result[i][o]))
-                non_manual_sum += result[i][o]
-
-        # Finally, distribute the remaining values to the other outputs
-        # Value is attributed based on what proportion each non-manual edge
-        # has of the total non-manual sum
-        for i, o, _ in non_manual_edges:
-            result[i][o] += amount_remaining * (result[i][o] / non_manual_sum)
-
-    return result
+from graph.base import g, create_gremlin_connection
+from graph.haircut import haircut_matrix, calculate_proportions
+from graph.vertex_ids import VertexIdCache
+from graph.backend import GraphBackend, gather
+from graph.batch_writer import GremlinBatchWriter
+from graph.writer_pool import GraphWriterPool
+from graph.async_submitter import AsyncBatchSubmitter
+from graph.batch_sizer import AdaptiveBatchSizer, write_in_halves, retry_in_halves, is_split_retryable
+from graph.projection import OUTPUT_PROJECTION, TX_PROJECTION, PROJECTIONS, check_projection
+from graph.pruning import PruningPolicy
 
 
 class PopulateOutputProportionGraph:
 
     def __init__(self,
-                 data_provider: BlockchainDataProviderADT = None):
+                 data_provider: BlockchainDataProviderADT = None,
+                 vertex_ids: VertexIdCache = None,
+                 writers: int = 1,
+                 connection_factory=create_gremlin_connection,
+                 in_flight: int = 1,
+                 adaptive_batch_size: bool = True,
+                 target_latency: float = 5.0,
+                 projection: str = OUTPUT_PROJECTION,
+                 pruning: PruningPolicy = None,
+                 backend: GraphBackend = None):
+        """
+        Args:
+            writers (int, optional): Number of connections batches are written over in parallel.
+                Defaults to 1, which writes on the global connection.
+            connection_factory (optional): Opens the connections used by parallel writers.
+            in_flight (int, optional): With a single writer, the number of batches sent
+                without waiting for them to be written. Defaults to 1.
+            adaptive_batch_size (bool, optional): Adjust batch sizes from how long batches take to write,
+                starting from the given batch size. Defaults to True.
+            target_latency (float, optional): Seconds a batch may take for the batch size to grow. Defaults to 5.
+            projection (str, optional): How transactions are represented: with sent edges between outputs,
+                or with tx vertices between them. See graph/projection.py. Defaults to OUTPUT_PROJECTION.
+            pruning (PruningPolicy, optional): Which outputs and edges batch population leaves out.
+                See graph/pruning.py. Defaults to keeping everything.
+            backend (GraphBackend, optional): Where the graph is written, e.g. an InMemoryGraphBackend
+                (see graph/memory_backend.py). Defaults to JanusGraph, over the global connection.
+        """
+        check_projection(projection)
+        self.pruning = pruning if pruning is not None else PruningPolicy()
+        # tx vertices don't have haircut edges to prune, only spent and created edges of outputs left out
+        if projection == TX_PROJECTION and self.pruning.prunes_haircut_edges:
+            raise ValueError("The tx projection can only prune outputs, not haircut edges")
         self.data_provider = data_provider
+        self.projection = projection
+        self.writers = writers
+        self.in_flight = in_flight
+        self.adaptive_batch_size = adaptive_batch_size
+        self.target_latency = target_latency
+        self.connection_factory = connection_factory
+        # output_id -> vertex ID, so edges can address vertices without index lookups
+        self.vertex_ids = vertex_ids if vertex_ids is not None else VertexIdCache()
+        self.writer = backend if backend is not None else GremlinBatchWriter(g, self.vertex_ids)
+        # tx vertices, address flows and one-by-one population are written with gremlin traversals
+        self.gremlin = isinstance(self.writer, GremlinBatchWriter)
+        if projection == TX_PROJECTION and not self.gremlin:
+            raise ValueError("The tx projection can only be populated in JanusGraph")
+
+    def output_vertex(self, traversal, output_id: int):
+        """Continue the traversal at the vertex for the given output, by vertex ID if it is known."""
+        vertex_id = self.vertex_ids.get(output_id)
+        if vertex_id is not None:
+            return traversal.V(vertex_id)
+        return traversal.V().has('output', 'output_id', output_id)
+
+    def haircut_edge_traversal(self, traversal, prev_out_id: int, output_id: int, haircut_value: float):
+        """Continue the traversal by creating a sent edge between two outputs if one doesn't already exist."""
+        prev_out_vertex_id = self.vertex_ids.get(prev_out_id)
+        if prev_out_vertex_id is not None:
+            from_prev_out = __.outV().hasId(prev_out_vertex_id)
+        else:
+            from_prev_out = __.outV().has('output_id', prev_out_id)
+
+        return self.output_vertex(traversal, output_id) \
+                   .inE('sent').where(from_prev_out) \
+                   .fold() \
+                   .coalesce(__.unfold(),
+                             self.output_vertex(__, output_id)
+                             .addE('sent')
+                             .from_(self.output_vertex(__, prev_out_id))
+                             .property('value', haircut_value))
+
+    def clear_graph(
+        self,
+        session: Session = None,
+        batch_size: int = 1_000,
+        workers: int = 4,
+        lowest_output_id: int = 0,
+        show_progressbar: bool = False
+    ):
+        """Drop all output vertices (and with them, their edges) from the graph,
+        and the tx vertices of their transactions in the tx projection.
+
+        Vertices are dropped by output_id, which is looked up through the composite
+        index, so no full graph scan is needed. The output_id range is split into
+        shards which are dropped in parallel.
+
+        Args:
+            session: Used to find the highest output ID and to reset the population checkpoints.
+                     If not given, vertices are dropped without sharding and the
+                     checkpoints are left as they are.
+            batch_size: Number of vertices dropped per traversal.
+            workers: Number of shards dropped at the same time.
+            lowest_output_id: Only drop vertices with at least this output ID.
+        """
+        if session is not None:
+            highest_output_id = session.query(func.max(Output.id)).scalar()
+            if highest_output_id is not None and highest_output_id >= lowest_output_id:
+                self._drop_output_id_range(lowest_output_id, highest_output_id,
+                                           batch_size, workers, show_progressbar)
+
+            if self.projection == TX_PROJECTION:
+                tx_ids = session.query(func.min(Output.tx_id), func.max(Output.tx_id))\
+                                .filter(Output.id >= lowest_output_id)\
+                                .one()
+                if tx_ids[0] is not None:
+                    self._drop_output_id_range(tx_ids[0], tx_ids[1], batch_size, workers, show_progressbar,
+                                               label='tx', key='tx_id')
+
+        self.writer.forget_vertex_ids(lowest_output_id)
+        if session is not None:
+            self.rewind_checkpoints(session, lowest_output_id - 1)
+
+        # flows between addresses can't be split by height, so the address flow graph is rebuilt from scratch
+        if session is not None and lowest_output_id > 0 \
+                and self.get_checkpoint(session, GraphPopulationCheckpoint.ADDRESS_FLOWS) is not None:
+            self.clear_address_flows(session, batch_size, workers, show_progressbar)
+
+        if lowest_output_id > 0:
+            return
+
+        # Remove anything left over which isn't in the relational database.
+        # Not all vertices can be deleted at once, so we delete them in batches,
+        # halving the batch size whenever the server can't cope with it.
+        sizer = self.batch_sizer(batch_size)
+        while self.writer.has_vertices():
+            size = sizer.size
+            start = time.perf_counter()
+            try:
+                self.writer.drop_any_vertices(size)
+            except GremlinServerError as e:
+                if not is_split_retryable(e) or size <= 1:
+                    raise e
+                sizer.record_failure()
+            else:
+                sizer.record_success(time.perf_counter() - start)
+
+    def clear_graph_above_height(
+        self,
+        session: Session,
+        height: int,
+        batch_size: int = 1_000,
+        workers: int = 4,
+        show_progressbar: bool = False
+    ):
+        """Drop all vertices for outputs in blocks higher than the given height,
+        so that part of the graph can be rebuilt.
+        """
+        lowest_output_id = session.query(func.min(Output.id))\
+                                  .join(Tx, Output.transaction)\
+                                  .filter(Tx.block_height > height)\
+                                  .scalar()
+        if lowest_output_id is None:
+            return
+
+        self.clear_graph(session, batch_size, workers, lowest_output_id, show_progressbar)
+
+    def _drop_output_id_range(
+        self,
+        lowest_output_id: int,
+        highest_output_id: int,
+        batch_size: int,
+        workers: int,
+        show_progressbar: bool = False,
+        label: str = 'output',
+        key: str = 'output_id'
+    ):
+        """Drop the vertices with the given label whose key, e.g. output_id or tx_id, is in a range."""
+        chunks = chunked_ranges(lowest_output_id, highest_output_id, batch_size)
+
+        if show_progressbar:
+            from tqdm import tqdm
+            progressbar = tqdm(total=highest_output_id - lowest_output_id + 1, desc="Dropping vertices", unit="vertex")
+
+        # chunks which time out are split in two and dropped again
+        sizer = self.batch_sizer(batch_size)
+
+        def drop_chunk(chunk):
+            start, end = chunk
+            write_in_halves(lambda ids: self.writer.drop_vertices(label, key, ids), list(range(start, end + 1)), sizer)
+            return end - start + 1
 
-    def clear_graph(self, batch_size: int = 100_000):
-        # Not all vertices can be deleted at once, so we delete them in batches.
         try:
-            while g.V().limit(1).count().next() > 0:
-                g.V().limit(batch_size).drop().iterate()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for dropped_count in executor.map(drop_chunk, chunks):
+                    if show_progressbar:
+                        progressbar.update(dropped_count)
+                        progressbar.set_postfix(failures=sizer.failures)
         except GremlinServerError:
-            print("Gremlin server error. Consider descreasing batch size or increasing evaluationTimeout")
+            print("Gremlin server error. Consider increasing evaluationTimeout")
+            raise
+        finally:
+            if show_progressbar:
+                progressbar.close()
+
+    def clear_address_flows(
+        self,
+        session: Session,
+        batch_size: int = 1_000,
+        workers: int = 4,
+        show_progressbar: bool = False
+    ):
+        """Drop the address vertices (and with them, the flow edges) and their checkpoint,
+        so the address flow graph is rebuilt by the next population.
+        """
+        highest_address_id = session.query(func.max(Address.id)).scalar()
+        if highest_address_id is not None:
+            self._drop_output_id_range(0, highest_address_id, batch_size, workers, show_progressbar,
+                                       label='address', key='address_id')
+        self.writer.address_vertex_id_cache.clear()
+
+        if not self.writer.persistent:
+            return
+        with Session(bind=session.get_bind()) as checkpoint_session:
+            GraphPopulationCheckpoint.clear(checkpoint_session, GraphPopulationCheckpoint.ADDRESS_FLOWS)
+            checkpoint_session.commit()
+
+    def create_address_flows(
+        self,
+        session: Session,
+        highest_to_populate: int = None,
+        show_progressbar: bool = False,
+        blocks_per_batch: int = 1_000
+    ):
+        """Build the address flow graph up to a height, resuming from its checkpoint.
+
+        Vertices are addresses, and each flow edge holds the haircut value sent from one address
+        to another, the number of transactions it was sent in, and the first and last heights it was
+        sent at. Flows are aggregated in SQL from the blockchain database for each range of blocks,
+        then added onto the edges built from earlier ranges.
+        """
+        if not self.gremlin:
+            raise ValueError("The address flow graph can only be populated in JanusGraph")
+        if highest_to_populate is None:
+            highest_to_populate = self.get_highest_block_height(session)
+
+        checkpoint = self.get_checkpoint(session, GraphPopulationCheckpoint.ADDRESS_FLOWS)
+        lowest_to_populate = checkpoint.block_height + 1 if checkpoint is not None else 0
+        if lowest_to_populate > highest_to_populate:
+            return
+
+        ranges = chunked_ranges(lowest_to_populate, highest_to_populate, blocks_per_batch)
+        if show_progressbar:
+            from tqdm import tqdm
+            progressbar = tqdm(total=highest_to_populate - lowest_to_populate + 1,
+                               desc="Creating address flows", unit="block")
+
+        for start, end in ranges:
+            flows = self.data_provider.get_address_flows(session, start, end)
+            try:
+                self.writer.merge_address_flows(flows, start)
+            except Exception as e:
+                print(f"Error writing {len(flows)} address flows for blocks {start} to {end}")
+                raise e
+
+            with Session(bind=session.get_bind()) as checkpoint_session:
+                GraphPopulationCheckpoint.save(checkpoint_session, GraphPopulationCheckpoint.ADDRESS_FLOWS,
+                                               end, self.get_highest_output_id(session, end))
+                checkpoint_session.commit()
+
+            if show_progressbar:
+                progressbar.update(end - start + 1)
+
+        if show_progressbar:
+            progressbar.close()
 
     def get_highest_block_height(self, session: Session):
         highest_block = session.query(Block.height).order_by(Block.height.desc()).first()
@@ -131,28 +315,355 @@ class PopulateOutputProportionGraph:
         else:
             return -1
 
-    def get_highest_vertex_id(self) -> int:
-        start = time.perf_counter()
-        highest_id = g.V().values('id').max().toList()
-        print(f"Got highest ID vertex in {time.perf_counter() - start} seconds")
+    def get_highest_output_id(self, session: Session, height: int) -> int:
+        """Get the highest ID of outputs in blocks up to the given height, or -1 if there are none."""
+        highest_output_id = session.query(func.max(Output.id))\
+                                   .join(Tx, Output.transaction)\
+                                   .filter(Tx.block_height <= height)\
+                                   .scalar()
+        return highest_output_id if highest_output_id is not None else -1
+
+    def check_vertices_fresh(self, boundary_output_id: int, highest_output_id: int):
+        """Make sure that no vertices exist for outputs above the boundary, so they can be
+        inserted without checking whether each one exists.
+
+        Outputs are populated in ID order, so only the first and last outputs are checked.
+        """
+        probe_ids = {output_id for output_id in (boundary_output_id + 1, highest_output_id)
+                     if boundary_output_id < output_id <= highest_output_id}
+        existing = self.writer.existing_output_vertices(probe_ids)
+        if existing:
+            raise ValueError(f"Vertices already exist for outputs {sorted(existing)} above output "
+                             f"{boundary_output_id}. Populate without insert_only, or delete them first.")
+
+    @staticmethod
+    def _write_output_vertices(writer: GremlinBatchWriter, rows: list[dict], boundary_output_id: int = None):
+        """Upsert vertices for outputs up to boundary_output_id and insert the rest.
+        If boundary_output_id is None, all of them are upserted.
+
+        Returns:
+            Future: Resolves once all of the vertices are written.
+        """
+        if boundary_output_id is None:
+            return writer.upsert_output_vertices_async(rows)
+        return gather([
+            writer.upsert_output_vertices_async([row for row in rows if row['output_id'] <= boundary_output_id]),
+            writer.add_output_vertices_async([row for row in rows if row['output_id'] > boundary_output_id])
+        ])
+
+    @staticmethod
+    def _write_sent_edges(writer: GremlinBatchWriter, edges: list[tuple[int, int, float]],
+                          boundary_output_id: int = None):
+        """Upsert edges going to outputs up to boundary_output_id and insert the rest.
+        If boundary_output_id is None, all of them are upserted.
+
+        Returns:
+            Future: Resolves once all of the edges are written.
+        """
+        if boundary_output_id is None:
+            return writer.upsert_sent_edges_async(edges)
+        return gather([
+            writer.upsert_sent_edges_async([edge for edge in edges if edge[1] <= boundary_output_id]),
+            writer.add_sent_edges_async([edge for edge in edges if edge[1] > boundary_output_id])
+        ])
+
+    @staticmethod
+    def _write_tx_vertices(writer: GremlinBatchWriter, rows: list[dict], boundary_output_id: int = None):
+        """Upsert tx vertices for transactions with outputs up to boundary_output_id and insert the rest.
+        If boundary_output_id is None, all of them are upserted.
+
+        Returns:
+            Future: Resolves once all of the tx vertices and their edges are written.
+        """
+        if boundary_output_id is None:
+            return writer.upsert_tx_vertices_async(rows)
+        return gather([
+            writer.upsert_tx_vertices_async([row for row in rows if row['first_output_id'] <= boundary_output_id]),
+            writer.add_tx_vertices_async([row for row in rows if row['first_output_id'] > boundary_output_id])
+        ])
+
+    def tx_vertex_row(self, tx: Tx) -> dict:
+        """Describe a transaction's tx vertex and its edges, for GremlinBatchWriter.add_tx_vertices_async.
+
+        Outputs left out by the pruning policy get no edges. input_value still includes their value,
+        so the haircut values derived from the remaining edges don't change.
+        """
+        return {
+            'tx_id': tx.id,
+            'first_output_id': tx.outputs[0].id,
+            'input_value': tx.total_input_value(),
+            'spent': [(input.prev_out.id, input.prev_out.value) for input in tx.inputs
+                      if input.prev_out is not None and self.pruning.keep_output(input.prev_out)],
+            'created': [(output.id, output.value) for output in tx.outputs if self.pruning.keep_output(output)]
+        }
+
+    def batch_sizer(self, batch_size: int) -> AdaptiveBatchSizer:
+        return AdaptiveBatchSizer(batch_size, target_latency=self.target_latency, adaptive=self.adaptive_batch_size)
+
+    def writer_pool(self):
+        """Open a pool of connections to write batches in parallel if more than one writer is used,
+        or keep several batches in flight on the global connection if in_flight is more than one.
+        Otherwise, batches are written one at a time, and the context gives None.
+        Batches are always written one at a time to in-process backends, which are only limited by the CPU.
+        """
+        if not self.gremlin:
+            return contextlib.nullcontext()
+        if self.writers > 1:
+            return GraphWriterPool(self.connection_factory, self.writers, self.vertex_ids)
+        if self.in_flight > 1:
+            return AsyncBatchSubmitter(self.writer, self.in_flight)
+        return contextlib.nullcontext()
+
+    def _dispatch_batch(
+        self,
+        session: Session,
+        pool: GraphWriterPool | AsyncBatchSubmitter,
+        write,
+        items: list,
+        sizer: AdaptiveBatchSizer,
+        last_output_id: int,
+        context: str,
+        checkpoint_type: str = None,
+        rewrite=None
+    ):
+        """Write a batch, directly or through the pool or async submitter, then move
+        the checkpoint over all batches which have been written.
+
+        If the batch fails with an error which a smaller batch might avoid,
+        it is split in two and the sizer halves the batch size. A batch is written with
+        several traversals, and some of them may have been committed when it failed,
+        so it is written again with rewrite, and never with a plain insert.
+
+        Args:
+            write: Sends items using the writer it is given, and returns a future.
+            items (list): The vertices or edges in the batch.
+            sizer (AdaptiveBatchSizer): Told how long the batch took, or that it failed.
+            last_output_id (int): The highest output ID the batch covers.
+            context (str): Describes the batch in error messages.
+            checkpoint_type (str, optional): Checkpoint to move, if any.
+            rewrite (optional): Like write, but skips the elements which already exist,
+                e.g. by upserting them. Defaults to write, which must then upsert.
+        """
+        if rewrite is None:
+            rewrite = write
+
+        def write_with_splitting(writer):
+            write_in_halves(lambda part: write(writer, part).result(), items, sizer,
+                            rewrite=lambda part: rewrite(writer, part).result())
+
+        def rewrite_with_splitting(writer):
+            write_in_halves(lambda part: rewrite(writer, part).result(), items, sizer)
+
+        if pool is None:
+            try:
+                write_with_splitting(self.writer)
+            except Exception as e:
+                print(f"Error writing {context}")
+                raise e
+            completed_output_id = last_output_id
+        elif isinstance(pool, AsyncBatchSubmitter):
+            pool.submit(
+                lambda writer: write(writer, items), last_output_id, context,
+                retry=lambda error: retry_in_halves(error, lambda part: rewrite(self.writer, part).result(),
+                                                    items, sizer),
+                sizer=sizer
+            )
+            completed_output_id = pool.pop_completed_output_id()
+        else:
+            pool.submit(write_with_splitting, last_output_id, context, rewrite=rewrite_with_splitting)
+            completed_output_id = pool.pop_completed_output_id()
 
-        assert len(highest_id) < 2, "more than one highest id returned"
+        if checkpoint_type is not None and completed_output_id is not None:
+            self.save_checkpoints(session, completed_output_id, [checkpoint_type])
 
-        if highest_id:
-            return highest_id[0]
-        else:
-            return -1
+    def _finish_batches(
+        self,
+        session: Session,
+        pool: GraphWriterPool | AsyncBatchSubmitter,
+        checkpoint_type: str = None
+    ):
+        """Wait for the pool or async submitter to write all batches, then move the checkpoint over them."""
+        if pool is None:
+            return
+        pool.join()
+        completed_output_id = pool.pop_completed_output_id()
+        if checkpoint_type is not None and completed_output_id is not None:
+            self.save_checkpoints(session, completed_output_id, [checkpoint_type])
+
+    def completed_block_height(self, session: Session, output_id: int) -> int:
+        """Get the highest block whose outputs all have IDs up to output_id."""
+        next_height = session.query(Tx.block_height)\
+                             .join(Output, Tx.outputs)\
+                             .filter(Output.id == output_id + 1)\
+                             .scalar()
+        if next_height is not None:
+            return next_height - 1
+
+        # output_id is the last output in the database, so its block is complete
+        height = session.query(Tx.block_height)\
+                        .join(Output, Tx.outputs)\
+                        .filter(Output.id == output_id)\
+                        .scalar()
+        return height if height is not None else -1
+
+    def get_checkpoint(self, session: Session, element_type: str) -> GraphPopulationCheckpoint:
+        """Get the population checkpoint of vertices, edges or address flows.
+
+        Checkpoints record how far the persistent graph is populated, so a graph which only
+        lives in this process, e.g. an InMemoryGraphBackend, is always populated from scratch.
+        """
+        if not self.writer.persistent:
+            return None
+        return GraphPopulationCheckpoint.get(session, element_type)
+
+    def save_checkpoints(self, session: Session, output_id: int,
+                         element_types=(GraphPopulationCheckpoint.VERTICES, GraphPopulationCheckpoint.EDGES)):
+        """Record that vertices and/or edges are populated for all outputs up to output_id.
+
+        The checkpoints are written and committed in their own session, so that they
+        don't interfere with transactions being streamed through session.
+        """
+        if not self.writer.persistent:
+            return
+        block_height = self.completed_block_height(session, output_id)
+        with Session(bind=session.get_bind()) as checkpoint_session:
+            for element_type in element_types:
+                GraphPopulationCheckpoint.save(checkpoint_session, element_type, block_height, output_id)
+            checkpoint_session.commit()
+
+    def start_checkpoint(self, session: Session, element_type: str, pending_output_id: int):
+        """Record that vertices or edges are about to be populated up to pending_output_id."""
+        if not self.writer.persistent:
+            return
+        with Session(bind=session.get_bind()) as checkpoint_session:
+            GraphPopulationCheckpoint.start(checkpoint_session, element_type, pending_output_id)
+            checkpoint_session.commit()
+
+    def insert_only_boundary(self, session: Session, element_type: str, lowest_to_populate: int) -> int:
+        """Get the highest output ID whose vertices or edges may already exist, when populating from
+        lowest_to_populate. Anything above it can be inserted without checking whether it exists.
+
+        The lowest block may be partially populated, and so may anything a previous,
+        interrupted run started populating.
+        """
+        boundary_output_id = self.get_highest_output_id(session, lowest_to_populate)
+
+        checkpoint = self.get_checkpoint(session, element_type)
+        if checkpoint is None:
+            return boundary_output_id
+        if checkpoint.output_id > boundary_output_id:
+            raise ValueError(f"The graph's {element_type} are already populated up to block {checkpoint.block_height}, "
+                             f"above block {lowest_to_populate}. Populate without insert_only.")
+        if checkpoint.pending_output_id is not None:
+            boundary_output_id = max(boundary_output_id, checkpoint.pending_output_id)
+        return boundary_output_id
+
+    def rewind_checkpoints(self, session: Session, output_id: int):
+        """Move the checkpoints back to output_id, after the graph above it is deleted."""
+        if not self.writer.persistent:
+            return
+        block_height = self.completed_block_height(session, output_id)
+        with Session(bind=session.get_bind()) as checkpoint_session:
+            GraphPopulationCheckpoint.rewind(checkpoint_session, block_height, output_id)
+            checkpoint_session.commit()
 
     def upsert_haircut_edge(self, prev_out_id: int, output_id: int, haircut_value: float):
-        g.V().has('output_id', prev_out_id) \
-             .inE('sent').where(__.outV().has('output_id', output_id)) \
-             .fold() \
-             .coalesce(__.unfold(),
-                       __.V().has('output', 'output_id', output_id)
-                       .addE('sent')
-                       .from_(__.V().has('output', 'output_id', prev_out_id))
-                       .property('value', haircut_value)
-                       ).next()
+        self.haircut_edge_traversal(g, prev_out_id, output_id, haircut_value).next()
+
+    def check_manual_proportions_supported(self):
+        # in the tx projection, haircut values are derived when the graph is read, so they can't be overridden
+        if self.projection != OUTPUT_PROJECTION:
+            raise ValueError("Manual proportions are only supported in the output projection")
+        # manual edges could lead to outputs which were left out, and would make pruned values wrong
+        if self.pruning.prunes_edges:
+            raise ValueError("Manual proportions can't be applied to a pruned graph")
+
+    @staticmethod
+    def manual_edge_values(tx: Tx, manual_proportions: list[ManualProportion]) -> list[tuple[int, int, float]]:
+        """Calculate the sent edges of a transaction with manual proportions applied.
+
+        Returns:
+            list[tuple[int, int, float]]: (previous output ID, output ID, value) for each edge with a value.
+        """
+        input_values = [input.prev_out.value for input in tx.inputs]
+        output_values = [output.value for output in tx.outputs]
+        edge_values = calculate_proportions(input_values, output_values, manual_proportions)
+
+        # no edges are created for inputs or outputs with no value
+        edge_values[np.asarray(input_values) == 0, :] = 0
+        edge_values[:, np.asarray(output_values) == 0] = 0
+
+        return [
+            (tx.inputs[i].prev_out.id, tx.outputs[o].id, edge_values[i, o])
+            for o, i in zip(*np.nonzero(edge_values.T > 0))
+        ]
+
+    @staticmethod
+    def haircut_edge_values(tx: Tx) -> list[tuple[int, int, float]]:
+        """Calculate the sent edges of a transaction by the haircut method alone.
+
+        Returns:
+            list[tuple[int, int, float]]: (previous output ID, output ID, value) for every input and output,
+                or nothing if the inputs have no value.
+        """
+        if tx.total_input_value() == 0:
+            return []
+        edge_values = haircut_matrix([input.prev_out.value for input in tx.inputs],
+                                     [output.value for output in tx.outputs])
+        return [
+            (input.prev_out.id, output.id, edge_values[i, o])
+            for o, output in enumerate(tx.outputs)
+            for i, input in enumerate(tx.inputs)
+        ]
+
+    def replace_tx_edges(
+        self,
+        txs: list[Tx],
+        edge_values: Callable[[Tx], list[tuple[int, int, float]]],
+        batch_size: int = 10_000,
+        progressbar=None
+    ) -> tuple[int, int]:
+        """Rewrite the sent edges into the outputs of transactions, touching only the edges which change.
+
+        Transactions are written together in batches of about batch_size edges.
+
+        Args:
+            txs: Transactions with their inputs' previous outputs and their outputs loaded.
+            edge_values: Calculates the edges a transaction should have.
+            batch_size: Number of edges compared and written at once.
+            progressbar (optional): Updated once for each transaction.
+
+        Returns:
+            (int, int): The number of edges dropped and created.
+        """
+        dropped, added = 0, 0
+        batch_edges, batch_output_ids, batch_tx_count = [], [], 0
+
+        def write_batch():
+            nonlocal dropped, added
+            try:
+                batch_dropped, batch_added = self.writer.replace_sent_edges(batch_edges, batch_output_ids)
+            except Exception as e:
+                print(f"Error replacing edges of {batch_tx_count} transactions, "
+                      f"up to output {max(batch_output_ids)}")
+                raise e
+            dropped += batch_dropped
+            added += batch_added
+            if progressbar is not None:
+                progressbar.update(batch_tx_count)
+
+        for tx in txs:
+            batch_edges.extend(edge_values(tx))
+            batch_output_ids.extend(output.id for output in tx.outputs)
+            batch_tx_count += 1
+
+            if len(batch_edges) >= batch_size:
+                write_batch()
+                batch_edges, batch_output_ids, batch_tx_count = [], [], 0
+
+        if batch_tx_count:
+            write_batch()
+        return dropped, added
 
     def apply_manual_edge_proportions_for_tx(
         self,
@@ -168,11 +679,6 @@ class PopulateOutputProportionGraph:
                     .filter_by(id=tx_id)\
                     .first()
 
-        # Delete existing edges from this input to outputs within the same transaction
-        for output in tx.outputs:
-            g.V().has('output_id', output.id)\
-                .inE('sent').drop().iterate()
-
         # retrieve all manual proportions whose output is in this transaction
         manual_proportions = session.query(ManualProportion)\
                                     .join(Output, ManualProportion.output)\
@@ -182,49 +688,40 @@ class PopulateOutputProportionGraph:
                                         joinedload(ManualProportion.output)
         ).all()
 
-        # create list of remaining values for each input/output
-        input_values = [input.prev_out.value for input in tx.inputs]
-        output_values = [output.value for output in tx.outputs]
-
-        edge_values = calculate_proportions(input_values, output_values, manual_proportions)
-
-        output: Output
-        for output in tx.outputs:
-            # If the output value is 0, no edges should be created
-            if output_values[output.index_in_tx] == 0:
-                continue
-
-            # Recalculate and upsert other edges based on the remaining transaction value
-            input: Input
-            for input in tx.inputs:
-                # If the input value is 0, no edges should be created
-                if input_values[input.index_in_tx] == 0:
-                    continue
-
-                edge_value = edge_values[input.index_in_tx][output.index_in_tx]
-                if edge_value > 0:
-                    self.upsert_haircut_edge(input.prev_out.id, output.id, edge_value)
+        self.check_manual_proportions_supported()
+        self.replace_tx_edges([tx], lambda tx: self.manual_edge_values(tx, manual_proportions))
 
     def apply_manual_edge_proportions(
         self,
         session: Session,
+        batch_size: int = 10_000,
         show_progressbar=False
     ):
-        if show_progressbar:
-            from tqdm import tqdm
-            manual_proportions_count = session.query(ManualProportion).count()
-            progressbar = tqdm(total=manual_proportions_count, desc="Applying manual edge proportions", unit="edge")
+        """Rewrite the edges of every transaction with manual proportions. Edges whose values
+        are already right are left alone, so applying the proportions again only writes what changed.
+        """
+        self.check_manual_proportions_supported()
+        affected_txs = ManualProportion.get_affected_txs(session)
 
-        affected_tx_ids = session.query(Tx.id)\
-                                 .join(Output, Tx.id == Output.tx_id)\
-                                 .join(ManualProportion, Output.id == ManualProportion.output_id)\
-                                 .distinct().all()
+        # retrieve all manual proportions at once, grouped by the transaction of their output
+        manual_proportions_by_tx = {}
+        manual_proportion: ManualProportion
+        for manual_proportion in session.query(ManualProportion)\
+                                        .options(joinedload(ManualProportion.input),
+                                                 joinedload(ManualProportion.output)):
+            manual_proportions_by_tx.setdefault(manual_proportion.output.tx_id, []).append(manual_proportion)
 
-        for tx in affected_tx_ids:
-            self.apply_manual_edge_proportions_for_tx(session, tx.id)
+        progressbar = None
+        if show_progressbar:
+            from tqdm import tqdm
+            progressbar = tqdm(total=len(affected_txs), desc="Applying manual edge proportions", unit="tx")
 
-            if show_progressbar:
-                progressbar.update(1)
+        self.replace_tx_edges(
+            affected_txs,
+            lambda tx: self.manual_edge_values(tx, manual_proportions_by_tx.get(tx.id, [])),
+            batch_size=batch_size,
+            progressbar=progressbar
+        )
 
         if show_progressbar:
             progressbar.close()
@@ -232,35 +729,22 @@ class PopulateOutputProportionGraph:
     def reset_manual_edge_proportions(
         self,
         session: Session,
+        batch_size: int = 10_000,
         show_progressbar=False
     ):
+        """Rewrite the edges of every transaction with manual proportions to their haircut values."""
+        self.check_manual_proportions_supported()
         affected_txs = ManualProportion.get_affected_txs(session)
 
+        progressbar = None
         if show_progressbar:
             from tqdm import tqdm
-            tx_count = len(affected_txs)
-            progressbar = tqdm(total=tx_count, desc="Resetting edge proportions", unit="edge")
+            progressbar = tqdm(total=len(affected_txs), desc="Resetting edge proportions", unit="tx")
 
-        for tx in affected_txs:
-            tx_sum = tx.total_input_value()
-            # Delete existing edges from this input to outputs within the same transaction
-            for output in tx.outputs:
-                g.V().has('output_id', output.id)\
-                    .inE('sent').drop().iterate()
-            if tx_sum == 0:
-                progressbar.update(1)
-                continue
+        self.replace_tx_edges(affected_txs, self.haircut_edge_values, batch_size=batch_size, progressbar=progressbar)
 
-            # Recalculate and upsert edges for outputs in this transaction
-            output: Output
-            for output in tx.outputs:
-                input: Input
-                for input in tx.inputs:
-                    haircut_value = haircut(input.prev_out.value, tx_sum, output.value)
-                    self.upsert_haircut_edge(input.prev_out.id, output.id, haircut_value)
-
-            if show_progressbar:
-                progressbar.update(1)
+        if show_progressbar:
+            progressbar.close()
 
     def populate_outputs_onebyone_getorcreate(
         self,
@@ -268,31 +752,24 @@ class PopulateOutputProportionGraph:
         block_heights: list[int],
         show_progressbar=False,
         fail_if_exists=False,
-        start_height: int = 0,
-        skip_check_highest: bool = False
+        start_height: int = 0
     ):
 
+        if self.projection != OUTPUT_PROJECTION:
+            raise ValueError("Populating one by one only supports the output projection. Populate in batches.")
+        if self.pruning.prunes_edges:
+            raise ValueError("Populating one by one doesn't support pruning. Populate in batches.")
+        if not self.gremlin:
+            raise ValueError("Populating one by one only supports JanusGraph. Populate in batches.")
+
         block_heights = list(block_heights)
         block_heights.sort()
 
         highest_to_populate = block_heights[-1]
 
-        if not skip_check_highest:
-            highest_id = self.get_highest_vertex_id()
-        else:
-            highest_id = -1
-
-        if highest_id > 0:
-            highest_id = highest_id[0]
-            highest_block = session.query(Block.height)\
-                .join(Tx, Block.transactions)\
-                .join(Output, Tx.outputs)\
-                .filter(Output.id == highest_id)\
-                .order_by(Block.height.desc())\
-                .first().height
-
-            if (highest_block + 1) in block_heights and fail_if_exists:
-                raise ValueError(f"highest block {highest_block} is in block heights")
+        checkpoint = self.get_checkpoint(session, GraphPopulationCheckpoint.VERTICES)
+        if checkpoint is not None and (checkpoint.block_height + 1) in block_heights and fail_if_exists:
+            raise ValueError(f"highest block {checkpoint.block_height} is in block heights")
 
         if show_progressbar:
             from tqdm import tqdm
@@ -302,6 +779,8 @@ class PopulateOutputProportionGraph:
                               .count()
             progressbar = tqdm(total=tx_count, desc="Populating graph", unit="tx")
 
+        current_height = None
+        last_output_id = None
         tx: Tx
         for tx in self.data_provider.get_txs_for_blocks(
             session,
@@ -309,42 +788,45 @@ class PopulateOutputProportionGraph:
             max_height=highest_to_populate,
             buffer=2000
         ):
+            # vertices and edges are written together, so both are complete up to the previous block
+            if tx.block_height != current_height and last_output_id is not None:
+                self.save_checkpoints(session, last_output_id)
+            current_height = tx.block_height
 
             tx_sum = tx.total_input_value()
+            if tx_sum > 0:
+                edge_values = haircut_matrix([input.prev_out.value for input in tx.inputs],
+                                             [output.value for output in tx.outputs])
+
             output: Output
-            for output in tx.outputs:
+            for output_index, output in enumerate(tx.outputs):
 
                 # Create a new output node if it doesn't exist.
                 output_node = __.addV('output') \
                                 .property('output_id', output.id)
                 if output.address is not None:
                     output_node = output_node.property('address_id', output.address.id)
+                output_node = output_node.property('value', output.value) \
+                                         .property('block_height', tx.block_height)
 
-                g.V().has('output', 'output_id', output.id) \
+                vertex = g.V().has('output', 'output_id', output.id) \
                     .fold() \
                     .coalesce(
                         __.unfold(),
                         output_node
                 ).next()
+                self.vertex_ids.set(output.id, vertex.id)
 
                 if tx_sum == 0:
                     continue
                 input: Input
-                for input in tx.inputs:
-                    haircut_value = haircut(input.prev_out.value, tx_sum, output.value)
+                for input_index, input in enumerate(tx.inputs):
+                    haircut_value = float(edge_values[input_index, output_index])
 
                     # Connect the input node to the output node.
                     # If the edge already exists, do nothing.
                     try:
-                        g.V().has('output', 'output_id', input.prev_out.id) \
-                             .inE('sent').where(__.outV().has('output', 'output_id', output.id)) \
-                             .fold() \
-                             .coalesce(__.unfold(),
-                                       __.V().has('output', 'output_id', output.id)
-                                       .addE('sent')
-                                       .from_(__.V().has('output', 'output_id', input.prev_out.id))
-                                       .property('value', haircut_value)
-                             ).next()
+                        self.haircut_edge_traversal(g, input.prev_out.id, output.id, haircut_value).next()
                     except GremlinServerError as e:
                         print(f"Error adding edge from {input.prev_out} to {output}")
                         print(f"tx: {tx.id}")
@@ -353,92 +835,150 @@ class PopulateOutputProportionGraph:
                         print(f"output value: {output.value}")
                         raise e
 
+            if tx.outputs:
+                last_output_id = tx.outputs[-1].id
+
             if show_progressbar:
                 progressbar.update(1)
 
+        if last_output_id is not None:
+            self.save_checkpoints(session, last_output_id)
+
         if show_progressbar:
             progressbar.close()
 
+    def output_vertex_rows(self, session: Session, lowest_to_populate: int, highest_to_populate: int,
+                           txs_per_chunk: int = 1_000):
+        """Yield a row for GremlinBatchWriter.add_output_vertices_async for each output in a height range,
+        in output ID order.
+
+        With a pruning policy, outputs it leaves out are skipped, and rows have the pruned_value of
+        their outputs. That depends on the inputs of their transactions, so transactions are read
+        instead of outputs alone, and their edges are computed a chunk at a time.
+        """
+        if not self.pruning.prunes_edges:
+            for output in self.data_provider.get_outputs_for_blocks(
+                session,
+                min_height=lowest_to_populate,
+                max_height=highest_to_populate,
+                buffer=20_000
+            ):
+                yield {
+                    'output_id': output.id,
+                    'address_id': output.address_id,
+                    'value': output.value,
+                    'block_height': output.transaction.block_height
+                }
+            return
+
+        txs = iter(self.data_provider.get_txs_for_blocks(
+            session,
+            min_height=lowest_to_populate,
+            max_height=highest_to_populate,
+            buffer=20_000
+        ))
+        while chunk := list(itertools.islice(txs, txs_per_chunk)):
+            _, _, _, pruned_values = self.pruning.haircut_edges(chunk)
+            for tx in chunk:
+                for output in tx.outputs:
+                    if self.pruning.keep_output(output):
+                        yield {
+                            'output_id': output.id,
+                            'address_id': output.address_id,
+                            'value': output.value,
+                            'block_height': tx.block_height,
+                            'pruned_value': pruned_values.get(output.id)
+                        }
+
     def create_output_nodes(
         self,
         session,
         highest_to_populate: int = None,
         lowest_to_populate: int = None,
         show_progressbar: bool = False,
-        batch_size: int = 10,
-        skip_check_highest: bool = False
+        batch_size: int = 1_000,
+        insert_only: bool = False
     ):
-        # TODO: Currently, this function uses all RAM and is automatically killed.
-        #       This is because JanusGraph doesn't deal well with inserting
-        #       a large number of vertices in batch. See https://stackoverflow.com/q/54775215/6946463
-        #       We need to find a way to do this faster while using less RAM.
+        """Create vertices for all outputs in a height range. Outputs which are
+        already populated according to the population checkpoint are skipped,
+        and so are outputs the pruning policy leaves out.
+
+        Args:
+            lowest_to_populate (int, optional): Defaults to resuming from the population checkpoint.
+            insert_only (bool, optional): Insert vertices without checking whether each one exists.
+                Only outputs in the lowest block, which may be partially populated, are upserted.
+                Fails if vertices already exist above it. Defaults to False.
+        """
+        # Each batch is written with one inject() traversal (see graph/batch_writer.py), rather than
+        # one chained get-or-create traversal per vertex, which made JanusGraph use all RAM on large batches.
+        # See https://stackoverflow.com/q/54775215/6946463
+        # For a full rebuild, graph/bulk_export.py is still much faster.
 
         if highest_to_populate is None:
             highest_to_populate = self.get_highest_block_height(session)
 
-        if not skip_check_highest:
-            highest_id = self.get_highest_vertex_id()
-        else:
-            highest_id = -1
+        checkpoint = self.get_checkpoint(session, GraphPopulationCheckpoint.VERTICES)
+        populated_output_id = checkpoint.output_id if checkpoint is not None else -1
 
         if lowest_to_populate is None:
-            if highest_id < 0:
-                lowest_to_populate = 0
-            else:
-                lowest_to_populate = session.query(Block.height)\
-                    .join(Tx, Block.transactions)\
-                    .join(Output, Tx.outputs)\
-                    .filter(Output.id == highest_id)\
-                    .order_by(Block.height.desc())\
-                    .first().height
-
-        # Get all output ids
-        highest_output_id = session.query(Output.id)\
-                                   .join(Tx, Output.transaction)\
-                                   .filter(Tx.block_height <= highest_to_populate)\
-                                   .order_by(Output.id.desc()).first()
+            lowest_to_populate = checkpoint.block_height + 1 if checkpoint is not None else 0
+
+        highest_output_id = self.get_highest_output_id(session, highest_to_populate)
+        if highest_output_id <= populated_output_id:
+            return
+        output_ids = range(populated_output_id + 1, highest_output_id + 1)
+
+        boundary_output_id = None
+        if insert_only:
+            boundary_output_id = self.insert_only_boundary(session, GraphPopulationCheckpoint.VERTICES,
+                                                           lowest_to_populate)
+            if checkpoint is None:
+                self.check_vertices_fresh(boundary_output_id, highest_output_id)
 
-        highest_output_id = highest_output_id[0]
-        output_ids = range(highest_id + 1, highest_output_id + 1)
+        # the checkpoint can only be moved if nothing is skipped between it and this range
+        track_checkpoint = self.get_highest_output_id(session, lowest_to_populate - 1) <= populated_output_id
+        if track_checkpoint:
+            self.start_checkpoint(session, GraphPopulationCheckpoint.VERTICES, highest_output_id)
 
         if show_progressbar:
             from tqdm import tqdm
             progressbar = tqdm(output_ids, desc="Creating output nodes", unit="output")
 
+        checkpoint_type = GraphPopulationCheckpoint.VERTICES if track_checkpoint else None
+        sizer = self.batch_sizer(batch_size)
+
+        def write_batch(pool, batch):
+            self._dispatch_batch(
+                session, pool,
+                functools.partial(self._write_output_vertices, boundary_output_id=boundary_output_id),
+                batch, sizer,
+                batch[-1]['output_id'],
+                f"{len(batch)} vertices for outputs {batch[0]['output_id']} to {batch[-1]['output_id']}",
+                checkpoint_type,
+                rewrite=self._write_output_vertices
+            )
+            if show_progressbar:
+                # outputs left out by the pruning policy count as done too
+                progressbar.update(batch[-1]['output_id'] + 1 - output_ids.start - progressbar.n)
+                progressbar.set_postfix(batch_size=sizer.size)
+
         # Batch creation of output nodes
-        batch_traversal = g
-        current_chunk_count = 0
-        for output in self.data_provider.get_outputs_for_blocks(
-            session,
-            min_height=lowest_to_populate,
-            max_height=highest_to_populate,
-            buffer=20_000
-        ):
-            if output.id not in output_ids:
-                continue
-
-            # Create a new output node if it doesn't exist.
-            output_node = __.addV('output') \
-                            .property('output_id', output.id)
-            if output.address is not None:
-                output_node = output_node.property('address_id', output.address.id)
-
-            batch_traversal = batch_traversal.V() \
-                .has('output', 'output_id', output.id) \
-                .fold() \
-                .coalesce(
-                    __.unfold(),
-                    output_node
-                )
-
-            current_chunk_count += 1
-
-            if current_chunk_count == batch_size:
-                batch_traversal.iterate()
-                current_chunk_count = 0
-                batch_traversal = g
-                if show_progressbar:
-                    progressbar.update(batch_size)
+        with self.writer_pool() as pool:
+            batch = []
+            for row in self.output_vertex_rows(session, lowest_to_populate, highest_to_populate):
+                if row['output_id'] not in output_ids:
+                    continue
+
+                batch.append(row)
+
+                if len(batch) >= sizer.size:
+                    write_batch(pool, batch)
+                    batch = []
+
+            if batch:
+                write_batch(pool, batch)
+
+            self._finish_batches(session, pool, checkpoint_type)
 
         if show_progressbar:
             progressbar.close()
@@ -449,13 +989,45 @@ class PopulateOutputProportionGraph:
         highest_to_populate: int = None,
         lowest_to_populate: int = None,
         show_progressbar: bool = False,
-        batch_size: int = 10
+        batch_size: int = 1_000,
+        insert_only: bool = False
     ):
+        """Create haircut edges for all transactions in a height range, or tx vertices with their
+        edges in the tx projection. Transactions which are already populated according to
+        the population checkpoint are skipped.
+
+        Args:
+            lowest_to_populate (int, optional): Defaults to resuming from the population checkpoint.
+            insert_only (bool, optional): Insert edges without checking whether each one exists.
+                Only edges to outputs in the lowest block, which may be partially populated, are upserted.
+                Fails if edges already exist above it. Defaults to False.
+        """
 
         if highest_to_populate is None:
             highest_to_populate = self.get_highest_block_height(session)
+
+        checkpoint = self.get_checkpoint(session, GraphPopulationCheckpoint.EDGES)
+        populated_output_id = checkpoint.output_id if checkpoint is not None else -1
+
         if lowest_to_populate is None:
-            lowest_to_populate = 0
+            lowest_to_populate = checkpoint.block_height + 1 if checkpoint is not None else 0
+
+        highest_output_id = self.get_highest_output_id(session, highest_to_populate)
+        if highest_output_id <= populated_output_id:
+            return
+
+        boundary_output_id = None
+        checked_fresh = True
+        if insert_only:
+            boundary_output_id = self.insert_only_boundary(session, GraphPopulationCheckpoint.EDGES,
+                                                           lowest_to_populate)
+            # without a checkpoint, check the graph itself when reaching the first transaction above the boundary
+            checked_fresh = checkpoint is not None
+
+        # the checkpoint can only be moved if nothing is skipped between it and this range
+        track_checkpoint = self.get_highest_output_id(session, lowest_to_populate - 1) <= populated_output_id
+        if track_checkpoint:
+            self.start_checkpoint(session, GraphPopulationCheckpoint.EDGES, highest_output_id)
 
         if show_progressbar:
             # count number of transactions between 0 and highest_to_populate
@@ -463,55 +1035,95 @@ class PopulateOutputProportionGraph:
                               .filter(Tx.block_height <= highest_to_populate, Tx.block_height >= lowest_to_populate)\
                               .count()
             from tqdm import tqdm
-            progressbar = tqdm(range(0, tx_count + 1), desc="Creating haircut edges", unit="tx")
+            desc = "Creating tx vertices" if self.projection == TX_PROJECTION else "Creating haircut edges"
+            progressbar = tqdm(range(0, tx_count + 1), desc=desc, unit="tx")
+
+        checkpoint_type = GraphPopulationCheckpoint.EDGES if track_checkpoint else None
+        sizer = self.batch_sizer(batch_size)
+
+        def write_batch(pool, batch_txs, last_output_id):
+            if self.projection == TX_PROJECTION:
+                batch = [self.tx_vertex_row(tx) for tx in batch_txs]
+                write = self._write_tx_vertices
+                described = f"{len(batch)} tx vertices"
+            else:
+                prev_out_ids, output_ids, values, _ = self.pruning.haircut_edges(batch_txs)
+                batch = list(zip(prev_out_ids.tolist(), output_ids.tolist(), values.tolist()))
+                write = self._write_sent_edges
+                described = f"{len(batch)} edges"
+            self._dispatch_batch(
+                session, pool,
+                functools.partial(write, boundary_output_id=boundary_output_id),
+                batch, sizer,
+                last_output_id,
+                f"{described} for txs {batch_txs[0].id} to {batch_txs[-1].id} "
+                f"in blocks {batch_txs[0].block_height} to {batch_txs[-1].block_height}",
+                checkpoint_type,
+                rewrite=write
+            )
+
+        with self.writer_pool() as pool:
+            batch_txs = []
+            batch_edge_count = 0
+            last_output_id = None
+            tx: Tx
+            for tx in self.data_provider.get_txs_for_blocks(
+                session,
+                min_height=lowest_to_populate,
+                max_height=highest_to_populate,
+                buffer=20_000
+            ):
+                if not tx.outputs or tx.outputs[-1].id <= populated_output_id:
+                    if show_progressbar:
+                        progressbar.update(1)
+                    continue
+                last_output_id = tx.outputs[-1].id
+
+                tx_sum = tx.total_input_value()
+                # Some transactions send 0 BTC.
+                # This is very strange, but since no value is sent,
+                # no edges should be created.
+                if tx_sum == 0:
+                    if show_progressbar:
+                        progressbar.update(1)
+                    continue
+
+                # edges are populated in transaction order, so if the first transaction
+                # above the boundary has no edges, none of the later ones do either
+                if not checked_fresh and tx.outputs[0].id > boundary_output_id:
+                    if self.projection == TX_PROJECTION:
+                        exists = self.writer.existing_tx_vertices([tx.id])
+                    else:
+                        exists = self.writer.existing_sent_edges([output.id for output in tx.outputs])
+                    if exists:
+                        raise ValueError(f"Edges already exist for tx {tx.id} above block {lowest_to_populate}. "
+                                         "Populate without insert_only, or delete them first.")
+                    checked_fresh = True
+
+                batch_txs.append(tx)
+                if self.projection == TX_PROJECTION:
+                    batch_edge_count += len(tx.inputs) + len(tx.outputs)
+                else:
+                    batch_edge_count += len(tx.inputs) * len(tx.outputs)
+
+                # edges of a transaction are written together, so batches can be slightly larger than the batch size
+                if batch_edge_count >= sizer.size:
+                    write_batch(pool, batch_txs, last_output_id)
+                    batch_txs = []
+                    batch_edge_count = 0
+                    if show_progressbar:
+                        progressbar.set_postfix(batch_size=sizer.size)
 
-        current_batch_count = 0
-        batch_traversal = g
-        tx: Tx
-        for tx in self.data_provider.get_txs_for_blocks(
-            session,
-            min_height=lowest_to_populate,
-            max_height=highest_to_populate,
-            buffer=20_000
-        ):
-            tx_sum = tx.total_input_value()
-            # Some transactions send 0 BTC.
-            # This is very strange, but since no value is sent,
-            # no edges should be created.
-            if tx_sum == 0:
                 if show_progressbar:
                     progressbar.update(1)
-                continue
-            for output in tx.outputs:
-
-                for input in tx.inputs:
-
-                    haircut_value = haircut(input.prev_out.value, tx_sum, output.value)
-
-                    batch_traversal = batch_traversal.V().has('output_id', input.prev_out.id) \
-                                                            .inE('sent').where(__.outV().has('output_id', output.id)) \
-                                                            .fold() \
-                                                            .coalesce(__.unfold(),
-                                                                    __.V().has('output_id', output.id)
-                                                                        .addE('sent')
-                                                                        .from_(__.V().has('output_id', input.prev_out.id))
-                                                                        .property('value', haircut_value)
-                                                            )
-
-                    current_batch_count += 1
-                    if current_batch_count == batch_size:
-                        try:
-                            batch_traversal.iterate()
-                        except Exception as e:
-                            print(f"Error adding edge from {input.prev_out} to {output}")
-                            print(f"tx: {tx.id}")
-                            print(f"block: {tx.block_height}")
-                            raise e
-                        current_batch_count = 0
-                        batch_traversal = g
 
-            if show_progressbar:
-                progressbar.update(1)
+            if batch_txs:
+                write_batch(pool, batch_txs, last_output_id)
+            self._finish_batches(session, pool, checkpoint_type)
+
+            # transactions after the last batch may have sent no value, so they have no edges
+            if track_checkpoint and last_output_id is not None:
+                self.save_checkpoints(session, last_output_id, [GraphPopulationCheckpoint.EDGES])
 
         if show_progressbar:
             progressbar.close()
@@ -521,24 +1133,29 @@ class PopulateOutputProportionGraph:
         session: Session,
         block_heights: list[int] = None,
         show_progressbar=False,
-        batch_size: int = 5,
+        batch_size: int = 1_000,
         skip_vertices: bool = False,
         max_height: int = None,
-        start_height: int = 0,
-        skip_check_highest: bool = False
+        start_height: int = None,
+        insert_only: bool = False,
+        address_flows: bool = False
     ):
+        """Create vertices, then edges, for a range of blocks.
+
+        Args:
+            start_height (int, optional): Defaults to resuming from the population checkpoints.
+            address_flows (bool, optional): Also build the address flow graph up to the highest block.
+                Defaults to False.
+        """
 
         if block_heights is None:
             if max_height is None:
                 max_height = self.get_highest_block_height(session) + 1
-            block_heights = list(range(start_height, max_height))
-
+            lowest_to_populate = start_height
+            highest_to_populate = max_height - 1
         else:
-            block_heights = list(block_heights)
-            block_heights.sort()
-
-        lowest_to_populate = block_heights[0]
-        highest_to_populate = block_heights[-1]
+            lowest_to_populate = min(block_heights)
+            highest_to_populate = max(block_heights)
 
         # First, create all vertices
         if not skip_vertices:
@@ -547,10 +1164,15 @@ class PopulateOutputProportionGraph:
                                      lowest_to_populate,
                                      show_progressbar,
                                      batch_size,
-                                     skip_check_highest=skip_check_highest)
+                                     insert_only=insert_only)
 
-        # Then, create all "sent" edges
-        self.create_haircut_edges(session, highest_to_populate, lowest_to_populate, show_progressbar, batch_size)
+        # Then, create all "sent" edges, or tx vertices in the tx projection. With parallel writers, every
+        # vertex batch has been written by the time create_output_nodes returns, so both ends of each edge exist.
+        self.create_haircut_edges(session, highest_to_populate, lowest_to_populate, show_progressbar, batch_size,
+                                  insert_only=insert_only)
+
+        if address_flows:
+            self.create_address_flows(session, highest_to_populate, show_progressbar)
 
         print("Done.")
 
@@ -560,38 +1182,93 @@ if __name__ == '__main__':
 
     from models.base import SessionLocal
     from blockchain_data_provider import PersistentBlockchainAPIData
+    from graph.memory_backend import InMemoryGraphBackend
 
     parser = argparse.ArgumentParser(description="Script for populating database")
     parser.add_argument('--height', default=None, type=int, help='Block height up to which to populate')
     parser.add_argument('--delete', default=False, action='store_true',
                         help='Delete all data in database and don\'t populate.')
+    parser.add_argument('--delete-above', default=None, type=int, dest='delete_above',
+                        help='Delete graph data for blocks above this height and don\'t populate.')
+    parser.add_argument('--workers', default=4, type=int,
+                        help='Number of parallel workers used when deleting graph data.')
 
     parser.add_argument('--batch', default=False, action='store_true',
                         help='Batch populate graph.')
+    parser.add_argument('--writers', default=1, type=int,
+                        help='Number of connections used to write batches in parallel during batch population.')
+    parser.add_argument('--in-flight', default=4, type=int, dest='in_flight',
+                        help='Number of batches sent without waiting for them to be written, with a single writer.')
+    parser.add_argument('--batch-size', default=1_000, type=int, dest='batch_size',
+                        help='Number of vertices or edges written per round trip during batch population. '
+                        'Adjusted as population runs, unless --fixed-batch-size is given.')
+    parser.add_argument('--fixed-batch-size', default=False, action='store_true', dest='fixed_batch_size',
+                        help='Keep the batch size fixed instead of adjusting it from write latency.')
+    parser.add_argument('--target-latency', default=5.0, type=float, dest='target_latency',
+                        help='Seconds a batch may take to write for the batch size to keep growing.')
     parser.add_argument('--skip-vertices', default=False, action='store_true',
                         help='Skip creating vertices during batch population. Only create edges.')
 
-    parser.add_argument('--start-height', default=0, type=int, dest='start_height',
-                        help='Block height to start populating from')
-    # Why is this check unbearably long?
-    # See https://stackoverflow.com/questions/70697793/faster-janusgraph-queries
-    # And also https://stackoverflow.com/questions/62480262/gremlin-haslabel-query-times-out
-    parser.add_argument('--skip-check-highest', default=False, action='store_true',
-                        dest='skip_check_highest',
-                        help='Skip checking highest output node id in database. Sometimes'
-                        'This check can be unbearably long ')
+    parser.add_argument('--insert-only', default=False, action='store_true', dest='insert_only',
+                        help='Insert vertices and edges without checking whether each one exists. '
+                        'Only for heights which have not been populated yet.')
+
+    parser.add_argument('--start-height', default=None, type=int, dest='start_height',
+                        help='Block height to start populating from. '
+                        'Batch population defaults to resuming from where it last stopped.')
+
+    parser.add_argument('--address-flows', default=False, action='store_true', dest='address_flows',
+                        help='Also build the address flow graph during batch population, '
+                        'with an edge for each pair of addresses which sent each other value.')
+
+    parser.add_argument('--projection', default=OUTPUT_PROJECTION, choices=PROJECTIONS,
+                        help='Represent each transaction with sent edges between every input and output (output), '
+                        'or with a tx vertex between them, which needs far fewer edges for large transactions (tx).')
+
+    parser.add_argument('--min-edge-value', default=0, type=float, dest='min_edge_value',
+                        help='Leave out haircut edges worth fewer satoshis than this during batch population.')
+    parser.add_argument('--min-input-fraction', default=0, type=float, dest='min_input_fraction',
+                        help='Leave out haircut edges carrying less than this fraction of their input.')
+    parser.add_argument('--skip-unspendable', default=False, action='store_true', dest='skip_unspendable',
+                        help='Leave out outputs which can never be spent.')
+    parser.add_argument('--min-output-value', default=0, type=int, dest='min_output_value',
+                        help='Leave out outputs worth fewer satoshis than this. 1 leaves out outputs with no value.')
+    parser.add_argument('--top-k-inputs', default=None, type=int, dest='top_k_inputs',
+                        help='Only keep the haircut edges from the inputs which send each output the most.')
+
+    parser.add_argument('--in-memory', default=False, action='store_true', dest='in_memory',
+                        help='Batch populate a graph kept in this process instead of JanusGraph, e.g. to benchmark '
+                        'population. It is discarded when population finishes.')
+
+    parser.add_argument('--vertex-id-cache', default=None, type=str, dest='vertex_id_cache',
+                        help='File to keep the output ID to vertex ID mapping in between runs.')
 
     args = parser.parse_args()
 
     data_provider = PersistentBlockchainAPIData()
 
-    populator = PopulateOutputProportionGraph(data_provider)
+    populator = PopulateOutputProportionGraph(data_provider, VertexIdCache(args.vertex_id_cache),
+                                              writers=args.writers, in_flight=args.in_flight,
+                                              adaptive_batch_size=not args.fixed_batch_size,
+                                              target_latency=args.target_latency,
+                                              projection=args.projection,
+                                              pruning=PruningPolicy(args.min_edge_value, args.min_input_fraction,
+                                                                    args.skip_unspendable, args.min_output_value,
+                                                                    args.top_k_inputs),
+                                              backend=InMemoryGraphBackend() if args.in_memory else None)
 
     if args.delete:
         print("Deleting all graph data...")
         # wipe the database
-        populator.clear_graph()
+        with SessionLocal() as session:
+            populator.clear_graph(session, workers=args.workers, show_progressbar=True)
         print("Graph data wiped.")
+    elif args.delete_above is not None:
+        print(f"Deleting graph data above height {args.delete_above}...")
+        with SessionLocal() as session:
+            populator.clear_graph_above_height(session, args.delete_above,
+                                               workers=args.workers, show_progressbar=True)
+        print(f"Graph data above height {args.delete_above} wiped.")
     else:
         with SessionLocal() as session:
             print("Populating graph...")
@@ -610,16 +1287,17 @@ if __name__ == '__main__':
                     print("Batch populating graph...")
                     populator.populate_batch(session,
                                              show_progressbar=True, skip_vertices=args.skip_vertices,
+                                             batch_size=args.batch_size,
                                              max_height=args.height,
                                              start_height=args.start_height,
-                                             skip_check_highest=args.skip_check_highest)
+                                             insert_only=args.insert_only,
+                                             address_flows=args.address_flows)
                 else:
-                    if args.skip_vertices:
+                    if args.skip_vertices or args.insert_only:
                         raise ValueError("This argument cannot be used without --batch")
                     populator.populate_outputs_onebyone_getorcreate(
                         session,
                         range(0, highest_block.height + 1),
                         show_progressbar=True,
-                        start_height=args.start_height,
-                        skip_check_highest=args.skip_check_highest
+                        start_height=args.start_height if args.start_height is not None else 0
                     )
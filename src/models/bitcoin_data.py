@@ -3,7 +3,6 @@ from sqlalchemy import (
     Index,
     Integer,
     BigInteger,
-    String,
     Boolean,
     DateTime,
     Text,
@@ -20,6 +19,7 @@ from sqlalchemy.orm import (
     aliased
 )
 import models.base
+from models.encoding import TxHashType, AddressType
 
 
 BITCOIN_TO_SATOSHI = 1e8
@@ -62,7 +62,7 @@ class Tx(models.base.Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
 
-    hash = Column(String)
+    hash = Column(TxHashType)
     index = Column(BigInteger, index=True)
     index_in_block = Column(Integer, index=True)
     is_duplicate = Column(Boolean, default=False, index=True)
@@ -128,6 +128,10 @@ class Output(models.base.Base):
     # find the address for them
     valid: Mapped['bool'] = mapped_column(default=True, index=True)
 
+    # Staging column holding the address exactly as it appeared in the output.
+    # Addresses can be re-derived from this in bulk (see repopulate_addresses).
+    address_addr: Mapped['str'] = mapped_column(AddressType, nullable=True)
+
     transaction: Mapped['Tx'] = relationship(
         back_populates="outputs",
         passive_deletes=True
@@ -218,7 +222,7 @@ class Address(models.base.Base):
     __tablename__ = "addresses"
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
-    addr = Column(String, index=True)
+    addr = Column(AddressType, index=True)
     outputs = relationship("Output", back_populates="address", passive_deletes=True)
 
     # Many-to-many relationship with Owner
@@ -0,0 +1,132 @@
+"""Compact binary encodings for transaction hashes and addresses.
+
+Transaction hashes are stored as their raw 32 bytes instead of a 64 character
+hex string. Base58 addresses are stored as their version byte followed by the
+20 byte hash160 (21 bytes in total) instead of a ~34 character string.
+
+Addresses which are not valid base58check (e.g. bech32 or other non-standard
+forms) are stored using a fallback encoding: a marker byte followed by the
+UTF-8 bytes of the original string. The marker is never used as a version byte
+by the compact form, so the two forms can't be confused when decoding.
+
+The SQLAlchemy types defined here make the encoding transparent: models
+and queries keep using plain strings.
+"""
+import hashlib
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+
+TX_HASH_LENGTH = 32
+HASH160_LENGTH = 20
+COMPACT_ADDRESS_LENGTH = 1 + HASH160_LENGTH
+CHECKSUM_LENGTH = 4
+
+# prefix for addresses which can't be stored in the compact form
+FALLBACK_ADDRESS_MARKER = 0xFF
+
+
+def b58encode(data: bytes) -> str:
+    leading_zeros = len(data) - len(data.lstrip(b'\x00'))
+    number = int.from_bytes(data, 'big')
+
+    encoded = []
+    while number > 0:
+        number, remainder = divmod(number, 58)
+        encoded.append(BASE58_ALPHABET[remainder])
+
+    return BASE58_ALPHABET[0] * leading_zeros + ''.join(reversed(encoded))
+
+
+def b58decode(string: str) -> bytes:
+    number = 0
+    for char in string:
+        if char not in BASE58_INDEX:
+            raise ValueError(f"Invalid base58 character {char!r}")
+        number = number * 58 + BASE58_INDEX[char]
+
+    leading_zeros = len(string) - len(string.lstrip(BASE58_ALPHABET[0]))
+    body = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return b'\x00' * leading_zeros + body
+
+
+def checksum(payload: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:CHECKSUM_LENGTH]
+
+
+def encode_tx_hash(tx_hash: str) -> bytes:
+    raw = bytes.fromhex(tx_hash)
+    if len(raw) != TX_HASH_LENGTH:
+        raise ValueError(f"Transaction hash {tx_hash} is not {TX_HASH_LENGTH} bytes long")
+    return raw
+
+
+def decode_tx_hash(raw: bytes) -> str:
+    return bytes(raw).hex()
+
+
+def encode_address(address: str) -> bytes:
+    """Encode an address as version byte + hash160, or using the fallback
+    encoding if the address isn't a standard base58check address.
+    """
+    try:
+        decoded = b58decode(address)
+    except ValueError:
+        decoded = b''
+
+    if len(decoded) == COMPACT_ADDRESS_LENGTH + CHECKSUM_LENGTH:
+        payload, check = decoded[:COMPACT_ADDRESS_LENGTH], decoded[COMPACT_ADDRESS_LENGTH:]
+        if (
+            payload[0] != FALLBACK_ADDRESS_MARKER
+            and checksum(payload) == check
+            # make sure decoding gives back exactly the same string
+            and b58encode(payload + check) == address
+        ):
+            return payload
+
+    return bytes([FALLBACK_ADDRESS_MARKER]) + address.encode('utf-8')
+
+
+def decode_address(raw: bytes) -> str:
+    raw = bytes(raw)
+    if raw[0] == FALLBACK_ADDRESS_MARKER:
+        return raw[1:].decode('utf-8')
+    return b58encode(raw + checksum(raw))
+
+
+class TxHashType(TypeDecorator):
+    """A hex transaction hash, stored as 32 raw bytes (bytea)."""
+
+    impl = LargeBinary(TX_HASH_LENGTH)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return encode_tx_hash(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_tx_hash(value)
+
+
+class AddressType(TypeDecorator):
+    """An address string, stored as version byte + hash160 (bytea)."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return encode_address(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_address(value)
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    Integer,
+    BigInteger,
+    String,
+    DateTime
+)
+from sqlalchemy.orm import (
+    Session,
+    mapped_column,
+    Mapped
+)
+import models.base
+
+
+class GraphPopulationCheckpoint(models.base.Base):
+    """How far the graph has been populated, so population can resume without scanning the graph.
+
+    There is one row for vertices and one for edges, since they are populated separately,
+    and one for the address flow graph, which is aggregated from the blockchain database.
+    """
+    __tablename__ = 'graph_population_checkpoints'
+
+    VERTICES = 'vertices'
+    EDGES = 'edges'
+    ADDRESS_FLOWS = 'address_flows'
+
+    element_type: Mapped[str] = mapped_column(String(16), primary_key=True)
+
+    # highest block whose outputs are all populated
+    block_height: Mapped[int] = mapped_column(Integer)
+    # highest populated output ID. Outputs are populated in ID order,
+    # so all outputs with lower IDs are populated too.
+    output_id: Mapped[int] = mapped_column(BigInteger)
+    # highest output ID a population run has started writing. If a run is interrupted,
+    # outputs between output_id and this may be partially populated.
+    pending_output_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<GraphPopulationCheckpoint({self.element_type}, block_height={self.block_height}, " \
+               f"output_id={self.output_id})>"
+
+    @staticmethod
+    def get(session: Session, element_type: str):
+        """Get the checkpoint for vertices or edges, or None if nothing has been populated."""
+        return session.get(GraphPopulationCheckpoint, element_type)
+
+    @staticmethod
+    def start(session: Session, element_type: str, pending_output_id: int):
+        """Record that a run is about to populate outputs up to pending_output_id. The caller commits."""
+        checkpoint = session.get(GraphPopulationCheckpoint, element_type, with_for_update=True)
+        if checkpoint is None:
+            session.add(GraphPopulationCheckpoint(
+                element_type=element_type,
+                block_height=-1,
+                output_id=-1,
+                pending_output_id=pending_output_id,
+                updated_at=datetime.utcnow()
+            ))
+        elif checkpoint.pending_output_id is None or pending_output_id > checkpoint.pending_output_id:
+            checkpoint.pending_output_id = pending_output_id
+            checkpoint.updated_at = datetime.utcnow()
+
+    @staticmethod
+    def save(session: Session, element_type: str, block_height: int, output_id: int):
+        """Create or advance the checkpoint for vertices or edges. Checkpoints are never moved
+        back by saving, since repopulating a lower range doesn't undo what's above it.
+        The caller commits.
+        """
+        checkpoint = session.get(GraphPopulationCheckpoint, element_type, with_for_update=True)
+        if checkpoint is None:
+            session.add(GraphPopulationCheckpoint(
+                element_type=element_type,
+                block_height=block_height,
+                output_id=output_id,
+                updated_at=datetime.utcnow()
+            ))
+        elif output_id > checkpoint.output_id:
+            checkpoint.block_height = block_height
+            checkpoint.output_id = output_id
+            checkpoint.updated_at = datetime.utcnow()
+
+    @staticmethod
+    def rewind(session: Session, block_height: int, output_id: int):
+        """Move any checkpoints past output_id back to it, after the graph above it is deleted.
+        The caller commits.
+        """
+        if output_id < 0:
+            GraphPopulationCheckpoint.clear(session)
+            return
+
+        session.query(GraphPopulationCheckpoint)\
+               .filter(GraphPopulationCheckpoint.output_id > output_id)\
+               .update({
+                   GraphPopulationCheckpoint.block_height: block_height,
+                   GraphPopulationCheckpoint.output_id: output_id,
+                   GraphPopulationCheckpoint.updated_at: datetime.utcnow()
+               }, synchronize_session=False)
+        session.query(GraphPopulationCheckpoint)\
+               .filter(GraphPopulationCheckpoint.pending_output_id > output_id)\
+               .update({
+                   GraphPopulationCheckpoint.pending_output_id: output_id
+               }, synchronize_session=False)
+
+    @staticmethod
+    def clear(session: Session, element_type: str = None):
+        """Remove all checkpoints, after the graph is wiped, or just the one for element_type.
+        The caller commits.
+        """
+        query = session.query(GraphPopulationCheckpoint)
+        if element_type is not None:
+            query = query.filter(GraphPopulationCheckpoint.element_type == element_type)
+        query.delete(synchronize_session=False)
@@ -0,0 +1,26 @@
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from utils import MockDataProvider
+from models.base import Base
+from blockchain_data_provider import PersistentBlockchainAPIData
+
+# Constants
+TEST_DATABASE_URL = "sqlite:///:memory:"
+
+
+@pytest.fixture(scope="module")
+def session_factory():
+    # An in-memory SQLite database with a few blocks, including block 170,
+    # which has the first transaction spending a previous output
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    blockchain_api = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+    with Session() as session:
+        for height in (0, 1, 9, 170):
+            blockchain_api.populate_block(session, height)
+    return Session
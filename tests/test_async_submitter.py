@@ -0,0 +1,51 @@
+from concurrent.futures import Future
+
+import pytest
+
+from graph.async_submitter import AsyncBatchSubmitter
+from graph.batch_writer import gather
+
+
+def test_batches_in_flight_are_bounded():
+    futures = [Future() for _ in range(3)]
+    submitter = AsyncBatchSubmitter(writer=None, max_in_flight=2)
+
+    submitter.submit(lambda writer: futures[0], last_output_id=9)
+    submitter.submit(lambda writer: futures[1], last_output_id=19)
+    assert len(submitter.in_flight) == 2
+    assert submitter.pop_completed_output_id() is None
+
+    # submitting a third batch waits for the oldest one
+    futures[0].set_result(None)
+    submitter.submit(lambda writer: futures[2], last_output_id=29)
+    assert submitter.pop_completed_output_id() == 9
+
+    # the checkpoint doesn't move past a batch which hasn't finished
+    futures[2].set_result(None)
+    assert submitter.pop_completed_output_id() is None
+
+    futures[1].set_result(None)
+    submitter.join()
+    assert submitter.pop_completed_output_id() == 29
+
+
+def test_errors_are_raised_with_context(capsys):
+    future = Future()
+    future.set_exception(RuntimeError("server error"))
+
+    submitter = AsyncBatchSubmitter(writer=None, max_in_flight=4)
+    with pytest.raises(RuntimeError):
+        submitter.submit(lambda writer: future, last_output_id=9, context="10 edges for txs 1 to 2")
+        submitter.join()
+    assert "10 edges for txs 1 to 2" in capsys.readouterr().out
+
+
+def test_gather():
+    futures = [Future(), Future()]
+    combined = gather(futures)
+    futures[1].set_result(2)
+    assert not combined.done()
+    futures[0].set_result(1)
+    assert combined.result() == [1, 2]
+
+    assert gather([]).result() == []
@@ -0,0 +1,117 @@
+import functools
+from concurrent.futures import Future
+
+import pytest
+from gremlin_python.driver.protocol import GremlinServerError
+
+from graph.batch_sizer import AdaptiveBatchSizer, write_in_halves
+from graph.memory_backend import InMemoryGraphBackend
+from graph_populate import PopulateOutputProportionGraph
+
+
+def server_error(message="Evaluation exceeded the configured threshold"):
+    return GremlinServerError({'code': 598, 'message': message, 'attributes': {}})
+
+
+def test_grows_additively_and_halves():
+    sizer = AdaptiveBatchSizer(100, increment=10, max_size=130, target_latency=1.0)
+
+    sizer.record_success(0.5)
+    assert sizer.size == 110
+    # slow batches don't grow the size
+    sizer.record_success(2.0)
+    assert sizer.size == 110
+
+    sizer.record_success(0.5)
+    sizer.record_success(0.5)
+    sizer.record_success(0.5)
+    assert sizer.size == 130
+
+    sizer.record_failure()
+    assert sizer.size == 65
+    assert sizer.failures == 1
+
+
+def test_fixed_size():
+    sizer = AdaptiveBatchSizer(100, adaptive=False)
+    sizer.record_success(0.1)
+    sizer.record_failure()
+    assert sizer.size == 100
+
+
+def test_failed_batches_are_split():
+    written = []
+
+    def write(items):
+        # the server can't cope with more than 3 items at once
+        if len(items) > 3:
+            raise server_error()
+        written.append(items)
+
+    sizer = AdaptiveBatchSizer(10, target_latency=60)
+    write_in_halves(write, list(range(10)), sizer)
+
+    assert [item for items in written for item in items] == list(range(10))
+    assert all(len(items) <= 3 for items in written)
+    assert sizer.size < 10
+
+
+def test_timeouts_echoing_block_heights_are_split():
+    written = []
+
+    def write(items):
+        if len(items) > 3:
+            # the server echoes the request, which writes each output vertex's block_height
+            raise server_error("A timeout occurred during traversal evaluation of [RequestMessage{args={gremlin="
+                               "[[], [addV(output), property(block_height, [[select(m), select(block_height)]])]]}]")
+        written.append(items)
+
+    sizer = AdaptiveBatchSizer(10, target_latency=60)
+    write_in_halves(write, list(range(10)), sizer)
+
+    assert [item for items in written for item in items] == list(range(10))
+    assert sizer.failures > 0 and sizer.size < 10
+
+
+def test_lock_conflicts_are_not_split():
+    def write(items):
+        raise server_error("Local lock contention")
+
+    with pytest.raises(GremlinServerError):
+        write_in_halves(write, list(range(10)), AdaptiveBatchSizer(10))
+
+
+class FlakyBackend(InMemoryGraphBackend):
+    """Fails one traversal adding edges, after the ones before it were committed."""
+
+    def __init__(self, failing_call: int):
+        super().__init__(initial_vertices=8, initial_edges=8)
+        self.failing_call = failing_call
+        self.calls = 0
+
+    def add_sent_edges_async(self, edges):
+        self.calls += 1
+        if self.calls == self.failing_call:
+            failed = Future()
+            failed.set_exception(server_error())
+            return failed
+        return super().add_sent_edges_async(edges)
+
+
+@pytest.mark.parametrize('failing_call', [1, 2])
+def test_retried_halves_dont_duplicate_committed_parts(failing_call):
+    backend = FlakyBackend(failing_call)
+    backend.add_output_vertices_async([{'output_id': output_id} for output_id in range(6)])
+    populator = PopulateOutputProportionGraph(backend=backend)
+    edges = [(0, 2, 1.0), (1, 3, 1.0), (0, 4, 1.0), (1, 5, 1.0)]
+
+    # edges to outputs up to 3 are upserted, and the rest inserted, in separate traversals
+    populator._dispatch_batch(
+        None, None,
+        functools.partial(populator._write_sent_edges, boundary_output_id=3),
+        edges, AdaptiveBatchSizer(4),
+        last_output_id=5, context="4 edges",
+        rewrite=populator._write_sent_edges
+    )
+
+    assert backend.sent_edge_values(range(6)) == {(0, 2): [1.0], (1, 3): [1.0], (0, 4): [1.0], (1, 5): [1.0]}
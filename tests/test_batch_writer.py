@@ -0,0 +1,205 @@
+from concurrent.futures import Future
+
+from gremlin_python.driver.remote_connection import RemoteTraversal
+from gremlin_python.process.anonymous_traversal import traversal
+from gremlin_python.process.traversal import P, Traverser
+from gremlin_python.structure.graph import Vertex
+
+from graph.batch_writer import GremlinBatchWriter
+from graph.vertex_ids import VertexIdCache
+
+
+class RecordingWriter(GremlinBatchWriter):
+    """Keeps sent edges in a dict instead of a graph, recording what is written."""
+
+    def __init__(self, edges: dict):
+        # output IDs double as vertex IDs
+        super().__init__(g=None, vertex_ids=VertexIdCache())
+        self.edges = edges
+        self.dropped = []
+        self.added = []
+
+    def output_vertex_ids(self, output_ids):
+        return {output_id: output_id for output_id in output_ids}
+
+    def sent_edge_values(self, output_ids):
+        return {pair: values for pair, values in self.edges.items() if pair[1] in output_ids}
+
+    def drop_sent_edges(self, vertex_pairs):
+        self.dropped.extend(vertex_pairs)
+        for pair in vertex_pairs:
+            del self.edges[pair]
+
+    def add_sent_edges(self, edges):
+        self.added.extend(edges)
+        for prev_out_id, output_id, value in edges:
+            self.edges.setdefault((prev_out_id, output_id), []).append(value)
+
+
+def test_replace_sent_edges_only_writes_changes():
+    writer = RecordingWriter({
+        (1, 10): [4.0],
+        (2, 10): [6.0],
+        (1, 11): [5.0],
+        (2, 11): [5.0, 5.0],
+        (3, 12): [1.0],
+    })
+
+    dropped, added = writer.replace_sent_edges([
+        (1, 10, 4.0),
+        (2, 10, 7.0),
+        (2, 11, 5.0),
+    ], output_ids=[10, 11])
+
+    # (1, 10) is unchanged, (2, 10) has a new value, (1, 11) is no longer wanted,
+    # (2, 11) was duplicated, and (3, 12) goes to another output
+    assert sorted(writer.dropped) == [(1, 11), (2, 10), (2, 11)]
+    assert sorted(writer.added) == [(2, 10, 7.0), (2, 11, 5.0)]
+    assert (dropped, added) == (3, 2)
+    assert writer.edges == {(1, 10): [4.0], (2, 10): [7.0], (2, 11): [5.0], (3, 12): [1.0]}
+
+    # nothing is written when the edges are already right
+    writer.dropped, writer.added = [], []
+    assert writer.replace_sent_edges([(1, 10, 4.0), (2, 10, 7.0), (2, 11, 5.0)], output_ids=[10, 11]) == (0, 0)
+    assert writer.dropped == [] and writer.added == []
+
+
+class RecordingFlowWriter(GremlinBatchWriter):
+    """Keeps flow edges in a dict instead of a graph. Address IDs double as vertex IDs."""
+
+    def __init__(self):
+        super().__init__(g=None)
+        self.edges = {}
+
+    def address_vertex_ids(self, address_ids):
+        return {address_id: address_id for address_id in address_ids}
+
+    def address_flow_edges(self, vertex_pairs):
+        return {pair: [dict(self.edges[pair])] for pair in vertex_pairs if pair in self.edges}
+
+    def drop_edges(self, label, vertex_pairs):
+        assert label == 'flow'
+        for pair in vertex_pairs:
+            del self.edges[pair]
+
+    def add_address_flow_edges(self, rows):
+        self.edges.update(rows)
+
+
+def test_merge_address_flows():
+    writer = RecordingFlowWriter()
+    writer.merge_address_flows([(1, 2, 10.0, 1, 5, 5), (2, 3, 4.0, 2, 7, 9)], lowest_height=0)
+    writer.merge_address_flows([(1, 2, 6.0, 3, 12, 15)], lowest_height=10)
+
+    assert writer.edges == {
+        (1, 2): {'value': 16.0, 'tx_count': 4, 'first_height': 5, 'last_height': 15},
+        (2, 3): {'value': 4.0, 'tx_count': 2, 'first_height': 7, 'last_height': 9},
+    }
+
+    # merging the same range again doesn't count it twice
+    assert writer.merge_address_flows([(1, 2, 6.0, 3, 12, 15)], lowest_height=10) == 0
+    assert writer.edges[(1, 2)]['value'] == 16.0
+
+
+class RecordingConnection:
+    """Stands in for a connection to the gremlin server. Records the bytecode of each
+    traversal sent, and answers each with the next of the given results.
+    """
+
+    def __init__(self, results: list):
+        self.results = list(results)
+        self.bytecodes = []
+
+    def submit(self, bytecode):
+        self.bytecodes.append(bytecode)
+        return RemoteTraversal(iter([Traverser(result) for result in self.results.pop(0)]))
+
+    def submit_async(self, bytecode):
+        future = Future()
+        future.set_result(self.submit(bytecode))
+        return future
+
+
+def recording_writer(*results) -> tuple[GremlinBatchWriter, RecordingConnection]:
+    connection = RecordingConnection(results)
+    return GremlinBatchWriter(traversal().withRemote(connection), VertexIdCache(initial_size=16)), connection
+
+
+def steps(bytecode) -> list[str]:
+    return [instruction[0] for instruction in bytecode.step_instructions]
+
+
+def property_keys(bytecode) -> list[str]:
+    return [instruction[1] for instruction in bytecode.step_instructions if instruction[0] == 'property']
+
+
+def test_output_vertices_written_with_one_traversal_per_property_set():
+    rows = [
+        {'output_id': 1, 'address_id': 7, 'value': 5, 'block_height': 3},
+        {'output_id': 2, 'value': 6, 'block_height': 3},
+        {'output_id': 3, 'address_id': 8, 'value': 7, 'block_height': 3},
+    ]
+    # the server answers with the new vertex IDs of each group, in the order it was sent
+    writer, connection = recording_writer([101, 103], [102])
+
+    assert writer.add_output_vertices_async(rows).result() == [101, 102, 103]
+    assert writer.vertex_ids.get_many([1, 2, 3]).tolist() == [101, 102, 103]
+
+    with_address, without_address = connection.bytecodes
+    assert with_address.step_instructions[0] == ['inject', [rows[0], rows[2]]]
+    assert without_address.step_instructions[0] == ['inject', [rows[1]]]
+    assert steps(with_address) == ['inject', 'unfold', 'as', 'addV'] + ['property'] * 4 + ['id']
+    assert property_keys(with_address) == ['output_id', 'address_id', 'value', 'block_height']
+    assert property_keys(without_address) == ['output_id', 'value', 'block_height']
+
+    # the traversal is the same size however many rows it writes
+    writer, connection = recording_writer(list(range(1_000)))
+    writer.add_output_vertices_async([rows[1] | {'output_id': i} for i in range(1_000)]).result()
+    assert steps(connection.bytecodes[0]) == steps(without_address)
+
+
+def test_upserted_vertices_are_looked_up_in_one_query():
+    writer, connection = recording_writer([{'output_id': 1, 'vertex_id': 101}], [102])
+
+    writer.upsert_output_vertices_async([{'output_id': 1}, {'output_id': 2}]).result()
+
+    lookup, add = connection.bytecodes
+    assert steps(lookup) == ['V', 'has', 'project', 'by', 'by']
+    assert lookup.step_instructions[1] == ['has', 'output', 'output_id', P.within([1, 2])]
+    assert add.step_instructions[0] == ['inject', [{'output_id': 2}]]
+    assert 'coalesce' not in steps(lookup) + steps(add)
+    assert writer.vertex_ids.get_many([1, 2]).tolist() == [101, 102]
+
+
+def test_sent_edges_reference_vertices_by_id():
+    writer, connection = recording_writer([{'from': 101, 'to': 102, 'value': 5.0}], [1])
+    writer.vertex_ids.set_many([1, 2, 3], [101, 102, 103])
+
+    # the edge into 2 exists, so only the edge into 3 is written
+    assert writer.upsert_sent_edges_async([(1, 2, 5), (1, 3, 2)]).result() == 1
+
+    lookup, add = connection.bytecodes
+    assert steps(lookup) == ['V', 'inE', 'project', 'by', 'by', 'by']
+    assert lookup.step_instructions[0] == ['V', 102, 103]
+    assert add.step_instructions[0] == ['inject', [{'from': Vertex(101), 'to': Vertex(103), 'value': 2.0}]]
+    assert steps(add) == ['inject', 'unfold', 'as', 'addE', 'from', 'to', 'property', 'count']
+    assert property_keys(add) == ['value']
+
+
+def test_tx_vertices_written_with_their_edges():
+    writer, connection = recording_writer([1])
+    writer.vertex_ids.set_many([1, 2], [101, 102])
+
+    writer.add_tx_vertices_async([{'tx_id': 9, 'first_output_id': 2, 'input_value': 5,
+                                   'spent': [(1, 5)], 'created': [(2, 5)]}]).result()
+
+    (bytecode,) = connection.bytecodes
+    assert bytecode.step_instructions[0] == ['inject', [{
+        'tx_id': 9,
+        'input_value': 5.0,
+        'spent': [{'from': Vertex(101), 'value': 5.0}],
+        'created': [{'to': Vertex(102), 'value': 5.0}]
+    }]]
+    assert steps(bytecode) == ['inject', 'unfold', 'as', 'addV', 'property', 'property', 'as',
+                               'sideEffect', 'sideEffect', 'count']
+    assert property_keys(bytecode) == ['tx_id', 'input_value']
@@ -0,0 +1,44 @@
+import pytest
+
+from models.encoding import (
+    encode_address,
+    decode_address,
+    encode_tx_hash,
+    decode_tx_hash,
+    COMPACT_ADDRESS_LENGTH,
+    FALLBACK_ADDRESS_MARKER
+)
+
+
+@pytest.mark.parametrize("address", [
+    "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa",  # genesis P2PKH
+    "12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S",
+    "3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy",  # P2SH
+])
+def test_standard_addresses_are_compact(address):
+    encoded = encode_address(address)
+    assert len(encoded) == COMPACT_ADDRESS_LENGTH
+    assert decode_address(encoded) == address
+
+
+@pytest.mark.parametrize("address", [
+    "bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq",  # bech32
+    "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb",  # bad checksum
+    "not an address",
+])
+def test_non_standard_addresses_use_fallback(address):
+    encoded = encode_address(address)
+    assert encoded[0] == FALLBACK_ADDRESS_MARKER
+    assert decode_address(encoded) == address
+
+
+def test_tx_hash_round_trip():
+    tx_hash = "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b"
+    encoded = encode_tx_hash(tx_hash)
+    assert len(encoded) == 32
+    assert decode_tx_hash(encoded) == tx_hash
+
+
+def test_invalid_tx_hash():
+    with pytest.raises(ValueError):
+        encode_tx_hash("abcd")
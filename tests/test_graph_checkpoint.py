@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from models.graph_data import GraphPopulationCheckpoint
+
+# Constants
+TEST_DATABASE_URL = "sqlite:///:memory:"
+
+VERTICES = GraphPopulationCheckpoint.VERTICES
+EDGES = GraphPopulationCheckpoint.EDGES
+
+
+@pytest.fixture
+def session():
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+
+
+def test_save_only_advances(session):
+    assert GraphPopulationCheckpoint.get(session, VERTICES) is None
+
+    GraphPopulationCheckpoint.save(session, VERTICES, 5, 100)
+    GraphPopulationCheckpoint.save(session, VERTICES, 3, 50)
+    session.commit()
+
+    checkpoint = GraphPopulationCheckpoint.get(session, VERTICES)
+    assert (checkpoint.block_height, checkpoint.output_id) == (5, 100)
+    assert GraphPopulationCheckpoint.get(session, EDGES) is None
+
+
+def test_start_records_pending_outputs(session):
+    GraphPopulationCheckpoint.start(session, EDGES, 200)
+    session.commit()
+
+    checkpoint = GraphPopulationCheckpoint.get(session, EDGES)
+    assert (checkpoint.block_height, checkpoint.output_id, checkpoint.pending_output_id) == (-1, -1, 200)
+
+    GraphPopulationCheckpoint.save(session, EDGES, 4, 80)
+    session.commit()
+    assert (checkpoint.output_id, checkpoint.pending_output_id) == (80, 200)
+
+
+def test_rewind_and_clear(session):
+    GraphPopulationCheckpoint.start(session, VERTICES, 300)
+    GraphPopulationCheckpoint.save(session, VERTICES, 9, 300)
+    GraphPopulationCheckpoint.save(session, EDGES, 2, 20)
+    session.commit()
+
+    GraphPopulationCheckpoint.rewind(session, 4, 80)
+    session.commit()
+    session.expire_all()
+
+    vertices = GraphPopulationCheckpoint.get(session, VERTICES)
+    assert (vertices.block_height, vertices.output_id, vertices.pending_output_id) == (4, 80, 80)
+    # edges weren't populated past the rewound output
+    edges = GraphPopulationCheckpoint.get(session, EDGES)
+    assert (edges.block_height, edges.output_id) == (2, 20)
+
+    GraphPopulationCheckpoint.rewind(session, -1, -1)
+    session.commit()
+    assert GraphPopulationCheckpoint.get(session, VERTICES) is None
+    assert GraphPopulationCheckpoint.get(session, EDGES) is None
@@ -0,0 +1,61 @@
+import csv
+import json
+
+import pytest
+
+from utils import MockDataProvider
+from blockchain_data_provider import PersistentBlockchainAPIData
+from graph.bulk_export import GraphBulkExporter, ShardedCSVWriter, VERTEX_HEADER, output_vertex_id
+
+
+@pytest.fixture(scope="module")
+def blockchain_api():
+    return PersistentBlockchainAPIData(data_provider=MockDataProvider())
+
+
+@pytest.fixture
+def session(session_factory):
+    with session_factory() as session:
+        yield session
+
+
+def read_rows(path):
+    with open(path, newline='') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_export(session, blockchain_api, tmp_path):
+    exporter = GraphBulkExporter(blockchain_api)
+    manifest = exporter.export(session, tmp_path, shard_size=3)
+
+    assert json.loads((tmp_path / 'manifest.json').read_text()) == manifest
+
+    # 6 outputs split into shards of 3 output IDs
+    assert [(shard['file'], shard['rows']) for shard in manifest['vertices']] == [
+        ('vertices-00000.csv', 3),
+        ('vertices-00001.csv', 3)
+    ]
+    vertices = [row for shard in manifest['vertices'] for row in read_rows(tmp_path / shard['file'])]
+    assert [int(row['output_id']) for row in vertices] == [0, 1, 2, 3, 4, 5]
+    assert all(int(row['vertex_id']) == output_vertex_id(int(row['output_id'])) for row in vertices)
+
+    # the block 170 spend sends 10 and 40 BTC from the block 9 coinbase output
+    edges = [row for shard in manifest['edges'] for row in read_rows(tmp_path / shard['file'])]
+    assert [(int(row['out_vertex_id']), int(row['in_vertex_id']), float(row['value'])) for row in edges] == [
+        (output_vertex_id(2), output_vertex_id(4), 1_000_000_000),
+        (output_vertex_id(2), output_vertex_id(5), 4_000_000_000),
+    ]
+
+
+def test_shards_are_not_reopened(tmp_path):
+    writer = ShardedCSVWriter(tmp_path, 'vertices', VERTEX_HEADER, shard_size=3)
+    writer.write(1, [output_vertex_id(1), 1, '', 100, 0])
+    writer.write(4, [output_vertex_id(4), 4, '', 100, 1])
+
+    # going back to the first shard would truncate it
+    with pytest.raises(ValueError):
+        writer.write(2, [output_vertex_id(2), 2, '', 100, 0])
+    writer.close()
+
+    assert [int(row['output_id']) for row in read_rows(tmp_path / 'vertices-00000.csv')] == [1]
+    assert [shard['shard'] for shard in writer.shards] == [0, 1]
@@ -0,0 +1,60 @@
+import networkx as nx
+import pytest
+
+from graph.haircut import haircut_matrix
+from graph.projection import collapse_tx_vertices
+from graph_analyze import GraphAnalyzer
+
+
+# output ID -> value. Tx 1 spends outputs 1 and 2 into outputs 3 and 4, and tx 2 spends 3 into 5 and 6.
+OUTPUT_VALUES = {1: 30, 2: 10, 3: 25, 4: 15, 5: 20, 6: 5}
+TXS = {1: ([1, 2], [3, 4]), 2: ([3], [5, 6])}
+
+
+def output_projection() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    for output_id, value in OUTPUT_VALUES.items():
+        graph.add_node(output_id, output_id=output_id, value=value, label='output')
+    for inputs, outputs in TXS.values():
+        edge_values = haircut_matrix([OUTPUT_VALUES[i] for i in inputs], [OUTPUT_VALUES[o] for o in outputs])
+        for i, prev_out in enumerate(inputs):
+            for o, output in enumerate(outputs):
+                graph.add_edge(prev_out, output, label='sent', value=edge_values[i, o])
+    return graph
+
+
+def tx_projection() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    for output_id, value in OUTPUT_VALUES.items():
+        graph.add_node(output_id, output_id=output_id, value=value, label='output')
+    for tx_id, (inputs, outputs) in TXS.items():
+        tx_node = f"tx{tx_id}"
+        graph.add_node(tx_node, tx_id=tx_id, input_value=sum(OUTPUT_VALUES[i] for i in inputs), label='tx')
+        for prev_out in inputs:
+            graph.add_edge(prev_out, tx_node, label='spent', value=OUTPUT_VALUES[prev_out])
+        for output in outputs:
+            graph.add_edge(tx_node, output, label='created', value=OUTPUT_VALUES[output])
+    return graph
+
+
+def test_collapse_tx_vertices():
+    collapsed = collapse_tx_vertices(tx_projection())
+    expected = output_projection()
+
+    assert set(collapsed.edges) == set(expected.edges)
+    for u, v in expected.edges:
+        assert collapsed.edges[u, v]['value'] == pytest.approx(expected.edges[u, v]['value'])
+
+    # graphs without tx vertices are left as they are
+    assert collapse_tx_vertices(expected) is expected
+
+
+@pytest.mark.parametrize('direction, vertex_id', [('incoming', 5), ('outgoing', 1)])
+def test_coin_traces_match_across_projections(direction, vertex_id):
+    analyzer = GraphAnalyzer(None, None)
+    expected = analyzer.get_coin_traces(vertex_id, 'output', direction, output_projection())
+    traces = analyzer.get_coin_traces(vertex_id, 'output', direction, tx_projection())
+
+    assert traces.keys() == expected.keys()
+    for output_id, amount in expected.items():
+        assert traces[output_id] == pytest.approx(amount)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from graph.haircut import haircut, haircut_matrix, haircut_edges, segment_sums, calculate_proportions
+
+
+def test_haircut_matrix_matches_haircut():
+    input_values = [5, 15, 30]
+    output_values = [20, 25, 4]
+    matrix = haircut_matrix(input_values, output_values)
+
+    assert matrix.shape == (3, 3)
+    for i, input_value in enumerate(input_values):
+        for o, output_value in enumerate(output_values):
+            assert matrix[i, o] == haircut(input_value, sum(input_values), output_value)
+
+    assert not haircut_matrix([0, 0], [1]).any()
+
+
+def test_segment_sums():
+    values = np.array([1.0, 2.0, 3.0, 4.0])
+    # the second and last segments are empty
+    offsets = np.array([0, 2, 2, 4, 4])
+    assert segment_sums(values, offsets).tolist() == [3.0, 0.0, 7.0, 0.0]
+
+
+def test_haircut_edges_for_many_txs():
+    # tx 0: a coinbase with no inputs, tx 1: 2 inputs and 3 outputs,
+    # tx 2: inputs worth nothing, tx 3: 1 input and 2 outputs
+    txs = [
+        ([], [50]),
+        ([10, 30], [5, 15, 20]),
+        ([0], [0]),
+        ([7], [3, 4]),
+    ]
+    input_values = [value for inputs, _ in txs for value in inputs]
+    output_values = [value for _, outputs in txs for value in outputs]
+    input_offsets = np.cumsum([0] + [len(inputs) for inputs, _ in txs])
+    output_offsets = np.cumsum([0] + [len(outputs) for _, outputs in txs])
+
+    input_index, output_index, values = haircut_edges(input_values, input_offsets, output_values, output_offsets)
+
+    # the same edges, in the same order, as looping over each transaction's outputs, then inputs
+    expected = []
+    for k, (inputs, outputs) in enumerate(txs):
+        if sum(inputs) == 0:
+            continue
+        for o, output_value in enumerate(outputs):
+            for i, input_value in enumerate(inputs):
+                expected.append((input_offsets[k] + i, output_offsets[k] + o,
+                                 haircut(input_value, sum(inputs), output_value)))
+
+    assert list(zip(input_index.tolist(), output_index.tolist(), values.tolist())) == expected
+
+
+def test_calculate_proportions():
+    # half of input 0 goes to output 1, and the rest of the value is divided by the haircut method
+    edges = calculate_proportions([10, 30], [25, 15], [(0, 1, 0.5)])
+    assert edges[0, 1] == 5.0
+    assert np.allclose(edges, [[3.7234042553191493, 5.0], [22.340425531914892, 8.936170212765957]])
+    assert np.isclose(edges.sum(), 40)
+
+    # without manual proportions, the haircut values
+    assert np.allclose(calculate_proportions([10, 30], [25, 15], []), haircut_matrix([10, 30], [25, 15]))
+
+    with pytest.raises(ValueError, match="greater than output value"):
+        calculate_proportions([10, 30], [25, 4], [(0, 0, 0.5), (0, 1, 0.5)])
@@ -0,0 +1,159 @@
+import pytest
+
+from utils import MockDataProvider
+from models.bitcoin_data import Tx, Output, BITCOIN_TO_SATOSHI
+from models.graph_data import GraphPopulationCheckpoint
+from blockchain_data_provider import PersistentBlockchainAPIData
+from graph.memory_backend import InMemoryGraphBackend
+from graph_populate import PopulateOutputProportionGraph
+from graph_analyze import GraphAnalyzer
+
+
+@pytest.fixture
+def backend():
+    # small arrays, so they have to grow
+    backend = InMemoryGraphBackend(initial_vertices=4, initial_edges=2)
+    backend.add_output_vertices_async([{'output_id': output_id, 'address_id': output_id % 2}
+                                       for output_id in range(10)])
+    return backend
+
+
+def test_upsert_and_replace_edges(backend):
+    backend.upsert_sent_edges([(0, 5, 1.0), (1, 5, 2.0)])
+    backend.upsert_sent_edges([(0, 5, 1.0), (2, 6, 3.0), (5, 7, 3.0)])
+    assert backend.sent_edge_values([5, 6]) == {(0, 5): [1.0], (1, 5): [2.0], (2, 6): [3.0]}
+
+    # only the edge from 1 is dropped, and only the edge from 2 is created
+    assert backend.replace_sent_edges([(0, 5, 1.0), (2, 5, 4.0)], [5]) == (1, 1)
+    assert backend.sent_edge_values([5]) == {(0, 5): [1.0], (2, 5): [4.0]}
+
+    prev_out_ids, output_ids, values = backend.sent_edges([2], 'outgoing')
+    assert sorted(zip(prev_out_ids.tolist(), output_ids.tolist(), values.tolist())) == [(2, 5, 4.0), (2, 6, 3.0)]
+
+    indptr, prev_out_ids, values = backend.adjacency('incoming')
+    assert prev_out_ids[indptr[5]:indptr[6]].tolist() == [0, 2]
+
+    with pytest.raises(ValueError):
+        backend.add_sent_edges([(0, 50, 1.0)])
+
+
+def test_drop_vertices(backend):
+    backend.add_sent_edges([(0, 5, 1.0), (2, 6, 3.0), (5, 7, 3.0)])
+    backend.drop_vertices('output', 'output_id', [5])
+
+    assert backend.existing_output_vertices([4, 5, 6]) == {4: 4, 6: 6}
+    assert backend.sent_edge_values([5, 7]) == {}
+    assert backend.sent_edges([0], 'outgoing')[1].tolist() == []
+    assert backend.address_output_ids(1) == [1, 3, 7, 9]
+
+    while backend.has_vertices():
+        backend.drop_any_vertices(3)
+    assert backend.edge_count == 0
+
+
+def test_repopulate_after_dropping_everything():
+    backend = InMemoryGraphBackend(initial_vertices=4, initial_edges=2)
+    backend.add_output_vertices_async([{'output_id': 0}, {'output_id': 1}])
+    backend.add_sent_edges([(0, 1, 1.0)])
+    assert backend.sent_edges([0], 'outgoing')[1].tolist() == [1]
+    backend.drop_any_vertices(10)
+
+    # as many edges as before, so the outgoing index must not be taken as up to date
+    backend.add_output_vertices_async([{'output_id': 2}, {'output_id': 3}])
+    backend.add_sent_edges([(2, 3, 1.0)])
+    assert backend.sent_edges([0], 'outgoing')[1].tolist() == []
+    assert backend.sent_edges([2], 'outgoing')[1].tolist() == [3]
+
+
+def test_populate_and_trace_in_memory(session_factory):
+    data_provider = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+    backend = InMemoryGraphBackend()
+    populator = PopulateOutputProportionGraph(data_provider, backend=backend)
+
+    with session_factory() as session:
+        populator.populate_batch(session)
+        # block 170 spends the coinbase of block 9, sending 10 BTC to one output and 40 BTC back
+        tx_170 = session.query(Tx).filter(Tx.block_height == 170, Tx.index_in_block == 1).one()
+        coinbase_9 = session.query(Tx).filter(Tx.block_height == 9).one()
+        sent_output_id = tx_170.outputs[0].id
+        coinbase_output_id = coinbase_9.outputs[0].id
+
+    assert backend.sent_edge_values([sent_output_id]) == {
+        (coinbase_output_id, sent_output_id): [10 * BITCOIN_TO_SATOSHI]
+    }
+
+    analyzer = GraphAnalyzer(None, session_factory, backend=backend)
+    graph = analyzer.get_trace_graph(sent_output_id, 'output', 'incoming', include_data=True)
+    assert set(graph.nodes) == {sent_output_id, coinbase_output_id}
+
+    traces = analyzer.get_coin_traces(sent_output_id, 'output', 'incoming', graph)
+    assert traces == {coinbase_output_id: 10 * BITCOIN_TO_SATOSHI}
+
+
+class CheckpointedBackend(InMemoryGraphBackend):
+    """Stands in for a persistent graph, which population checkpoints describe."""
+
+    persistent = True
+
+
+def populated_elements(session, backend):
+    output_ids = [output_id for output_id, in session.query(Output.id)]
+    return backend.existing_output_vertices(output_ids), backend.sent_edge_values(output_ids)
+
+
+def test_insert_only_populates_fresh_graph_like_upserts(session_factory):
+    data_provider = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+    upserted, inserted = InMemoryGraphBackend(), InMemoryGraphBackend()
+
+    with session_factory() as session:
+        PopulateOutputProportionGraph(data_provider, backend=upserted).populate_batch(session)
+        PopulateOutputProportionGraph(data_provider, backend=inserted).populate_batch(session, insert_only=True)
+        expected = populated_elements(session, upserted)
+        assert expected[1]
+        assert populated_elements(session, inserted) == expected
+
+
+def test_insert_only_upserts_partially_populated_block(session_factory):
+    data_provider = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+    backend = InMemoryGraphBackend()
+    populator = PopulateOutputProportionGraph(data_provider, backend=backend)
+
+    with session_factory() as session:
+        populator.populate_batch(session)
+        expected = populated_elements(session, backend)
+
+        # block 170 is the lowest one, so its vertices and edges are checked rather than inserted twice
+        populator.populate_batch(session, start_height=170, insert_only=True)
+        assert populated_elements(session, backend) == expected
+
+        # from a lower block, block 170 is above the boundary, so finding it populated fails the run
+        with pytest.raises(ValueError):
+            populator.populate_batch(session, start_height=9, insert_only=True)
+
+
+def test_insert_only_upserts_pending_outputs_of_interrupted_run(session_factory):
+    data_provider = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+    backend = CheckpointedBackend()
+    populator = PopulateOutputProportionGraph(data_provider, backend=backend)
+
+    try:
+        with session_factory() as session:
+            populator.populate_batch(session)
+            expected = populated_elements(session, backend)
+
+            # a run which wrote blocks 9 and 170, but was interrupted before moving the checkpoints past block 1
+            highest_output_id = populator.get_highest_output_id(session, 170)
+            populator.rewind_checkpoints(session, populator.get_highest_output_id(session, 1))
+            for element_type in (GraphPopulationCheckpoint.VERTICES, GraphPopulationCheckpoint.EDGES):
+                populator.start_checkpoint(session, element_type, highest_output_id)
+
+        # resuming from the checkpoints, the pending outputs are checked rather than inserted twice
+        with session_factory() as session:
+            populator.populate_batch(session, insert_only=True)
+            assert populated_elements(session, backend) == expected
+            checkpoint = populator.get_checkpoint(session, GraphPopulationCheckpoint.EDGES)
+            assert checkpoint.output_id == highest_output_id
+    finally:
+        with session_factory() as session:
+            GraphPopulationCheckpoint.clear(session)
+            session.commit()
@@ -0,0 +1,45 @@
+from utils import MockDataProvider
+from models.bitcoin_data import Tx, Output, BITCOIN_TO_SATOSHI
+from blockchain_data_provider import PersistentBlockchainAPIData
+from graph.memory_backend import InMemoryGraphBackend
+from graph.output_metadata import OutputMetadataService
+from graph_populate import PopulateOutputProportionGraph
+from graph_analyze import GraphAnalyzer
+
+
+def test_records_match_outputs(session_factory):
+    service = OutputMetadataService(session_factory, max_entries=3, chunk_size=2)
+    with session_factory() as session:
+        outputs = session.query(Output).order_by(Output.id).all()
+        expected = {
+            output.id: (output.transaction.block_height, output.value, output.address_id, output.pretty_label())
+            for output in outputs
+        }
+
+    records = service.get_many(list(expected) + [10_000])
+    assert {output_id: (record.block_height, record.value, record.address_id, record.pretty_label())
+            for output_id, record in records.items()} == expected
+
+    # only the last three are remembered
+    service.get_many(list(expected)[-3:])
+    assert (service.hits, service.misses) == (3, len(expected) + 1)
+
+
+def test_tracing_reads_values_from_vertices(session_factory):
+    backend = InMemoryGraphBackend()
+    populator = PopulateOutputProportionGraph(PersistentBlockchainAPIData(data_provider=MockDataProvider()),
+                                              backend=backend)
+    with session_factory() as session:
+        populator.populate_batch(session)
+        tx_170 = session.query(Tx).filter(Tx.block_height == 170, Tx.index_in_block == 1).one()
+        sent_output_id = tx_170.outputs[0].id
+        coinbase_output_id = session.query(Tx).filter(Tx.block_height == 9).one().outputs[0].id
+
+    assert backend.output_properties([sent_output_id])[sent_output_id]['value'] == 10 * BITCOIN_TO_SATOSHI
+    assert backend.output_properties([sent_output_id])[sent_output_id]['block_height'] == 170
+
+    analyzer = GraphAnalyzer(None, session_factory, backend=backend)
+    traces = analyzer.trace_coins(sent_output_id, 'output', 'incoming')
+    assert traces == {coinbase_output_id: 10 * BITCOIN_TO_SATOSHI}
+    # nothing had to be read from the database
+    assert analyzer.output_metadata.misses == 0
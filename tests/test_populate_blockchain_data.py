@@ -1,11 +1,11 @@
 import pytest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 from utils import MockDataProvider
 from models.base import Base
-from models.bitcoin_data import Block, Tx
+from models.bitcoin_data import Block, Tx, Output, Address
 from blockchain_data_provider import PersistentBlockchainAPIData
 
 # Constants
@@ -37,3 +37,173 @@ def test_get_block(session, blockchain_api):
     block = blockchain_api.get_block(session, test_height)
     assert block is not None
     assert block.height == test_height
+
+
+def test_binary_hash_and_address(session, blockchain_api):
+    # hashes and addresses are stored as bytes but read back as strings
+    block = blockchain_api.get_block(session, 0)
+    tx = block.transactions[0]
+    assert tx.hash == "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b"
+    assert tx.outputs[0].address.addr == "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+
+    assert blockchain_api.get_tx(session, tx_hash=tx.hash).id == tx.id
+    assert blockchain_api.get_address(session, address="1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa").id == 0
+
+
+def test_delete_above_height(session, blockchain_api):
+    blockchain_api.populate_block(session, 1)
+    assert session.query(Block).count() == 2
+
+    blockchain_api.delete_above_height(session, 0)
+
+    assert [height for height, in session.query(Block.height)] == [0]
+    assert session.query(Tx).count() == 1
+    assert session.query(Output).count() == 1
+    assert [addr for addr, in session.query(Address.addr)] == ["1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"]
+
+
+def test_batch_lookups(session, blockchain_api):
+    blockchain_api.populate_block(session, 1)
+
+    txs = blockchain_api.get_txs(session, tx_ids=[1, 0, 1, 99])
+    assert list(txs.keys()) == [1, 0]
+    assert txs[0].outputs[0].address.addr == "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+
+    tx_hash = "0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098"
+    assert blockchain_api.get_txs(session, tx_hashes=[tx_hash])[tx_hash].id == 1
+
+    outputs = blockchain_api.get_outputs(session, [0, 1])
+    assert {output_id: output.value for output_id, output in outputs.items()} == {0: 5000000000, 1: 5000000000}
+
+    addresses = blockchain_api.get_addresses(session, addresses=["12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX"])
+    assert addresses["12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX"].id == 1
+    assert set(blockchain_api.get_addresses(session, address_ids=[0, 1]).keys()) == {0, 1}
+
+
+def test_batch_lookup_cache(session, blockchain_api):
+    queries = []
+
+    def count_queries(orm_execute_state):
+        queries.append(orm_execute_state.statement)
+
+    event.listen(session, "do_orm_execute", count_queries)
+    try:
+        first = blockchain_api.get_outputs(session, [0, 1], use_cache=True)
+        query_count = len(queries)
+        second = blockchain_api.get_outputs(session, [1, 0], use_cache=True)
+
+        # cached objects are returned without querying again
+        assert len(queries) == query_count
+        assert second[0] is first[0] and second[1] is first[1]
+
+        blockchain_api.clear_lookup_cache(session)
+        blockchain_api.get_outputs(session, [0], use_cache=True)
+        assert len(queries) > query_count
+    finally:
+        event.remove(session, "do_orm_execute", count_queries)
+
+
+def test_block_loader(session, blockchain_api):
+    queries = []
+
+    def count_queries(orm_execute_state):
+        queries.append(orm_execute_state.statement)
+
+    block = blockchain_api.get_block(session, 1)
+    session.expunge_all()
+
+    event.listen(session, "do_orm_execute", count_queries)
+    try:
+        block = blockchain_api.get_block(session, 1)
+        query_count = len(queries)
+
+        # all relationships are already loaded
+        tx = block.transactions[0]
+        assert tx.block is block
+        assert tx.inputs == []
+        assert [output.address.addr for output in tx.outputs] == ["12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX"]
+        assert tx.outputs[0].transaction is tx
+        assert len(queries) == query_count
+    finally:
+        event.remove(session, "do_orm_execute", count_queries)
+
+    txs = list(blockchain_api.get_txs_for_blocks(session, min_height=0, max_height=1, buffer=1))
+    assert [tx.id for tx in txs] == [0, 1]
+
+
+def test_txs_for_blocks_with_unordered_ids():
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        api = PersistentBlockchainAPIData(data_provider=MockDataProvider())
+        for height in (0, 1, 9):
+            api.populate_block(session, height)
+
+        # the transactions of blocks 1 and 9 swap places, so block 9's lies between blocks 0 and 1's
+        session.query(Tx).filter(Tx.id == 1).update({'block_height': 9})
+        session.query(Tx).filter(Tx.id == 2).update({'block_height': 1})
+        session.commit()
+
+        txs = list(api.get_txs_for_blocks(session, min_height=0, max_height=1, buffer=1))
+        assert [(tx.id, tx.block_height) for tx in txs] == [(0, 0), (2, 1)]
+        assert [output.transaction for output in txs[1].outputs] == [txs[1]]
+
+
+def test_block_loader_prev_outs(session, blockchain_api):
+    blockchain_api.populate_block(session, 9)
+    blockchain_api.populate_block(session, 170)
+
+    block = blockchain_api.get_block(session, 170)
+    spend = block.transactions[1]
+    assert spend.hash == "f4184fc596403b9d638783cf57adfe4c75c605f6356fbc91338530e9831e9e16"
+    assert [input.prev_out.address.addr for input in spend.inputs] == ["12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S"]
+    assert spend.total_input_value() == 5000000000
+    assert [output.value for output in spend.outputs] == [1000000000, 4000000000]
+
+
+def test_repopulate_addresses(session, blockchain_api):
+    session.query(Output).update({'address_id': None})
+    session.query(Address).delete()
+    session.commit()
+
+    blockchain_api.repopulate_addresses(session, workers=1)
+
+    addresses = session.query(Address.id, Address.addr).order_by(Address.id).all()
+    assert addresses == [
+        (0, "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"),
+        (1, "12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX"),
+        (2, "12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S"),
+        (3, "1PSSGeFHDnKNxiEyFrD1wcEaHr9hrQDDWc"),
+        (4, "1Q2TWHE3GMdB6BZKafqwxXtWAWgFt5Jvm3"),
+    ]
+    session.expire_all()
+    assert all(output.address_id is not None and output.address.addr == output.address_addr
+               for output in session.query(Output))
+
+
+def test_repopulate_addresses_with_other_ids(session, blockchain_api):
+    # addresses whose IDs weren't assigned in order of first appearance
+    first, second = session.query(Address).filter(Address.id.in_([0, 1])).order_by(Address.id).all()
+    first.addr, second.addr = "swapped", first.addr
+    session.commit()
+    address_ids = {output.id: output.address_id for output in session.query(Output)}
+
+    with pytest.raises(ValueError, match="rebuilt with"):
+        blockchain_api.repopulate_addresses(session)
+
+    assert {output.id: output.address_id for output in session.query(Output)} == address_ids
+    first.addr, second.addr = second.addr, "12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX"
+    session.commit()
+
+
+def test_address_flows(session, blockchain_api):
+    addresses = {addr: id_ for id_, addr in session.query(Address.id, Address.addr)}
+
+    # block 170 sends 10 BTC from 12cbQ... to 1Q2TW..., and the rest back to 12cbQ...
+    flows = blockchain_api.get_address_flows(session, 0, 170)
+    assert [tuple(flow) for flow in flows] == [(
+        addresses["12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S"],
+        addresses["1Q2TWHE3GMdB6BZKafqwxXtWAWgFt5Jvm3"],
+        1000000000.0, 1, 170, 170
+    )]
+    assert blockchain_api.get_address_flows(session, 0, 169) == []
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+from graph.haircut import haircut_edges_for_txs
+from graph.pruning import PruningPolicy
+
+
+def make_output(output_id, value, valid=True):
+    return SimpleNamespace(id=output_id, value=value, valid=valid)
+
+
+def make_tx(prev_outs, outputs):
+    return SimpleNamespace(
+        inputs=[SimpleNamespace(prev_out=prev_out) for prev_out in prev_outs],
+        outputs=outputs,
+        is_coinbase=lambda: not prev_outs
+    )
+
+
+@pytest.fixture
+def txs():
+    return [
+        make_tx([make_output(1, 1_000), make_output(2, 9_000), make_output(3, 10)],
+                [make_output(10, 6_000), make_output(11, 4_000), make_output(12, 0, valid=False),
+                 make_output(13, 10)]),
+        make_tx([make_output(4, 500)], [make_output(14, 500)]),
+    ]
+
+
+def edge_dict(prev_out_ids, output_ids, values):
+    return dict(zip(zip(prev_out_ids.tolist(), output_ids.tolist()), values.tolist()))
+
+
+def test_no_pruning_keeps_every_edge(txs):
+    *edges, pruned_values = PruningPolicy().haircut_edges(txs)
+    assert edge_dict(*edges) == edge_dict(*haircut_edges_for_txs(txs))
+    assert pruned_values == {}
+
+
+def test_pruned_value_accounts_for_pruned_edges(txs):
+    policy = PruningPolicy(min_edge_value=10, skip_unspendable=True, min_output_value=100, top_k_inputs=1)
+    *edges, pruned_values = policy.haircut_edges(txs)
+    kept = edge_dict(*edges)
+
+    # only the largest input of each output is kept, and the dust input and outputs are left out
+    assert set(kept) == {(2, 10), (2, 11), (4, 14)}
+    assert set(pruned_values) == {10, 11}
+
+    # every kept output still receives its whole value, counting the pruned edges
+    all_edges = edge_dict(*haircut_edges_for_txs(txs))
+    for output_id in (10, 11, 14):
+        received = sum(value for (_, o), value in kept.items() if o == output_id) + pruned_values.get(output_id, 0)
+        assert received == pytest.approx(sum(value for (_, o), value in all_edges.items() if o == output_id))
+
+
+def test_min_input_fraction(txs):
+    *edges, _ = PruningPolicy(min_input_fraction=0.5).haircut_edges(txs)
+    # each input of the first transaction sends 60% of its value to output 10
+    assert set(edge_dict(*edges)) == {(1, 10), (2, 10), (3, 10), (4, 14)}
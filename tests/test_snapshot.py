@@ -0,0 +1,61 @@
+import numpy as np
+
+from utils import MockDataProvider
+from models.bitcoin_data import Tx, BITCOIN_TO_SATOSHI
+from blockchain_data_provider import PersistentBlockchainAPIData
+from graph.snapshot import GraphSnapshot, GraphSnapshotBuilder, NO_ADDRESS
+from graph.tracing import BatchTracer
+
+
+def snapshot_arrays(snapshot: GraphSnapshot):
+    return [np.asarray(array).tolist() for array in (snapshot.address_ids, snapshot.heights, snapshot.values,
+                                                     *snapshot.csc(), *snapshot.csr())]
+
+
+def test_build_and_append(session_factory, tmp_path):
+    builder = GraphSnapshotBuilder(PersistentBlockchainAPIData(data_provider=MockDataProvider()))
+
+    with session_factory() as session:
+        # appending block by block, with small buffers, gives the same snapshot as building at once
+        builder.build(session, tmp_path / 'appended', max_height=9, buffer=1)
+        builder.build(session, tmp_path / 'appended', max_height=9)
+        manifest = builder.build(session, tmp_path / 'appended', buffer=1)
+        builder.build(session, tmp_path / 'whole')
+
+        tx_170 = session.query(Tx).filter(Tx.block_height == 170, Tx.index_in_block == 1).one()
+        coinbase_9 = session.query(Tx).filter(Tx.block_height == 9).one()
+        sent_output_id = tx_170.outputs[0].id
+        coinbase_output_id = coinbase_9.outputs[0].id
+        sent_address_id = tx_170.outputs[0].address_id
+
+    assert manifest['max_height'] == 170
+    appended, whole = GraphSnapshot(tmp_path / 'appended'), GraphSnapshot(tmp_path / 'whole')
+    assert snapshot_arrays(appended) == snapshot_arrays(whole)
+
+    prev_out_ids, values = appended.in_edges(sent_output_id)
+    assert prev_out_ids.tolist() == [coinbase_output_id]
+    assert values.tolist() == [10 * BITCOIN_TO_SATOSHI]
+
+    output_ids, values = appended.out_edges(coinbase_output_id)
+    assert len(output_ids) == 2 and sent_output_id in output_ids.tolist()
+    assert values.sum() == 50 * BITCOIN_TO_SATOSHI
+
+    assert appended.heights[sent_output_id] == 170
+    assert appended.values[sent_output_id] == 10 * BITCOIN_TO_SATOSHI
+    assert appended.address_ids[sent_output_id] == (sent_address_id if sent_address_id is not None else NO_ADDRESS)
+
+    # the CSR arrays hold the same edges as the CSC arrays
+    indptr, indices, weights = appended.csc()
+    csc_edges = sorted(zip(indices.tolist(), np.repeat(np.arange(appended.vertex_count), np.diff(indptr)).tolist(),
+                           weights.tolist()))
+    indptr, indices, weights = appended.csr()
+    csr_edges = sorted(zip(np.repeat(np.arange(appended.vertex_count), np.diff(indptr)).tolist(), indices.tolist(),
+                           weights.tolist()))
+    assert csc_edges == csr_edges
+
+    # tracing the sent output back reaches the coinbase, and tracing the coinbase forward reaches both outputs
+    incoming, = BatchTracer.from_snapshot(appended, 'incoming').trace([sent_output_id])
+    assert incoming == {coinbase_output_id: 10 * BITCOIN_TO_SATOSHI}
+    outgoing, = BatchTracer.from_snapshot(appended, 'outgoing').trace([coinbase_output_id])
+    assert outgoing[sent_output_id] == 10 * BITCOIN_TO_SATOSHI
+    assert sum(outgoing.values()) == 50 * BITCOIN_TO_SATOSHI
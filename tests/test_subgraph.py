@@ -0,0 +1,71 @@
+from graph.projection import TX_PROJECTION
+from graph.subgraph import SubgraphExtractor, EDGE_LABELS
+
+
+class DictExtractor(SubgraphExtractor):
+    """Reads edges from a list instead of a graph, recording how many vertices each request asks about."""
+
+    def __init__(self, edges: list[tuple], projection: str = 'output'):
+        super().__init__(g=None, projection=projection, batch_size=2)
+        self.edges = edges
+        self.requests = []
+
+    def start_vertices(self, vertex_id, vertex_type):
+        return [vertex_id]
+
+    def frontier_edges(self, vertex_ids, direction):
+        self.requests.append(len(vertex_ids))
+        labels = EDGE_LABELS[self.projection]
+        return [
+            edge for edge in self.edges if edge[2] in labels and (
+                (direction != 'outgoing' and edge[1] in vertex_ids)
+                or (direction != 'incoming' and edge[0] in vertex_ids)
+            )
+        ]
+
+    def vertex_properties(self, vertex_ids):
+        # vertices from 100 up are tx vertices, whose inputs are worth 5
+        return {vertex_id: {'label': 'tx', 'tx_id': vertex_id, 'input_value': 5.0} if vertex_id >= 100
+                else {'label': 'output', 'output_id': vertex_id} for vertex_id in vertex_ids}
+
+
+# 1 and 2 both spend into 3 and 4, which are both spent into 5, so 5 has four paths back to 1 and 2
+SENT_EDGES = [(1, 3, 'sent', 1.0), (1, 4, 'sent', 1.0), (2, 3, 'sent', 1.0), (2, 4, 'sent', 1.0),
+              (3, 5, 'sent', 1.0), (4, 5, 'sent', 1.0)]
+
+
+def test_each_vertex_and_edge_fetched_once():
+    extractor = DictExtractor(SENT_EDGES)
+    subgraph = extractor.extract(5, 'output', 'incoming')
+
+    assert set(subgraph.vertices) == {1, 2, 3, 4, 5}
+    assert set(subgraph.edges) == {(u, v) for u, v, _, _ in SENT_EDGES}
+    assert not subgraph.truncated
+    # one level each for 5, then 3 and 4, then 1 and 2, then nothing
+    assert extractor.requests == [1, 2, 2]
+
+    depth_1 = DictExtractor(SENT_EDGES).extract(5, 'output', 'incoming', depth=1)
+    assert set(depth_1.vertices) == {3, 4, 5}
+
+    both = DictExtractor(SENT_EDGES).extract(3, 'output', 'both', depth=2)
+    assert set(both.vertices) == {1, 2, 3, 4, 5}
+
+
+def test_budgets():
+    by_vertices = DictExtractor(SENT_EDGES).extract(5, 'output', 'incoming', max_vertices=4)
+    assert len(by_vertices.vertices) == 4 and by_vertices.truncated
+    # only edges between vertices in the subgraph are kept
+    assert all(u in by_vertices.vertices and v in by_vertices.vertices for u, v in by_vertices.edges)
+
+    by_edges = DictExtractor(SENT_EDGES).extract(5, 'output', 'incoming', max_edges=3)
+    assert len(by_edges.edges) == 3 and by_edges.truncated
+
+
+def test_tx_projection_depth_counts_output_hops():
+    # tx 100 spends 1 into 2, and tx 101 spends 2 into 3
+    edges = [(1, 100, 'spent', 5.0), (100, 2, 'created', 5.0), (2, 101, 'spent', 5.0), (101, 3, 'created', 5.0)]
+    subgraph = DictExtractor(edges, TX_PROJECTION).extract(3, 'output', 'incoming', depth=1)
+    assert set(subgraph.vertices) == {2, 3, 101}
+
+    nx_graph = subgraph.to_networkx()
+    assert list(nx_graph.edges(data='value')) == [(2, 3, 5.0)]
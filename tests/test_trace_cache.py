@@ -0,0 +1,153 @@
+import networkx as nx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from models.graph_data import GraphPopulationCheckpoint
+from graph.memory_backend import InMemoryGraphBackend
+from graph.trace_cache import MISSING, TraceCache
+import graph_analyze
+from graph_analyze import GraphAnalyzer
+from graph.projection import TX_PROJECTION
+
+
+def test_lru_eviction_and_stats():
+    cache = TraceCache(max_entries=2)
+    cache.put(('a',), 10, 1)
+    cache.put(('b',), 10, 2)
+    assert cache.get(('a',), 10) == 1
+    # b is the least recently used, so it makes room for c
+    cache.put(('c',), 10, 3)
+
+    assert cache.get(('b',), 10) is MISSING
+    assert cache.get(('a',), 11) is MISSING
+    assert cache.stats() == {'entries': 2, 'hits': 1, 'disk_hits': 0, 'misses': 2, 'hit_rate': 1 / 3,
+                             'evictions': 1, 'invalidations': 0}
+
+
+def test_none_and_modified_results():
+    cache = TraceCache()
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return None
+
+    # None is a result like any other, so it isn't computed again
+    assert cache.get_or_compute(('a',), 10, compute) is None
+    assert cache.get_or_compute(('a',), 10, compute) is None
+    assert len(computed) == 1
+
+    traces = cache.get_or_compute(('b',), 10, lambda: {'x': {'amount': 1}})
+    traces['x']['amount'] = 2
+    cache.get(('b',), 10)['y'] = 3
+    assert cache.get(('b',), 10) == {'x': {'amount': 1}}
+
+
+def test_disk_tier_and_invalidation(tmp_path):
+    cache = TraceCache(max_entries=1, path=tmp_path)
+    cache.put(('a',), 10, {'x': 1})
+    cache.put(('b',), 12, {'y': 2})
+
+    # a was evicted from memory, but is still on disk, and a new cache can read it too
+    assert cache.get(('a',), 10) == {'x': 1}
+    assert TraceCache(path=tmp_path).get(('b',), 12) == {'y': 2}
+    assert cache.stats()['disk_hits'] == 1
+
+    cache.invalidate(11)
+    assert cache.get(('a',), 10) is MISSING
+    assert cache.get(('b',), 12) == {'y': 2}
+    assert cache.stats()['invalidations'] == 1
+
+
+class CountingBackend(InMemoryGraphBackend):
+    """Counts reads, and stands in for a persistent graph, which population checkpoints describe."""
+
+    persistent = True
+
+    def __init__(self):
+        super().__init__(initial_vertices=8, initial_edges=8)
+        self.reads = 0
+
+    def sent_edges(self, output_ids, direction):
+        self.reads += 1
+        return super().sent_edges(output_ids, direction)
+
+
+def test_analyzer_caches_until_population_advances():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    backend = CountingBackend()
+    backend.add_output_vertices_async([{'output_id': output_id} for output_id in range(3)])
+    backend.add_sent_edges([(0, 1, 5.0), (1, 2, 5.0)])
+    analyzer = GraphAnalyzer(None, Session, backend=backend, cache=TraceCache())
+
+    def save_checkpoint(height):
+        with Session() as session:
+            GraphPopulationCheckpoint.save(session, GraphPopulationCheckpoint.EDGES, height, height)
+            session.commit()
+
+    # nothing is cached before anything is populated
+    analyzer.get_trace_graph(2, 'output')
+    analyzer.get_trace_graph(2, 'output')
+    assert backend.reads == 6
+
+    save_checkpoint(1)
+    graph = analyzer.get_trace_graph(2, 'output')
+    # callers get copies, so changing one doesn't change what the next caller gets
+    graph.nodes[2]['value'] = 10
+    graph.remove_edge(0, 1)
+    cached = analyzer.get_trace_graph(2, 'output')
+    assert list(cached.edges(data='value')) == [(1, 2, 5.0), (0, 1, 5.0)]
+    assert 'value' not in cached.nodes[2]
+    assert backend.reads == 9
+
+    save_checkpoint(2)
+    analyzer.get_trace_graph(2, 'output')
+    assert backend.reads == 12
+    assert analyzer.cache.stats()['invalidations'] == 1
+
+    # traces of a graph which was passed in are keyed by what it holds
+    nx.set_node_attributes(cached, 5, 'value')
+    traces = analyzer.get_coin_traces(2, 'output', 'incoming', cached)
+    hits = analyzer.cache.stats()['hits']
+    assert analyzer.get_coin_traces(2, 'output', 'incoming', cached.copy()) == traces
+    assert analyzer.cache.stats()['hits'] == hits + 1
+
+    cached.edges[0, 1]['value'] = 2.0
+    analyzer.get_coin_traces(2, 'output', 'incoming', cached)
+    assert analyzer.cache.stats()['hits'] == hits + 1
+
+
+def test_coin_trace_keys(monkeypatch):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    backend = CountingBackend()
+    cache = TraceCache()
+    analyzer = GraphAnalyzer(None, Session, backend=backend, cache=cache)
+    graph = nx.DiGraph()
+    graph.add_node(0, label='output', output_id=0, value=5.0)
+    graph.add_node(1, label='output', output_id=1, value=5.0)
+    graph.add_edge(0, 1, value=5.0)
+
+    digests = []
+    monkeypatch.setattr(graph_analyze, 'graph_digest', lambda graph: digests.append(graph) or 'digest')
+
+    # graphs are only digested to look them up once there is a populated height to key them by
+    traces = analyzer.get_coin_traces(1, 'output', 'incoming', graph)
+    assert digests == [] and len(cache) == 0
+
+    with Session() as session:
+        GraphPopulationCheckpoint.save(session, GraphPopulationCheckpoint.EDGES, 1, 1)
+        session.commit()
+    assert analyzer.get_coin_traces(1, 'output', 'incoming', graph) == traces
+    assert len(digests) == 1 and len(cache) == 1
+
+    # analyzers of differently populated graphs can share a cache
+    tx_analyzer = GraphAnalyzer(None, Session, projection=TX_PROJECTION, backend=backend, cache=cache)
+    tx_analyzer.get_coin_traces(1, 'output', 'incoming', graph)
+    assert len(cache) == 2
@@ -0,0 +1,99 @@
+import random
+
+import networkx as nx
+import pytest
+
+from graph.tracing import PRUNED_SOURCE, BatchTracer, trace_sources
+
+
+def recursive_trace_sources(graph, start_fractions, pruned_values):
+    """The recursion get_coin_traces used before, which visits each node once per path to it."""
+    sources_record = {}
+
+    def traverse_sources(vertex, fraction):
+        if pruned_values.get(vertex, 0) > 0:
+            sources_record[PRUNED_SOURCE] = sources_record.get(PRUNED_SOURCE, 0) + pruned_values[vertex] * fraction
+        for child in graph.successors(vertex):
+            child_transfer = graph.edges[vertex, child]['value']
+            sources_record[child] = sources_record.get(child, 0) + child_transfer * fraction
+            transfer_total = sum(graph[child][grandchild]['value'] for grandchild in graph.successors(child)) \
+                + pruned_values.get(child, 0)
+            if transfer_total > 0:
+                traverse_sources(child, child_transfer / transfer_total * fraction)
+
+    for vertex, fraction in start_fractions.items():
+        traverse_sources(vertex, fraction)
+    return sources_record
+
+
+def random_dag(seed: int, node_count: int = 60) -> nx.DiGraph:
+    rng = random.Random(seed)
+    graph = nx.DiGraph()
+    for node in range(node_count):
+        graph.add_node(node, output_id=node, value=rng.uniform(1, 100))
+        for parent in rng.sample(range(node), min(node, rng.randint(0, 3))):
+            graph.add_edge(parent, node, value=rng.uniform(1, 100))
+    return graph
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_recursive_traces(seed):
+    graph = random_dag(seed)
+    pruned_values = {node: 10.0 for node in graph if node % 7 == 0}
+    start_fractions = {0: 0.25, 1: 0.5, 3: 0.25}
+
+    expected = recursive_trace_sources(graph, start_fractions, pruned_values)
+    traces = trace_sources(graph, start_fractions, pruned_values)
+
+    assert traces.keys() == expected.keys()
+    for key, amount in expected.items():
+        assert traces[key] == pytest.approx(amount)
+
+
+def test_deep_history():
+    # every output splits into two, which are spent together again, so there are 2^depth paths
+    depth = 2_000
+    graph = nx.DiGraph()
+    for level in range(depth):
+        graph.add_node(('join', level), output_id=('join', level))
+        for branch in range(2):
+            graph.add_node(('split', level, branch), output_id=('split', level, branch))
+            graph.add_edge(('join', level), ('split', level, branch), value=1.0)
+            graph.add_edge(('split', level, branch), ('join', level + 1), value=1.0)
+    graph.nodes[('join', depth)]['output_id'] = ('join', depth)
+
+    traces = trace_sources(graph, {('join', 0): 1.0})
+    assert traces[('join', depth)] == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize('direction', ['incoming', 'outgoing'])
+def test_batch_tracer_matches_trace_sources(direction):
+    graph = random_dag(0)
+    pruned_values = {node: 10.0 for node in graph if node % 7 == 0} if direction == 'incoming' else {}
+    nx.set_node_attributes(graph, pruned_values, 'pruned_value')
+    oriented = graph.reverse(copy=False) if direction == 'incoming' else graph
+    sources = [[50, 55], 59] if direction == 'incoming' else [[0, 1], 3]
+
+    results = BatchTracer.from_graph(graph, direction).trace(sources)
+
+    for source, result in zip(sources, results):
+        output_ids = source if isinstance(source, list) else [source]
+        total = sum(graph.nodes[output_id]['value'] for output_id in output_ids)
+        expected = trace_sources(oriented, {output_id: graph.nodes[output_id]['value'] / total
+                                            for output_id in output_ids}, pruned_values)
+        assert result.keys() == expected.keys()
+        for key, amount in expected.items():
+            assert result[key] == pytest.approx(amount)
+
+
+def test_batch_tracer_depth_and_threshold():
+    graph = nx.DiGraph()
+    for node, value in enumerate([10, 9, 1, 9]):
+        graph.add_node(node, output_id=node, value=value)
+    graph.add_edge(0, 1, value=9)
+    graph.add_edge(0, 2, value=1)
+    graph.add_edge(1, 3, value=9)
+    tracer = BatchTracer.from_graph(graph, 'outgoing')
+
+    assert tracer.trace([0], depth=1) == [{1: 9.0, 2: 1.0}]
+    assert tracer.trace([0], min_value=2) == [{1: 9.0, 3: 9.0}]
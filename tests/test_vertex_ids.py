@@ -0,0 +1,29 @@
+import numpy as np
+
+from graph.vertex_ids import VertexIdCache, MISSING_VERTEX_ID
+
+
+def test_vertex_id_cache():
+    cache = VertexIdCache(initial_size=4)
+    cache.set(2, 4104)
+    cache.set_many([10, 11], [8200, 12296])
+
+    assert cache.get(2) == 4104
+    assert cache.get(3) is None
+    assert cache.get(1_000) is None
+    assert list(cache.get_many([11, 2, 5, 50])) == [12296, 4104, MISSING_VERTEX_ID, MISSING_VERTEX_ID]
+
+    cache.clear(10)
+    assert cache.get(10) is None
+    assert cache.get(2) == 4104
+
+
+def test_memory_mapped_vertex_id_cache(tmp_path):
+    path = tmp_path / 'vertex_ids.bin'
+    cache = VertexIdCache(path, initial_size=2)
+    cache.set_many(np.arange(100), np.arange(100) * 4 + 8)
+    cache.flush()
+
+    reopened = VertexIdCache(path)
+    assert len(reopened) >= 100
+    assert reopened.get(99) == 99 * 4 + 8
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+from gremlin_python.driver.protocol import GremlinServerError
+
+from graph.writer_pool import GraphWriterPool, is_lock_conflict
+
+
+class OfflineConnection:
+    """Stands in for a traversal source. The writes in these tests never use it."""
+
+    class RemoteConnection:
+        def close(self):
+            pass
+
+    def __init__(self):
+        self.remote_connection = self.RemoteConnection()
+
+
+# the server echoes the request, which writes each output vertex's block_height
+TIMEOUT_ON_VERTICES = ("A timeout occurred during traversal evaluation of [RequestMessage{, "
+                       "args={gremlin=[[], [inject(...), unfold(), as(m), addV(output), "
+                       "property(block_height, [[select(m), select(block_height)]])]]}]")
+
+
+def server_error(message):
+    return GremlinServerError({'code': 500, 'message': message, 'attributes': {}})
+
+
+def test_lock_conflicts_are_retried():
+    assert is_lock_conflict(server_error("org.janusgraph.diskstorage.locking.PermanentLockingException: "
+                                         "Local lock contention"))
+    assert not is_lock_conflict(server_error("Evaluation exceeded the configured threshold"))
+    assert not is_lock_conflict(server_error(TIMEOUT_ON_VERTICES))
+
+    attempts = []
+
+    def write(writer, name='write'):
+        attempts.append(name)
+        if len(attempts) < 3:
+            raise server_error("Local lock contention")
+
+    with GraphWriterPool(OfflineConnection, workers=2, retry_delay=0) as pool:
+        pool.submit(write, last_output_id=9, rewrite=lambda writer: write(writer, 'rewrite'))
+        pool.join()
+        assert pool.pop_completed_output_id() == 9
+
+    # part of the batch may have been written, so it is written again with the rewrite
+    assert attempts == ['write', 'rewrite', 'rewrite']
+
+
+def test_lock_conflicts_without_rewrite_are_raised():
+    attempts = []
+
+    def write(writer):
+        attempts.append(writer)
+        raise server_error("Local lock contention")
+
+    with GraphWriterPool(OfflineConnection, workers=2, retry_delay=0) as pool:
+        pool.submit(write, last_output_id=9, context="batch 0")
+        with pytest.raises(GremlinServerError):
+            pool.join()
+
+    assert len(attempts) == 1
+
+
+def test_timeouts_echoing_block_heights_are_raised():
+    attempts = []
+
+    def write(writer):
+        attempts.append(writer)
+        raise server_error(TIMEOUT_ON_VERTICES)
+
+    with GraphWriterPool(OfflineConnection, workers=2, retry_delay=0) as pool:
+        pool.submit(write, last_output_id=9, rewrite=write)
+        with pytest.raises(GremlinServerError):
+            pool.join()
+
+    # left to the batch sizer to split, rather than retried whole
+    assert len(attempts) == 1
+
+
+def test_other_errors_are_raised():
+    def write(writer):
+        raise server_error("Evaluation exceeded the configured threshold")
+
+    with GraphWriterPool(OfflineConnection, workers=2, retry_delay=0) as pool:
+        pool.submit(write, last_output_id=9, context="batch 0")
+        with pytest.raises(GremlinServerError):
+            pool.join()
+
+
+def test_completed_output_id_is_contiguous():
+    release_first = threading.Event()
+    second_done = threading.Event()
+
+    def first(writer):
+        release_first.wait(timeout=5)
+
+    def second(writer):
+        second_done.set()
+
+    with GraphWriterPool(OfflineConnection, workers=2) as pool:
+        pool.submit(first, last_output_id=99)
+        pool.submit(second, last_output_id=199)
+
+        # the second batch finishing doesn't move past the unfinished first one
+        assert second_done.wait(timeout=5)
+        assert pool.pop_completed_output_id() is None
+
+        release_first.set()
+        pool.join()
+        assert pool.pop_completed_output_id() == 199
+        assert pool.pop_completed_output_id() is None
@@ -133,6 +133,60 @@ class MockDataProvider:
                     }
                 ]
             },
+            9: {
+                "hash": "000000008d9dc510f23c2657fc4f67bea30078cc05a90eb89e84cc475c080805",
+                "ver": 1,
+                "prev_block": "00000000408c48f847aa786c2268fc3e6ec2af68e8468a34a28c61b7f1de0dc6",
+                "mrkl_root": "0437cd7f8525ceed2324359c2d0ba26006d92d856a9c20fa0241106ee5a597c9",
+                "time": 1231473279,
+                "n_tx": 1,
+                "block_index": 9,
+                "main_chain": True,
+                "height": 9,
+                "tx": [
+                    {
+                        "hash": "0437cd7f8525ceed2324359c2d0ba26006d92d856a9c20fa0241106ee5a597c9",
+                        "ver": 1,
+                        "vin_sz": 1,
+                        "vout_sz": 1,
+                        "fee": 0,
+                        "lock_time": 0,
+                        "tx_index": 7092901136679432,
+                        "double_spend": False,
+                        "time": 1231473279,
+                        "block_index": 9,
+                        "block_height": 9,
+                        "inputs": [
+                            {
+                                "sequence": 4294967295,
+                                "witness": "",
+                                "index": 0,
+                                "prev_out": {
+                                    "n": 4294967295,
+                                    "script": "",
+                                    "spending_outpoints": [{"n": 0, "tx_index": 7092901136679432}],
+                                    "spent": True,
+                                    "tx_index": 0,
+                                    "type": 0,
+                                    "value": 0
+                                }
+                            }
+                        ],
+                        "out": [
+                            {
+                                "type": 0,
+                                "spent": True,
+                                "value": 5000000000,
+                                "spending_outpoints": [{"n": 0, "tx_index": 795787923367440}],
+                                "n": 0,
+                                "tx_index": 7092901136679432,
+                                "script": "410411db93e1dcdb8a016b49840f8c53bc1eb68a382e97b1482ecad7b148a6909a5cb2e0eaddfb84ccf9744464f82e160bfa9b8b64f9d4c03f999b8643f656b412a3ac",
+                                "addr": "12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S"
+                            }
+                        ]
+                    }
+                ]
+            },
             170: {
                 "hash": "00000000d1145790a8694403d4063f323d499e655c83426834d4ce2f8dd4a2ee",
                 "ver": 1,